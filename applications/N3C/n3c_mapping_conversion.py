@@ -12,6 +12,7 @@ import shutil
 import urllib3
 
 from datetime import datetime, timezone
+from omop2obo.utils import reads_mapping_results
 from tqdm import tqdm
 from typing import Dict
 
@@ -43,6 +44,21 @@ def url_download(url: str, write_location: str, filename: str) -> None:
     return None
 
 
+def reads_mapping_data(file_path: str, sheet_name: str) -> pd.DataFrame:
+    """Reads OMOP2OBO mappings from an Excel file or from the CSV, Parquet, or Feather results written by main.py
+    (i.e. with --output_format), including results partitioned by ontology (i.e. with --partition_onts). Parquet and
+    Feather files keep the column types and are much faster to read.
+    Args:
+        file_path: A string containing the filepath to the mapping file or directory of partitioned mapping files.
+        sheet_name: A string containing the name of the sheet to read from an Excel file.
+    Returns:
+        A Pandas DataFrame of OMOP2OBO mappings.
+    """
+
+    if file_path.endswith('.xlsx'): return pd.read_excel(file_path, sep=',', header=0, sheet_name=sheet_name)
+    else: return reads_mapping_results(file_path)
+
+
 def creates_mapping_dictionary(data: pd.DataFrame) -> Dict:
     """Function takes a Pandas DataFrame, extracts information needed to generate Atlas-formatted JSON files and
     outputs this information as a nested dictionary.
@@ -362,7 +378,7 @@ def main():
         if not os.path.exists(write_loc + file_name): url_download(url, write_loc, file_name)
         # read in the mapping data
         print('\t - Reading in mapping data from OMOP2OBO')
-        map_data = pd.read_excel(write_loc + file_name, sep=',', header=0, sheet_name="OMOP2OBO_HPO_Mapping_Results")
+        map_data = reads_mapping_data(write_loc + file_name, sheet_name="OMOP2OBO_HPO_Mapping_Results")
         map_filtered = map_data.fillna('None')
         map_filtered = map_filtered[map_filtered['MAPPING_CATEGORY'] != 'Unmapped']
 
@@ -9,56 +9,24 @@ import pandas as pd
 import pickle
 
 from datetime import date, datetime
-from typing import Tuple
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 
 from omop2obo import ConceptAnnotator, OntologyDownloader, OntologyInfoExtractor, SimilarStringFinder
-from omop2obo.utils import aggregates_mapping_results
+from omop2obo.utils import aggregates_mapping_results, PipelineRunner, writes_mapping_results
 
 
-@click.command()
-@click.option('--ont_file', type=click.Path(exists=True), required=True, default='resources/ontology_source_list.txt')
-@click.option('--tfidf_mapping', required=True, default='no')
-@click.option('--clinical_domain', required=True)
-@click.option('--merge', required=True, multiple=True, default='True or False - UMLS Expanded Merge')
-@click.option('--onts', required=True, multiple=True, default=['List'])
-@click.option('--clinical_data', type=click.Path(exists=True), required=True)
-@click.option('--primary_key', required=True, default='CONCEPT_ID')
-@click.option('--concept_codes', required=True, multiple=True, default=['CONCEPT_SOURCE_CODE'])
-@click.option('--concept_strings', multiple=True, default=['CONCEPT_LABEL', 'CONCEPT_SYNONYM'])
-@click.option('--ancestor_codes', multiple=True, default=['ANCESTOR_SOURCE_CODE'])
-@click.option('--ancestor_strings', multiple=True, default=['ANCESTOR_LABEL', 'ANCESTOR_SYNONYM'])
-@click.option('--outfile', required=True, default='./resources/mapping/OMOP2OBO_MAPPED_')
-def main(ont_file: str, tfidf_mapping: str, clinical_domain: str, onts: list, clinical_data: str, primary_key: str,
-         concept_codes: Tuple, concept_strings: Tuple, ancestor_codes: Tuple, ancestor_strings: Tuple,
-         merge: bool, outfile: str):
-    """The OMOP2OBO package provides functionality to assist with mapping OMOP standard clinical terminology concepts to
-    OBO terms. Successfully running this program requires several input parameters, which are specified below:
+def loads_ontology_data(ont_file: str, onts: List) -> Dict:
+    """Downloads and processes the ontologies in ont_file and returns the processed data of the ontologies in onts.
 
-    PARAMETERS:
+    Args:
+        ont_file: A string containing the path to the ontology source list.
+        onts: A list of ontology prefixes to map to.
 
-        ont_file: 'resources/oontology_source_list.txt'
-        tfidf_mapping: "yes" if want to perform cosine similarity mapping using a TF-IDF matrix.
-        clinical_domain: clinical domain of input data (i.e. "conditions", "drugs", or "measurements").
-        onts: A comma-separated list of ontology prefixes that matches 'resources/oontology_source_list.txt'.
-        clinical_data: The filepath to the clinical data needing mapping.
-        primary_key: The name of the file to use as the primary key.
-        concept_codes: A comma-separated list of concept-level codes to use for DbXRef mapping.
-        concept_strings: A comma-separated list of concept-level strings to map to use for exact string mapping.
-        ancestor_codes: A comma-separated list of ancestor-level codes to use for DbXRef mapping.
-        ancestor_strings: A comma-separated list of ancestor-level strings to map to use for exact string mapping.
-        merge: A bool specifying whether to merge UMLS SAB codes with OMOP source codes once or twice.
-            Merging once will only align OMOP source codes to UMLS SAB, twice with take the CUIs from the first merge
-            and merge them again with the full UMLS SAB set resulting in a larger set of matches. The default value
-            is True, which means that the merge will be performed twice.
-        outfile: The filepath for where to write output data to.
-
-    Several dependencies must be addressed before running this file. Please see the README for instructions.
+    Returns:
+        A nested dictionary containing the processed data of each ontology in onts.
     """
 
-    ######################
-    # PROCESS ONTOLOGIES #
-    ######################
-
     # download ontologies
     ont = OntologyDownloader(ont_file)
     ont.downloads_data_from_url()
@@ -75,54 +43,122 @@ def main(ont_file: str, tfidf_mapping: str, clinical_domain: str, onts: list, cl
         ont_data = pickle.load(handle)
     handle.close()
 
-    #########################
-    # PROCESS CLINICAL DATA #
-    ########################
+    return {k: v for k, v in ont_data.items() if k in onts}
 
-    date_today = '_' + datetime.strftime(datetime.strptime(str(date.today()), '%Y-%m-%d'), '%d%b%Y').upper()
+
+def maps_exact_concepts(ont_data: Dict, clinical_data: str, merge: bool, primary_key: str, concept_codes: Tuple,
+                        concept_strings: Tuple, ancestor_codes: Tuple, ancestor_strings: Tuple,
+                        umls_mrconso_file: Optional[str], umls_mrsty_file: Optional[str]) -> Tuple:
+    """Maps clinical concepts to ontology concepts using DbXRefs and exact string matching.
+
+    Args:
+        ont_data: A nested dictionary containing the processed data of each ontology.
+        clinical_data: A string containing the filepath to the clinical data needing mapping.
+        merge: A bool specifying whether to merge UMLS SAB codes with OMOP source codes once or twice.
+        primary_key: A string containing the name of the primary key column.
+        concept_codes: A tuple of concept-level code columns.
+        concept_strings: A tuple of concept-level string columns.
+        ancestor_codes: A tuple of ancestor-level code columns.
+        ancestor_strings: A tuple of ancestor-level string columns.
+        umls_mrconso_file: An optional string containing the filepath to the UMLS MRCONSO file.
+        umls_mrsty_file: An optional string containing the filepath to the UMLS MRSTY file.
+
+    Returns:
+        A tuple containing the exact mappings, the long-format mapping table, and the source code map.
+    """
 
     mapper = ConceptAnnotator(clinical_file=clinical_data,
-                              ontology_dictionary={k: v for k, v in ont_data.items() if k in onts},
+                              ontology_dictionary=ont_data,
                               umls_expand=merge,
                               primary_key=primary_key,
                               concept_codes=concept_codes,
                               concept_strings=concept_strings,
                               ancestor_codes=ancestor_codes,
                               ancestor_strings=ancestor_strings,
-                              umls_mrconso_file=glob.glob('resources/mappings/*MRCONSO*')[0]
-                              if len(glob.glob('resources/mappings/*MRCONSO*')) > 0 else None,
-                              umls_mrsty_file=glob.glob('resources/mappings/*MRSTY*')[0]
-                              if len(glob.glob('resources/mappings/*MRSTY*')) > 0 else None)
+                              umls_mrconso_file=umls_mrconso_file,
+                              umls_mrsty_file=umls_mrsty_file)
 
     mappings = mapper.clinical_concept_mapper()
 
+    return mappings, mapper.mapping_table, mapper.source_code_map
+
+
+def maps_similar_concepts(ont_data: Dict, clinical_data: str, primary_key: str, concept_strings: Tuple,
+                          workers: int, tfidf_model_dir: Optional[str], lsh_bands: Optional[int],
+                          min_idf: Optional[float], token_cache: Optional[str], hash_features: Optional[int],
+                          similarity_dir: Optional[str], similarity_format: str, similarity_engine: str,
+                          lsh_rows_per_band: int = 2) -> Tuple:
+    """Maps clinical concepts to ontology concepts using the cosine similarity of their TF-IDF vectors.
+
+    Args:
+        ont_data: A nested dictionary containing the processed data of each ontology.
+        clinical_data: A string containing the filepath to the clinical data needing mapping.
+        primary_key: A string containing the name of the primary key column.
+        concept_strings: A tuple of concept-level string columns.
+        workers: An integer specifying the number of workers to use when calculating cosine similarity.
+        tfidf_model_dir: An optional string containing a directory to save and re-use the ontology TF-IDF model in.
+        lsh_bands: An optional integer specifying the number of MinHash LSH bands to use.
+        min_idf: An optional float specifying the smallest inverse document frequency used to find candidates.
+        token_cache: An optional string containing a file to save and re-use pre-processed strings in.
+        hash_features: An optional integer specifying the number of hashed TF-IDF features.
+        similarity_dir: An optional string containing a directory to write the similarity scores to.
+        similarity_format: A string containing the file format to write similarity scores in.
+        similarity_engine: A string containing the n-grams to use for the similarity search.
+        lsh_rows_per_band: An integer specifying the number of MinHash values in each LSH band (default=2).
+
+    Returns:
+        A tuple containing the similarity mappings (i.e. the primary key and similarity columns) and the long-format
+            similarity scores. If similarity_dir is provided, the scores are only written to it, partitioned by
+            ontology, and both items are None. The similarity columns are then added by aggregates_mappings.
+    """
+
+    sim = SimilarStringFinder(clinical_file=clinical_data,
+                              ontology_dictionary=ont_data,
+                              primary_key=primary_key,
+                              concept_strings=concept_strings)
+
+    sim_mappings = sim.performs_similarity_search(workers, model_directory=tfidf_model_dir,
+                                                 lsh_bands=lsh_bands, min_idf=min_idf,
+                                                 token_cache_file=token_cache, n_features=hash_features,
+                                                 output_directory=similarity_dir, output_format=similarity_format,
+                                                 engine=similarity_engine, lsh_rows_per_band=lsh_rows_per_band)
+    if similarity_dir is not None: return None, None
+    sim_scores = sim.similarity_scores
+    sim_mappings = sim_mappings[[primary_key] + [x for x in sim_mappings.columns if 'SIM' in x]].drop_duplicates()
+
+    return sim_mappings, sim_scores
+
+
+def merges_mapping_results(exact_results: Tuple, similarity_results: Optional[Tuple] = None,
+                           clinical_domain: str = '', primary_key: str = 'CONCEPT_ID') -> Tuple:
+    """Merges the exact and similarity mappings and expands lab results with multiple result types.
+
+    Args:
+        exact_results: A tuple containing the output of maps_exact_concepts.
+        similarity_results: An optional tuple containing the output of maps_similar_concepts (default=None).
+        clinical_domain: A string containing the clinical domain of the input data (e.g. "LABS").
+        primary_key: A string containing the name of the primary key column.
+
+    Returns:
+        A tuple containing the merged and expanded mappings and the long-format mapping table.
+    """
+
+    mappings, mapping_table = exact_results[0], exact_results[1]
+
     # get column names -- used later to organize output
     start_cols = [i for i in mappings.columns if not any(j for j in ['STR', 'DBXREF', 'EVIDENCE'] if j in i)]
     exact_cols = [i for i in mappings.columns if i not in start_cols]
 
-    print('\nSaving Results: {}'.format('Exact Match'))
-    mappings.to_csv(outfile + clinical_domain.upper() + date_today + '.csv', sep=',', index=False, header=True)
-
-    # STEP 4: TF-IDF SIMILARITY MAPPING
-    # searches top 10 highest results and currently keeps the top 75th percentile among scores >=0.25
-    if tfidf_mapping is not None:
-        sim = SimilarStringFinder(clinical_file=clinical_data,
-                                  ontology_dictionary={k: v for k, v in ont_data.items() if k in onts},
-                                  primary_key=primary_key,
-                                  concept_strings=concept_strings)
-
-        sim_mappings = sim.performs_similarity_search()
+    if similarity_results is not None and similarity_results[0] is not None:
+        sim_mappings, sim_scores = similarity_results
+        mapping_table = pd.concat([mapping_table, sim_scores], ignore_index=True)
         # get column names -- used later to organize output
-        sim_mappings = sim_mappings[[primary_key] + [x for x in sim_mappings.columns if 'SIM' in x]].drop_duplicates()
         sim_cols = [i for i in sim_mappings.columns if not any(j for j in start_cols if j in i)]
 
         # merge dbXref, exact string, and TF-IDF similarity results
         merged_scores = pd.merge(mappings, sim_mappings, how='left', on=primary_key)
         mappings = merged_scores[start_cols + exact_cols + sim_cols]
 
-        print('\nSaving Results: {}'.format('TF-IDF Cosine Similarity'))
-        mappings.to_csv(outfile + clinical_domain.upper() + date_today + '.csv', sep=',', index=False, header=True)
-
     # clean up output
     if clinical_domain == 'LABS':
         result_type_idx, updated_data = list(mappings.columns).index('RESULT_TYPE'), []
@@ -141,8 +177,181 @@ def main(ont_file: str, tfidf_mapping: str, clinical_domain: str, onts: list, cl
         data_expanded = mappings.copy()
     data_expanded.fillna('', inplace=True)
 
-    updated_maps = aggregates_mapping_results(data_expanded, onts, ont_data, mapper.source_code_map, 0.25)
-    updated_maps.to_csv(outfile + clinical_domain.upper() + date_today + '.csv', sep=',', index=False, header=True)
+    return data_expanded, mapping_table
+
+
+def aggregates_mappings(merged_results: Tuple, exact_results: Tuple, ont_data: Dict, onts: List, workers: int,
+                        primary_key: str, size_limit: Optional[int] = 32500, similarity_dir: Optional[str] = None,
+                        similarity_format: str = 'csv') -> pd.DataFrame:
+    """Aggregates the merged mappings into one mapping per clinical concept and ontology.
+
+    Args:
+        merged_results: A tuple containing the output of merges_mapping_results.
+        exact_results: A tuple containing the output of maps_exact_concepts.
+        ont_data: A nested dictionary containing the processed data of each ontology.
+        onts: A list of ontology prefixes to map to.
+        workers: An integer specifying the number of workers to use when aggregating mapping results.
+        primary_key: A string containing the name of the primary key column.
+        size_limit: An optional integer specifying the maximum length of text fields (default=32500).
+        similarity_dir: An optional string containing a directory the similarity scores were written to, which is
+            aggregated and added to the similarity columns one part file at a time (default=None).
+        similarity_format: A string containing the file format of the similarity scores (default="csv").
+
+    Returns:
+        A Pandas DataFrame containing the aggregated mappings.
+    """
+
+    data_expanded, mapping_table = merged_results
+
+    return aggregates_mapping_results(data_expanded, onts, ont_data, exact_results[2], 0.25, workers, mapping_table,
+                                      primary_key, size_limit, similarity_dir, similarity_format)
+
+
+@click.command()
+@click.option('--ont_file', type=click.Path(exists=True), required=True, default='resources/ontology_source_list.txt')
+@click.option('--tfidf_mapping', required=True, default='no')
+@click.option('--clinical_domain', required=True)
+@click.option('--merge', required=True, multiple=True, default='True or False - UMLS Expanded Merge')
+@click.option('--onts', required=True, multiple=True, default=['List'])
+@click.option('--clinical_data', type=click.Path(exists=True), required=True)
+@click.option('--primary_key', required=True, default='CONCEPT_ID')
+@click.option('--concept_codes', required=True, multiple=True, default=['CONCEPT_SOURCE_CODE'])
+@click.option('--concept_strings', multiple=True, default=['CONCEPT_LABEL', 'CONCEPT_SYNONYM'])
+@click.option('--ancestor_codes', multiple=True, default=['ANCESTOR_SOURCE_CODE'])
+@click.option('--ancestor_strings', multiple=True, default=['ANCESTOR_LABEL', 'ANCESTOR_SYNONYM'])
+@click.option('--outfile', required=True, default='./resources/mapping/OMOP2OBO_MAPPED_')
+@click.option('--workers', type=int, default=1)
+@click.option('--tfidf_model_dir', default=None)
+@click.option('--lsh_bands', type=int, default=None)
+@click.option('--lsh_rows_per_band', type=int, default=2)
+@click.option('--min_idf', type=float, default=None)
+@click.option('--token_cache', default=None)
+@click.option('--hash_features', type=int, default=None)
+@click.option('--similarity_dir', default=None)
+@click.option('--similarity_format', type=click.Choice(['csv', 'parquet']), default='csv')
+@click.option('--similarity_engine', type=click.Choice(['word', 'char']), default='word')
+@click.option('--checkpoint_dir', default=None)
+@click.option('--output_format', type=click.Choice(['csv', 'parquet', 'feather']), default='csv')
+@click.option('--output_compression', default=None)
+@click.option('--partition_onts', is_flag=True, default=False)
+def main(ont_file: str, tfidf_mapping: str, clinical_domain: str, onts: list, clinical_data: str, primary_key: str,
+         concept_codes: Tuple, concept_strings: Tuple, ancestor_codes: Tuple, ancestor_strings: Tuple,
+         merge: bool, outfile: str, workers: int, tfidf_model_dir: str, lsh_bands: int, lsh_rows_per_band: int,
+         min_idf: float, token_cache: str, hash_features: int, similarity_dir: str, similarity_format: str,
+         similarity_engine: str, checkpoint_dir: str, output_format: str, output_compression: str,
+         partition_onts: bool):
+    """The OMOP2OBO package provides functionality to assist with mapping OMOP standard clinical terminology concepts to
+    OBO terms. Successfully running this program requires several input parameters, which are specified below:
+
+    PARAMETERS:
+
+        ont_file: 'resources/oontology_source_list.txt'
+        tfidf_mapping: "yes" if want to perform cosine similarity mapping using a TF-IDF matrix.
+        clinical_domain: clinical domain of input data (i.e. "conditions", "drugs", or "measurements").
+        onts: A comma-separated list of ontology prefixes that matches 'resources/oontology_source_list.txt'.
+        clinical_data: The filepath to the clinical data needing mapping.
+        primary_key: The name of the file to use as the primary key.
+        concept_codes: A comma-separated list of concept-level codes to use for DbXRef mapping.
+        concept_strings: A comma-separated list of concept-level strings to map to use for exact string mapping.
+        ancestor_codes: A comma-separated list of ancestor-level codes to use for DbXRef mapping.
+        ancestor_strings: A comma-separated list of ancestor-level strings to map to use for exact string mapping.
+        merge: A bool specifying whether to merge UMLS SAB codes with OMOP source codes once or twice.
+            Merging once will only align OMOP source codes to UMLS SAB, twice with take the CUIs from the first merge
+            and merge them again with the full UMLS SAB set resulting in a larger set of matches. The default value
+            is True, which means that the merge will be performed twice.
+        outfile: The filepath for where to write output data to.
+        workers: The number of workers to use when calculating cosine similarity and aggregating mapping results
+            (default=1).
+        tfidf_model_dir: A directory to save and re-use the ontology TF-IDF model in, so that it is only fit once per
+            ontology release (default=None).
+        lsh_bands: The number of MinHash LSH bands to use for an approximate TF-IDF similarity search of very large
+            ontologies, where more bands increase recall and run time (default=None, exact search).
+        lsh_rows_per_band: The number of MinHash values in each LSH band, where fewer rows per band increase recall and
+            run time (default=2).
+        min_idf: The smallest inverse document frequency an n-gram needs to be used to find candidate ontology strings
+            during the TF-IDF similarity search (default=None, all n-grams).
+        token_cache: A file to save and re-use pre-processed clinical and ontology strings in, so that each string is
+            only pre-processed once across runs (default=None).
+        hash_features: The number of hashed TF-IDF features to use instead of a TF-IDF vocabulary, which keeps memory
+            use fixed for very large ontologies (default=None, one feature per n-gram).
+        similarity_dir: A directory to write the TF-IDF similarity scores to, partitioned by ontology, as they are
+            produced instead of keeping them in memory. The scores are then aggregated and added to the output one part
+            file at a time, which gives the same output as keeping them in memory (default=None).
+        similarity_format: The file format to write similarity scores in, "csv" or "parquet" (default="csv").
+        similarity_engine: The n-grams to use for the TF-IDF similarity search, "word" for word n-grams or "char" for
+            character trigrams, which also match misspelled and abbreviated strings (default="word").
+        checkpoint_dir: A directory to checkpoint the output of each pipeline stage in, so that a re-run resumes from
+            the last stage whose inputs have not changed (default=None). DataFrames are checkpointed as Parquet files
+            when pyarrow is installed and the ontology data is keyed by the content of the downloaded ontology files.
+        output_format: The file format to write the mapping results in, "csv", "parquet", or "feather", where Parquet
+            and Feather files keep the column types and are much smaller and faster to read (default="csv").
+        output_compression: The compression codec to use when writing the mapping results (e.g. "gzip" for CSV files
+            or "zstd" for Parquet and Feather files; default=None, no compression for CSV files and the default codec
+            for Parquet and Feather files).
+        partition_onts: A flag specifying whether to write the mapping results of each ontology to its own file in a
+            directory named after the outfile (default=False).
+
+    Several dependencies must be addressed before running this file. Please see the README for instructions.
+    """
+
+    date_today = '_' + datetime.strftime(datetime.strptime(str(date.today()), '%Y-%m-%d'), '%d%b%Y').upper()
+    umls_files = [glob.glob('resources/mappings/*{}*'.format(x)) for x in ['MRCONSO', 'MRSTY']]
+    umls_mrconso_file, umls_mrsty_file = [x[0] if len(x) > 0 else None for x in umls_files]
+
+    # STEPS 1-5: each stage is checkpointed and the exact and TF-IDF mapping stages, which only share the ontology
+    # data, run at the same time in separate processes
+    # the ontology data is keyed by the content of the ontology files that have already been downloaded, which are
+    # used instead of downloading them again
+    ont_files = sorted(glob.glob('resources/ontologies/*_without_imports.owl'))
+    pipeline = PipelineRunner(checkpoint_dir)
+    pipeline.adds_stage('ontologies', partial(loads_ontology_data, ont_file, list(onts)),
+                        inputs=[ont_file, list(onts)] + ont_files)
+    pipeline.adds_stage('exact_mapping', partial(maps_exact_concepts, clinical_data=clinical_data, merge=merge,
+                                                 primary_key=primary_key, concept_codes=concept_codes,
+                                                 concept_strings=concept_strings, ancestor_codes=ancestor_codes,
+                                                 ancestor_strings=ancestor_strings,
+                                                 umls_mrconso_file=umls_mrconso_file, umls_mrsty_file=umls_mrsty_file),
+                        depends_on=['ontologies'], process=True,
+                        inputs=[clinical_data, merge, primary_key, concept_codes, concept_strings, ancestor_codes,
+                                ancestor_strings, umls_mrconso_file, umls_mrsty_file])
+    mapping_stages = ['exact_mapping']
+    # searches top 10 highest results and currently keeps the top 75th percentile among scores >=0.25
+    if tfidf_mapping is not None:
+        pipeline.adds_stage('similarity_mapping', partial(maps_similar_concepts, clinical_data=clinical_data,
+                                                          primary_key=primary_key, concept_strings=concept_strings,
+                                                          workers=workers, tfidf_model_dir=tfidf_model_dir,
+                                                          lsh_bands=lsh_bands, min_idf=min_idf, token_cache=token_cache,
+                                                          hash_features=hash_features, similarity_dir=similarity_dir,
+                                                          similarity_format=similarity_format,
+                                                          similarity_engine=similarity_engine,
+                                                          lsh_rows_per_band=lsh_rows_per_band),
+                            depends_on=['ontologies'], process=True,
+                            inputs=[clinical_data, primary_key, concept_strings, lsh_bands, lsh_rows_per_band, min_idf,
+                                    hash_features, similarity_engine, similarity_dir, similarity_format])
+        mapping_stages.append('similarity_mapping')
+    pipeline.adds_stage('merged_mapping', partial(merges_mapping_results, clinical_domain=clinical_domain,
+                                                  primary_key=primary_key),
+                        depends_on=mapping_stages, inputs=[clinical_domain, primary_key])
+    # text fields are only shortened for CSV files, which may be opened in Excel, and similarity scores written to
+    # similarity_dir are aggregated one part file at a time instead of being merged
+    size_limit = 32500 if output_format == 'csv' else None
+    sim_dir = similarity_dir if tfidf_mapping is not None else None
+    pipeline.adds_stage('aggregated_mapping', partial(aggregates_mappings, onts=list(onts), workers=workers,
+                                                      primary_key=primary_key, size_limit=size_limit,
+                                                      similarity_dir=sim_dir, similarity_format=similarity_format),
+                        depends_on=['merged_mapping', 'exact_mapping', 'ontologies'],
+                        inputs=[list(onts), primary_key, size_limit, sim_dir, similarity_format])
+    updated_maps = pipeline.runs(['aggregated_mapping'])['aggregated_mapping']
+
+    print('\nSaving Results: {}'.format('Aggregated Mappings'))
+    if partition_onts:
+        output_file = outfile + clinical_domain.upper() + date_today
+    else:
+        suffix = {'gzip': '.gz', 'bz2': '.bz2', 'zip': '.zip', 'xz': '.xz'} if output_format == 'csv' else {}
+        output_file = outfile + clinical_domain.upper() + date_today + '.' + output_format + \
+            suffix.get(output_compression, '')
+    writes_mapping_results(updated_maps, output_file, output_format, output_compression,
+                           list(onts) if partition_onts else None)
 
 
 if __name__ == '__main__':
@@ -3,6 +3,7 @@
 
 
 # import needed libraries
+import numpy as np  # type: ignore
 import os
 import pandas as pd  # type: ignore
 
@@ -39,6 +40,8 @@ class ConceptAnnotator(object):
             Merging once will only align OMOP source codes to UMLS SAB, twice with take the CUIs from the first merge
             and merge them again with the full UMLS SAB set resulting in a larger set of matches. The default value
             is True, which means that the merge will be performed twice.
+        mapping_table: A long-format Pandas DataFrame containing one row per dbxref and exact string mapping result,
+            which is populated by the clinical_concept_mapper method.
 
     Raises:
         TypeError:
@@ -65,6 +68,7 @@ class ConceptAnnotator(object):
         print('*** Setting up Environment')
 
         self.umls_double_merge: bool = umls_expand
+        self.mapping_table: pd.DataFrame = pd.DataFrame()
 
         # vocabulary source code mapping -- not tested in testing file
         source_code = 'resources/mappings/source_code_vocab_map.csv' if source_codes is None else source_codes
@@ -327,6 +331,41 @@ class ConceptAnnotator(object):
 
         return pd.concat(ont_dfs).drop_duplicates()
 
+    @staticmethod
+    def tidies_mapping_results(data: pd.DataFrame, primary_key: str, code_type: str, source: str) -> pd.DataFrame:
+        """Takes a stacked Pandas DataFrame of dbxref or exact string mapping results and converts it into the
+        long-format mapping table, which contains one row per concept, level, mapping source, ontology, and uri.
+
+            INPUT:
+                    CONCEPT_ID  CONCEPT_DBXREF_ONT_URI  CONCEPT_DBXREF_ONT_TYPE  ...  CONCEPT_DBXREF_ONT_EVIDENCE
+                0       442264                     URL                    MONDO  ...     CONCEPT_DBXREF_sctid:...
+
+            OUTPUT:
+                    CONCEPT_ID    LEVEL  SOURCE    ONT  ONT_URI    ONT_LABEL                  EVIDENCE  SCORE
+                0       442264  CONCEPT  DBXREF  MONDO      URL  ear disease  CONCEPT_DBXREF_sctid:...    NaN
+
+        Args:
+            data: A stacked Pandas DataFrame containing output from the dbxref_mapper or exact_string_mapper methods
+                (see INPUT above).
+            primary_key: A string containing the name of the primary key (i.e. CONCEPT_ID).
+            code_type: A string containing the concept_level (i.e. concept or ancestor).
+            source: A string containing the mapping source (i.e. "DBXREF" or "STR").
+
+        Returns:
+            A long-format Pandas DataFrame of mapping results (see OUTPUT above).
+        """
+
+        col_lab = code_type.upper() + '_' + source + '_ONT_'
+        mapping_table = pd.DataFrame({primary_key: data[primary_key].to_numpy(),
+                                      'LEVEL': code_type.upper(), 'SOURCE': source,
+                                      'ONT': data[col_lab + 'TYPE'].to_numpy(),
+                                      'ONT_URI': data[col_lab + 'URI'].to_numpy(),
+                                      'ONT_LABEL': data[col_lab + 'LABEL'].to_numpy(),
+                                      'EVIDENCE': data[col_lab + 'EVIDENCE'].to_numpy(),
+                                      'SCORE': np.full(len(data), np.nan, dtype=np.float32)})
+
+        return mapping_table
+
     def clinical_concept_mapper(self) -> pd.DataFrame:
         """This method serves as the main method for this class. it's purpose is to iterate over all relevant data in
         an input clinical data file and generate several different kinds of mappings to a ontologies provided in an
@@ -338,12 +377,15 @@ class ConceptAnnotator(object):
             4 - Aggregating the results from steps 1-3 into a single Pandas DataFrame
             5 - Combine results from each level into single Pandas DataFrame
 
+        The dbXRef and exact string mapping results are also stored in long format in the mapping_table attribute,
+        which can be passed to aggregates_mapping_results instead of the pipe-delimited mapping columns.
+
         Returns:
             complete_map: A Pandas DataFrame containing the results of performing dbXRef and exact string mapping to
                 the input ontologies and clinical data.
         """
 
-        level_maps = []
+        level_maps, mapping_tables = [], []
 
         if self.ancestor_codes is not None:
             levels = {'concept': {'codes': self.concept_codes, 'strings': self.concept_strings},
@@ -391,21 +433,11 @@ class ConceptAnnotator(object):
 
             # STEP 4 - COMBINE RESULTS
             print('Aggregating Mapping Results')
-            # dbXRef annotations
-            if len(stacked_dbxref) != 0:
-                ont_type_column = [col for col in stacked_dbxref.columns if 'TYPE' in col][0]
-                dbxrefs = data_frame_grouper(stacked_dbxref.copy(), primary_key, ont_type_column,
-                                             aggregates_column_values)
-            else:
-                dbxrefs = None
-
-            # exact string annotations
-            if len(stacked_strings) != 0:
-                ont_type_column = [col for col in stacked_strings.columns if 'TYPE' in col][0]
-                strings = data_frame_grouper(stacked_strings.copy(), primary_key, ont_type_column,
-                                             aggregates_column_values)
-            else:
-                strings = None
+            # dbXRef and exact string annotations
+            level_table = pd.concat([self.tidies_mapping_results(stacked_dbxref, primary_key, level, 'DBXREF'),
+                                     self.tidies_mapping_results(stacked_strings, primary_key, level, 'STR')])
+            mapping_tables.append(level_table)
+            maps = renders_mapping_table(level_table, primary_key) if len(level_table) != 0 else None
 
             # umls annotations
             if umls_map is not None:
@@ -416,7 +448,7 @@ class ConceptAnnotator(object):
                 umls = None
 
             # combine annotations
-            dfs = [x for x in [dbxrefs, strings, umls] if x is not None]
+            dfs = [x for x in [maps, umls] if x is not None]
             if len(dfs) > 1:
                 level_maps.append(reduce(lambda x, y: pd.merge(x, y, how='outer', on=primary_key), dfs))
             else:
@@ -424,6 +456,7 @@ class ConceptAnnotator(object):
 
         # STEP 5 - COMBINE CONCEPT AND ANCESTOR DATA
         print('Combining Concept and Ancestor Maps')
+        self.mapping_table = pd.concat(mapping_tables).reset_index(drop=True)
         full_map = reduce(lambda x, y: pd.merge(x, y, how='outer', on=self.primary_key), level_maps)
         complete_map = pd.merge(self.clinical_data, full_map, how='left', on=self.primary_key)
         complete_map.columns = [x.upper() for x in complete_map.columns]
@@ -4,23 +4,28 @@
 
 # import needed libraries
 import hashlib
+import multiprocessing
 import os
 import numpy as np  # type: ignore
 import pandas as pd  # type: ignore
+import pickle
 import re
 
-from functools import reduce
+from functools import lru_cache, partial
+from more_itertools import unique_everseen
 # from nltk.corpus import stopwords  # type: ignore
 from nltk.stem import WordNetLemmatizer  # type: ignore
-from nltk.tokenize import RegexpTokenizer  # type: ignore
 from pandas import errors
 from scipy import sparse  # type: ignore
-from sklearn.feature_extraction.text import TfidfVectorizer  # type: ignore
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer  # type: ignore
 from sklearn.metrics.pairwise import linear_kernel  # type: ignore
+from sklearn.pipeline import make_pipeline, Pipeline  # type: ignore
 from tqdm import tqdm  # type: ignore
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
-from omop2obo.utils import column_splitter, data_frame_subsetter, merge_dictionaries
+from omop2obo.utils import clears_partitioned_data, column_splitter, data_frame_subsetter, \
+    finds_approximate_similarities, merge_dictionaries, reads_partitioned_data, streams_top_similarities, TokenCache, \
+    writes_partitioned_data
 
 # TODO: Update script so all ontologies in the ont list (i.e. ontology_dictionary keys) are processed in parallel.
 
@@ -43,6 +48,137 @@ stopwords = ['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you',
              'wouldn', "wouldn't"]
 
 
+# compile the tokenizer, stopwords, and lemmatizer once
+token_pattern = re.compile(r"\w+")
+stopword_set = frozenset(stopwords)
+lemmatizer = WordNetLemmatizer()
+
+# namespace for cached pre-processed strings -- update the version when the pre-processing steps change
+preprocessing_version = hashlib.md5(bytes(repr(('1', token_pattern.pattern, sorted(stopword_set),
+                                                type(lemmatizer).__name__)), 'utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _lemmatizes_token(token: str) -> str:
+    """Lemmatizes a token. Results are cached, so each distinct token is only passed to WordNet once.
+
+    Args:
+        token: A lowercase string token.
+
+    Returns:
+        A string containing the lemmatized token.
+    """
+
+    return str(lemmatizer.lemmatize(token))
+
+
+def _preprocesses_string(string: str) -> List:
+    """Performs several text preprocessing steps on a string: (1) non-ASCII characters are removed, (2) the string is
+    tokenized on word characters, (3) stopwords are removed and each token is lowercased, and (4) each token is
+    lemmatized. Stopwords are matched before lowercasing, so capitalized stopwords (e.g. "A") are kept.
+
+    Args:
+        string: A raw string.
+
+    Returns:
+        A list of processed tokens.
+    """
+
+    tokens = token_pattern.findall(string.encode('ascii', 'ignore').decode())
+
+    return [_lemmatizes_token(x.lower()) for x in tokens if x not in stopword_set]
+
+
+def _preprocesses_strings(strings: List, n_jobs: int = 1) -> List:
+    """Pre-processes a list of strings (see _preprocesses_string), optionally using a pool of worker processes.
+
+    Args:
+        strings: A list of raw strings.
+        n_jobs: An integer specifying the number of worker processes to use (default=1).
+
+    Returns:
+        A list containing a list of processed tokens for each string in strings.
+    """
+
+    if n_jobs > 1 and len(strings) > 1:
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            processed = pool.map(_preprocesses_string, strings, chunksize=max(1, len(strings) // (n_jobs * 4)))
+        finally:
+            pool.close(); pool.join()
+    else:
+        processed = [_preprocesses_string(x) for x in strings]
+
+    return processed
+
+
+def _splits_corpus_identifiers(identifiers: List, ont_type: List) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the prefix and the key of each corpus identifier. The key is the identifier prefix (e.g. a clinical
+    primary key) or, for ontology identifiers, the first two parts of the identifier (e.g. "HP_0000001" for
+    "HP_0000001_<hash>").
+
+    Args:
+        identifiers: A list of corpus identifiers.
+        ont_type: A list of strings specifying the ontology types (e.g. "HP", "MONDO").
+
+    Returns:
+        A tuple of two object arrays containing the prefix and the key of each identifier.
+    """
+
+    onts = set(ont_type)
+    prefixes = [x.partition('_')[0] for x in identifiers]
+    keys = ['_'.join(x.split('_', 2)[0:2]) if y in onts else y for x, y in zip(identifiers, prefixes)]
+
+    return np.array(prefixes, dtype=object), np.array(keys, dtype=object)
+
+
+def _groups_rows(codes: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Groups row positions by an array of integer codes (e.g. from pd.factorize) in CSR format, so the positions of
+    the rows with code i are order[offsets[i]:offsets[i + 1]].
+
+    Args:
+        codes: An array containing an integer code between 0 and n_groups - 1 for each row.
+        n_groups: An integer specifying the number of codes.
+
+    Returns:
+        A tuple containing: (1) an array of row positions sorted by code and then by position and (2) an array of
+            n_groups + 1 offsets into (1).
+    """
+
+    order = np.argsort(codes, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n_groups))])
+
+    return order, offsets
+
+
+def _returns_tokens(tokens: List) -> List:
+    """Returns pre-processed tokens unchanged. It is used as the TfidfVectorizer tokenizer and preprocessor, instead
+    of a lambda, so that fitted vectorizers can be pickled.
+
+    Args:
+        tokens: A list of pre-processed tokens.
+
+    Returns:
+        tokens: The input list of tokens.
+    """
+
+    return tokens
+
+
+def _joins_tokens(tokens: List) -> str:
+    """Joins pre-processed tokens back into one string. It is used as the preprocessor of the character n-gram
+    vectorizer, instead of a lambda, so that fitted vectorizers can be pickled.
+
+    Args:
+        tokens: A list of pre-processed tokens.
+
+    Returns:
+        A string containing the tokens separated by spaces.
+    """
+
+    return ' '.join(tokens)
+
+
 class SimilarStringFinder(object):
     """This class is designed to facilitate the mapping of clinical concepts from the Observational Medical Outcomes
     Partnership to Open Biomedical Ontology concepts. To suggest labels, we leverage clinical labels and synonyms as
@@ -62,6 +198,11 @@ class SimilarStringFinder(object):
         concept_strings: A list of column names containing concept-level labels and synonyms (optional).
         matrix: A Scipy sparse matrix containing the TF-IDF results for all clinical data (i.e. labels and synonyms)
             and ontology data (i.e. labels, definitions, and synonyms).
+        token_cache: A TokenCache object storing the pre-processed clinical and ontology strings.
+        similarity_scores: A long-format Pandas DataFrame containing one row per filtered similarity match, with the
+            primary key, level, source (i.e. "SIM"), ontology type, ontology uri, ontology label, and a float32
+            similarity score. It has the same columns as the ConceptAnnotator mapping_table. It is empty when the
+            scores are written to an output directory (see scores_tfidf).
 
     Raises:
         TypeError:
@@ -76,6 +217,8 @@ class SimilarStringFinder(object):
     def __init__(self, clinical_file: str, ontology_dictionary: Dict, primary_key: str, concept_strings: Tuple) -> None:
 
         self.matrix: sparse.csr_matrix = sparse.csr_matrix(0, dtype=np.int8)
+        self.similarity_scores: pd.DataFrame = pd.DataFrame()
+        self.token_cache: TokenCache = TokenCache(namespace=preprocessing_version)
 
         # clinical_file
         if not isinstance(clinical_file, str):
@@ -114,28 +257,31 @@ class SimilarStringFinder(object):
             self.ont_dict: Dict = ontology_dictionary
 
     @staticmethod
-    def text_preprocessor(data: pd.DataFrame, primary_key: str) -> List:
+    def text_preprocessor(data: pd.DataFrame, primary_key: str, token_cache: Optional[TokenCache] = None,
+                          n_jobs: int = 1) -> List:
         """Takes a Pandas DataFrame as input and performs several text preprocessing steps on one of the input columns.
+        Each distinct string is only pre-processed once and the results are looked up in token_cache, so strings that
+        were processed before (e.g. in an earlier ontology or run) are not pre-processed again.
 
         Args:
             data: A Pandas DataFrame containing two columns: (1) primary_key and (2) the column containing text to
                 perform preprocessing on.
             primary_key: A string containing the name of the column to use as a primary key.
+            token_cache: An optional TokenCache object storing pre-processed strings. If None, strings are only
+                de-duplicated within data (default=None).
+            n_jobs: An integer specifying the number of worker processes to use when pre-processing strings
+                (default=1).
 
         Returns:
             data_corpus: A list of tuples, where each tuple contains an identifier and a string process.
         """
 
         col = [x for x in data.columns if x != primary_key][0]  # get text to perform preprocessing on
-        # stop_word_patterns = re.compile(r'\b(' + r'|'.join(stopwords.words('english')) + r')\b\s*')
-        stop_word_patterns = re.compile(r'\b(' + r'|'.join(stopwords) + r')\b\s*')
-        lemmatizer = WordNetLemmatizer()
+        token_cache = TokenCache(namespace=preprocessing_version) if token_cache is None else token_cache
 
         # process data
-        data['CODE_PROC'] = data[col].apply(lambda x: re.sub(r"\s+", " ", str(x.encode('ascii', 'ignore').decode())))
-        data['CODE_PROC'] = data['CODE_PROC'].apply(lambda x: stop_word_patterns.sub('', x).lower())
-        data['CODE_PROC'] = data['CODE_PROC'].apply(lambda x: RegexpTokenizer(r"\w+").tokenize(x))
-        data['CODE_PROC'] = data['CODE_PROC'].apply(lambda x: [str(lemmatizer.lemmatize(i)) for i in x])
+        tokens = token_cache.processes(list(data[col]), partial(_preprocesses_strings, n_jobs=n_jobs))
+        data['CODE_PROC'] = pd.Series(tokens, index=data.index)
 
         # split column and update identifier to be primary_key_hash(string)
         hashed_str = data['CODE_PROC'].apply(lambda x: hashlib.md5(bytes(' '.join(x), 'utf-8')).hexdigest())
@@ -162,18 +308,19 @@ class SimilarStringFinder(object):
                 (2) corpus_enum: keys are row identifiers and values are indices of the row identifiers in the corpus.
         """
 
+        identifiers = np.array([x[0] for x in corpus], dtype=object)
+        id_codes, ids = pd.factorize(identifiers)
+        key_codes, keys = pd.factorize(_splits_corpus_identifiers(ids.tolist(), ont_type)[1][id_codes])
+
         # convert corpus to dictionary for faster look-up of clinical keys
-        corpus_idx: Dict = {}
-        for x in corpus:
-            key = x[0].split('_')[0] if x[0].split('_')[0] not in ont_type else '_'.join(x[0].split('_')[0:2])
-            if key in corpus_idx.keys(): corpus_idx[key].append(x[0])
-            else: corpus_idx[key] = [x[0]]
+        order, offsets = _groups_rows(key_codes, len(keys))
+        grouped, bounds = identifiers[order].tolist(), offsets.tolist()
+        corpus_idx = {k: grouped[bounds[i]:bounds[i + 1]] for i, k in enumerate(keys.tolist())}
 
         # create dict with id as key and index as value
-        corpus_enum: Dict = {}
-        for x, y in enumerate(corpus):
-            if y[0] in corpus_enum.keys(): corpus_enum[y[0]].append(x)
-            else: corpus_enum[y[0]] = [x]
+        order, offsets = _groups_rows(id_codes, len(ids))
+        grouped, bounds = order.tolist(), offsets.tolist()
+        corpus_enum = {k: grouped[bounds[i]:bounds[i + 1]] for i, k in enumerate(ids.tolist())}
 
         return corpus_idx, corpus_enum
 
@@ -188,18 +335,19 @@ class SimilarStringFinder(object):
             threshold: An integer specifying a percentile for deriving a threshold cut-off.
 
         Returns:
-            final_matches: A list of the filtered matches (e.g. [[1.0, 'HP_0012384'], [0.7654, 'HP_00123678']]).
+            final_matches: A list of the filtered matches (e.g. [['1.0', 'HP_0012384'], ['0.765', 'HP_00123678']]).
         """
 
-        # filter matches to reduce duplicate results
-        filtered_matches: List = []
-        for x, y in sorted(matches, reverse=True):
-            if not any(i for i in filtered_matches if y in i):
-                filtered_matches.append([x, y])
+        # filter matches to reduce duplicate results -- keeps the best score for each uri
+        best_matches: Dict = {}
+        for x, y in matches:
+            if y not in best_matches or x > best_matches[y]: best_matches[y] = x
+        filtered_matches = sorted([[x, y] for y, x in best_matches.items()], reverse=True)
 
         # derive threshold cut-off to reduce match list
-        score_threshold = np.percentile([x[0] for x in filtered_matches], threshold)
-        final_matches = [[str(round(x[0], 3)), x[1]] for x in filtered_matches if x[0] >= score_threshold]
+        scores = np.array([x[0] for x in filtered_matches])
+        keep = scores >= np.percentile(scores, threshold)
+        final_matches = [[str(round(x[0], 3)), x[1]] for x, k in zip(filtered_matches, keep) if k]
 
         return final_matches
 
@@ -222,25 +370,55 @@ class SimilarStringFinder(object):
 
         var_vector = self.matrix[var_idx:var_idx + 1]
         cosine_similarities = linear_kernel(var_vector, ontology_matrix).flatten()
-        rel_var_indices = cosine_similarities.argsort()[::-1]
-        similar_variables = [(variable, cosine_similarities[variable]) for variable in rel_var_indices][0:top_n]
+        top_n = max(min(top_n, len(cosine_similarities)), 0)
+        top_idx = np.argpartition(-cosine_similarities, top_n - 1)[:top_n] if top_n > 0 else np.array([], dtype=int)
+        rel_var_indices = top_idx[np.lexsort((top_idx, -cosine_similarities[top_idx]))]
+        similar_variables = [(variable, cosine_similarities[variable]) for variable in rel_var_indices]
 
         return similar_variables
 
-    def scores_tfidf(self, corpus: List, ontology_type: List, top_n: int, threshold: int) -> pd.DataFrame:
-        """The function iterates over the corpus and returns the top_n (as specified by user) most similar variables,
-        by cosine similarity score, which are filtered to only include the top x% most similar matches.
+    def scores_tfidf(self, corpus: List, ontology_type: List, top_n: int, threshold: int, n_jobs: int = 1,
+                     block_size: int = 100, lsh_bands: Optional[int] = None, min_idf: Optional[float] = None,
+                     output_directory: Optional[str] = None, output_format: str = 'csv', flush_size: int = 100000,
+                     lsh_rows_per_band: int = 2) -> Union[pd.DataFrame, List[str]]:
+        """The function iterates over the corpus and returns the top_n (as specified by user) most similar variables
+        from each ontology, by cosine similarity score, which are filtered to only include the top x% most similar
+        matches. The filtered matches are stored as a long-format table with numeric scores in the similarity_scores
+        attribute (see renders_similarity_scores for an example) and the evidence strings are only rendered when the
+        results are converted to one row per concept.
+
+        Matches are converted to tables in chunks of about flush_size rows as they are produced. Each chunk holds all
+        matches of its keys, so it is rendered to one row per key on its own and the rendered chunks only need to be
+        concatenated. If output_directory is provided, the long-format chunks are instead written to it partitioned by
+        ontology (see writes_partitioned_data) and are neither rendered nor kept in the similarity_scores attribute, so
+        memory use does not grow with the number of matches. Each key's matches for an ontology are in a single part
+        file, so the parts can be processed one at a time (e.g. by aggregates_mapping_results).
 
         Args:
             corpus: A list of lists, where the first item in each list is the identifier and the second item is a list
                 containing the processed question definition.
             ontology_type: A list containing ontology types (e.g. ["hp", "mondo"]) to use when filtering results.
-            top_n: The number of results to return for each variable.
+            top_n: The number of results to return for each variable and ontology.
             threshold: An integer specifying a percentile for deriving a threshold cut-off.
+            n_jobs: An integer specifying the number of threads to use when scoring blocks of clinical strings.
+            block_size: An integer specifying the number of clinical strings to score at a time.
+            lsh_bands: An optional integer specifying the number of MinHash LSH bands to use for an approximate
+                search (see finds_approximate_similarities). If None, the exact search is used (default=None).
+            min_idf: An optional float specifying the smallest inverse document frequency an n-gram needs to be used to
+                find candidate ontology strings (see builds_inverted_index). If None, all n-grams are used
+                (default=None).
+            output_directory: An optional string containing the path to a directory to write the long-format
+                similarity scores to. If None, the scores are kept in the similarity_scores attribute (default=None).
+            output_format: A string containing the file format to write to output_directory (i.e. "csv" or
+                "parquet"; default="csv").
+            flush_size: An integer specifying the number of matches to collect before converting them to a table.
+            lsh_rows_per_band: An integer specifying the number of MinHash values in each LSH band, where fewer rows
+                per band increase recall and run time. Only used if lsh_bands is provided (default=2).
 
         Returns:
-            results: A pandas DataFrame of the top_n (as specified by user) results for each variable, with two new
-                columns added per ontology. See example below:
+            results: A list of the paths of the written part files if output_directory is provided. Otherwise, a pandas
+                DataFrame of the top_n (as specified by user) results for each variable, with two new columns added per
+                ontology. See example below:
 
                 OUTPUT
                       CONCEPT_ID     HP_SIM_ONT_URI  HP_SIM_ONT_LABEL   MONDO_SIM_ONT_URI   MONDO_SIM_ONT_LABEL
@@ -249,65 +427,180 @@ class SimilarStringFinder(object):
 
         onts, ont_uri = ontology_type, 'http://purl.obolibrary.org/obo/'
         ont_labels = merge_dictionaries(self.ont_dict, 'label', reverse=True)
-        corpus_id, corpus_idx = self.corpus_modifier(corpus, onts)  # convert corpus to dictionary for faster look-up
-        results: Dict = {x: [] for x in onts}
-
-        # create ont-only version of TF-IDF matrix and corpus for faster cosine similarity look-up
-        sub_idx = [i for j in [v for k, v in corpus_idx.items() if any(k.startswith(x) for x in onts)] for i in j]
-        ont_matrix, ont_corpus = self.matrix.tocsr()[np.array(sub_idx), :], [corpus[x] for x in sub_idx]
+        results: List = []; score_chunks: List = []; outputs: List = []
+        if output_directory is not None: clears_partitioned_data(output_directory, 'ONT', output_format)
+
+        # index corpus rows by key (i.e. clinical primary key or ontology uri) and by ontology
+        id_codes, ids = pd.factorize(np.array([x[0] for x in corpus], dtype=object))
+        prefixes, corpus_keys = [x[id_codes] for x in _splits_corpus_identifiers(ids.tolist(), onts)]
+
+        # create ont-only version of TF-IDF matrix, ordered by ontology and then by identifier, for faster look-up
+        ont_idx = [np.flatnonzero(prefixes == ont) for ont in onts]
+        ont_idx = [x[np.argsort(id_codes[x], kind='stable')] for x in ont_idx]
+        sub_idx = np.concatenate([np.array([], dtype=int)] + ont_idx)
+        sub_ont = np.repeat(np.array(onts, dtype=object), [len(x) for x in ont_idx]).tolist()
+        ont_matrix, sub_uri = self.matrix.tocsr()[sub_idx, :], corpus_keys[sub_idx]
+
+        # score clinical strings against each ontology's strings in sparse blocks ordered by key, keeping the top_n
+        # scores >= 0.25 per ontology so that large ontologies do not crowd out matches from small ontologies
+        keys = list(unique_everseen(self.clinical_data[self.primary_key]))
+        key_codes, key_groups = pd.factorize(corpus_keys)
+        order, offsets = _groups_rows(key_codes, len(key_groups))
+        key_index = {k: i for i, k in enumerate(key_groups)}
+        var_ids = [order[offsets[key_index[k]]:offsets[key_index[k] + 1]] if k in key_index else order[0:0]
+                   for k in keys]
+        clin_matrix = self.matrix.tocsr()[np.concatenate([np.array([], dtype=int)] + var_ids), :]
+        if lsh_bands is not None:
+            var_matches = iter(finds_approximate_similarities(clin_matrix, ont_matrix, top_n, 0.25, lsh_bands,
+                                                              lsh_rows_per_band, reference_groups=sub_ont))
+        else:
+            blocks = streams_top_similarities(clin_matrix, ont_matrix, top_n, 0.25, block_size, n_jobs, sub_ont,
+                                              min_idf)
+            var_matches = (x for block_matches in blocks for x in block_matches)
 
         # matching data in filtered file
-        for index, row in tqdm(self.clinical_data.iterrows(), total=self.clinical_data.shape[0]):
-            match_vars = corpus_id[row[self.primary_key]]
-            var_id = set([i for j in [corpus_idx[x] for x in match_vars] for i in j])
-            scores = [x for y in [self.similarity_search(ont_matrix, v, top_n) for v in set(var_id)] for x in y]
-            match_info = [[x[1], '_'.join(ont_corpus[x[0]][0].split('_')[0:2])] for x in scores if x[1] >= 0.25]
-
-            if len(match_info) > 0:  # extract matches by ontology type
-                for ont in onts:
-                    ont_matches = [x for x in match_info if ont in x[1]]
-                    if len(ont_matches) > 0:
-                        hits = self.filters_matches(ont_matches, threshold)
-                        results[ont].append([row[self.primary_key],
-                                             ' | '.join([x[1] for x in hits]),
-                                             ' | '.join([ont_labels[ont_uri + x[1]] if ont_uri + x[1] in ont_labels
-                                                         else x[1] for x in hits]),
-                                             ' | '.join([x[1] + '_' + x[0] for x in hits])])
-                    else: continue
-            else:
-                continue
+        for key, key_rows in tqdm(zip(keys, var_ids), total=len(keys)):
+            scores = [x for _ in range(len(key_rows)) for x in next(var_matches)]
+            match_info = [[x[1], sub_uri[x[0]], sub_ont[x[0]]] for x in scores]
+
+            for ont in onts:  # extract matches by ontology type
+                ont_matches = [x[0:2] for x in match_info if x[2] == ont]
+                if len(ont_matches) > 0:
+                    hits = self.filters_matches(ont_matches, threshold)
+                    results += [[key, ont, x[1], ont_labels[ont_uri + x[1]] if ont_uri + x[1] in ont_labels else x[1],
+                                 float(x[0])] for x in hits]
+
+            # convert matches to a long-format table once a chunk is full -- keys never span chunks
+            if len(results) >= flush_size:
+                outputs.append(self._flushes_similarity_scores(results, onts, score_chunks, output_directory,
+                                                               output_format, len(outputs)))
+                results = []
+        outputs.append(self._flushes_similarity_scores(results, onts, score_chunks, output_directory, output_format,
+                                                       len(outputs)))
+        self.similarity_scores = pd.concat(score_chunks, ignore_index=True) if len(score_chunks) > 0 \
+            else self._creates_similarity_scores([], self.primary_key)
+
+        if output_directory is not None: return [x for y in outputs for x in y]
+        else: return pd.concat(outputs, ignore_index=True)
 
-        # convert results to Pandas DataFrame + merge ontology findings together
-        ont_sim = [pd.DataFrame({self.primary_key: [x[0] for x in results[ont]],
-                                 ont + '_SIM_ONT_URI': [x[1] for x in results[ont]],
-                                 ont + '_SIM_ONT_LABEL': [x[2] for x in results[ont]],
-                                 ont + '_SIM_ONT_EVIDENCE': [x[3] for x in results[ont]]})
-                   for ont in results.keys()]
+    @staticmethod
+    def _creates_similarity_scores(results: List, primary_key: str) -> pd.DataFrame:
+        """Converts a list of filtered matches to a long-format Pandas DataFrame with numeric scores.
 
-        scored = reduce(lambda x, y: pd.merge(x, y, how='outer', on=self.primary_key), ont_sim)
+        Args:
+            results: A list of lists, where each list contains a primary key, ontology type, ontology uri, ontology
+                label, and similarity score.
+            primary_key: A string containing the column name of the primary key.
 
-        return scored.drop_duplicates()
+        Returns:
+            A Pandas DataFrame with the same columns as the ConceptAnnotator mapping_table.
+        """
+
+        scores = pd.DataFrame(results, columns=[primary_key, 'ONT', 'ONT_URI', 'ONT_LABEL', 'SCORE'])
+        scores.insert(1, 'LEVEL', 'CONCEPT'); scores.insert(2, 'SOURCE', 'SIM'); scores.insert(6, 'EVIDENCE', None)
+
+        return scores.astype({'SCORE': np.float32})
+
+    def _flushes_similarity_scores(self, results: List, ontology_type: List, score_chunks: List,
+                                   output_directory: Optional[str], output_format: str, part: int) \
+            -> Union[pd.DataFrame, List[str]]:
+        """Converts a chunk of filtered matches to a long-format table, which is written to output_directory or, if
+        no directory is provided, appended to score_chunks and rendered to one row per primary key.
 
-    def performs_similarity_search(self):
+        Args:
+            results: A list of lists, where each list contains a primary key, ontology type, ontology uri, ontology
+                label, and similarity score.
+            ontology_type: A list containing ontology types (e.g. ["hp", "mondo"]).
+            score_chunks: A list of long-format Pandas DataFrames to append the chunk to.
+            output_directory: An optional string containing the path to a directory to write the chunk to.
+            output_format: A string containing the file format to write (i.e. "csv" or "parquet").
+            part: An integer containing the number of the chunk.
+
+        Returns:
+            A list of the paths of the written part files if output_directory is provided, otherwise a Pandas DataFrame
+                with one row per primary key (see renders_similarity_scores).
         """
 
+        scores = self._creates_similarity_scores(results, self.primary_key)
+        if output_directory is not None:
+            return writes_partitioned_data(scores, output_directory, 'ONT', part, output_format)
+        if len(scores) > 0: score_chunks.append(scores)
+
+        return self.renders_similarity_scores(scores, self.primary_key, ontology_type)
+
+    def reads_similarity_scores(self, output_directory: str, output_format: str = 'csv') -> pd.DataFrame:
+        """Reads the long-format similarity scores written to output_directory by scores_tfidf.
+
+        Args:
+            output_directory: A string containing the path to the directory the scores were written to.
+            output_format: A string containing the file format of the scores (i.e. "csv" or "parquet"; default="csv").
+
         Returns:
-            complete_mapping: A Pandas DataFrame containing the results of calculating pairwise cosine similarity
-                between the input clinical data and the input ontologies and merged back with the original input
-                clinical data.
+            A Pandas DataFrame with the same columns and types as the similarity_scores attribute.
         """
 
-        print('\n#### PERFORMING STRING SIMILARITY SEARCH ####')
+        columns = list(self._creates_similarity_scores([], self.primary_key).columns)
+        dtype = {**{x: str for x in columns}, 'SCORE': np.float32}
+        chunks = [x[columns] for x in reads_partitioned_data(output_directory, 'ONT', output_format, dtype=dtype)]
+        if len(chunks) == 0: return self._creates_similarity_scores([], self.primary_key)
+        scores = pd.concat(chunks, ignore_index=True)
+        scores['EVIDENCE'] = None
 
-        # STEP 1 - Pre-process Clinical and Ontology Data
-        print('\n*** Pre-Processing Input Data ...')
-        # subset input clinical data set to only include string columns
-        print('Clinical Data')
-        subset_data = self.clinical_data.copy()[[self.primary_key] + self.concept_strings].drop_duplicates()
-        split_strings = column_splitter(subset_data, self.primary_key, self.concept_strings, '|')
-        str_stacked = data_frame_subsetter(split_strings[[self.primary_key] + self.concept_strings],
-                                           self.primary_key, self.concept_strings)[[self.primary_key, 'CODE']]
-        preprocessed_clinical_data = self.text_preprocessor(str_stacked, self.primary_key)
+        return scores.astype({'SCORE': np.float32})
+
+    @staticmethod
+    def renders_similarity_scores(similarity_scores: pd.DataFrame, primary_key: str, ontology_type: List) \
+            -> pd.DataFrame:
+        """Takes a long-format Pandas DataFrame of similarity results, with one row per match, and aggregates it to one
+        row per primary key with uri, label, and evidence columns for each ontology. The evidence strings are rendered
+        from the numeric scores (e.g. "HP_0002617_0.512").
+
+        Args:
+            similarity_scores: A Pandas DataFrame of similarity results. For example:
+                     CONCEPT_ID    ONT        ONT_URI      ONT_LABEL    SCORE
+                0       4311399     HP     HP_0002617     dilatation    0.512
+                1       4311399  MONDO  MONDO_0001273      megacolon    0.455
+            primary_key: A string containing the column name of the primary key.
+            ontology_type: A list containing ontology types (e.g. ["hp", "mondo"]).
+
+        Returns:
+            A Pandas DataFrame with one row per primary key and a uri, label, and evidence column for each ontology
+                (e.g. "HP_SIM_ONT_URI", "HP_SIM_ONT_LABEL", and "HP_SIM_ONT_EVIDENCE").
+        """
+
+        scores = similarity_scores[similarity_scores['ONT'].isin(ontology_type)].copy()
+        scores['ONT_EVIDENCE'] = scores['ONT_URI'] + '_' + scores['SCORE'].apply(lambda x: str(round(float(x), 3)))
+        sim_cols = ['ONT_URI', 'ONT_LABEL', 'ONT_EVIDENCE']
+
+        # sort matches by key and then by ontology, so each key and ontology pair is one contiguous run of rows that
+        # is joined in a single keyed pass, instead of outer merging one table per ontology
+        key_codes, keys = pd.factorize(scores[primary_key])
+        ont_codes = scores['ONT'].map({x: i for i, x in enumerate(ontology_type)}).values.astype(int)
+        order = np.lexsort((ont_codes, key_codes))
+        group_codes = key_codes[order] * len(ontology_type) + ont_codes[order]
+        starts = np.flatnonzero(np.diff(group_codes, prepend=-1))
+        bounds = list(zip(starts.tolist(), np.append(starts[1:], len(order)).tolist()))
+        rows, cols = group_codes[starts] // len(ontology_type), group_codes[starts] % len(ontology_type)
+        scored = np.full((len(keys), len(ontology_type) * len(sim_cols)), np.nan, dtype=object)
+        for i, col in enumerate(sim_cols):
+            values = scores[col].values[order].tolist()
+            scored[rows, cols * len(sim_cols) + i] = [' | '.join(values[x:y]) for x, y in bounds]
+        scored = pd.DataFrame(scored, columns=[ont + '_SIM_' + x for ont in ontology_type for x in sim_cols])
+        scored.insert(0, primary_key, keys)
+
+        return scored.drop_duplicates()
+
+    def preprocesses_ontology_data(self, n_jobs: int = 1) -> List:
+        """Pre-processes the labels, definitions, and synonyms of each ontology in ontology_dictionary.
+
+        Args:
+            n_jobs: An integer specifying the number of worker processes to use when pre-processing strings
+                (default=1).
+
+        Returns:
+            A list of tuples, where each tuple contains an ontology identifier and a list of processed tokens, ordered
+                by ontology.
+        """
 
         # convert ont dictionary into dictionary of Pandas DataFrames keyed by ontology type
         ont_data_dict = {}
@@ -316,20 +609,225 @@ class SimilarStringFinder(object):
             ont_df = pd.concat([pd.DataFrame(self.ont_dict[ont][str_col].items(), columns=['CODE', 'ONT_URI'])
                                 for str_col in ['label', 'definition', 'synonym']])
             ont_df['ONT_URI'] = ont_df['ONT_URI'].apply(lambda x: x.split('/')[-1])
-            ont_data_dict[ont] = self.text_preprocessor(ont_df, 'ONT_URI')
+            ont_data_dict[ont] = self.text_preprocessor(ont_df, 'ONT_URI', self.token_cache, n_jobs)
+
+        return [x for y in [v for k, v in ont_data_dict.items()] for x in y]
+
+    def hashes_ontology_data(self, n_features: Optional[int] = None, engine: str = 'word') -> str:
+        """Creates an md5 hash of the ontology labels, definitions, and synonyms (and the TF-IDF settings) used to build
+        the TF-IDF matrix, which identifies the ontology release that a persisted TF-IDF model was fit on. Settings that
+        are objects (e.g. the tokenizer function) are hashed by name, so the hash is the same in every run.
+
+        Args:
+            n_features: An optional integer specifying the number of hashed TF-IDF features (default=None).
+            engine: A string specifying the n-grams to score strings with (i.e. "word" or "char"; default="word").
+
+        Returns:
+            A string containing an md5 hexdigest.
+        """
+
+        params = self.creates_tfidf_vectorizer(n_features, engine).get_params()
+        settings = [(k, v if isinstance(v, (bool, float, int, str, tuple, type(None)))
+                     else getattr(v, '__name__', type(v).__name__)) for k, v in sorted(params.items())]
+        ont_hash = hashlib.md5(bytes(repr(settings), 'utf-8'))
+        for ont in self.ont_dict.keys():
+            for str_col in ['label', 'definition', 'synonym']:
+                ont_hash.update(bytes(ont + '\t' + str_col + '\n', 'utf-8'))
+                for k, v in self.ont_dict[ont][str_col].items():
+                    ont_hash.update(bytes(str(k) + '\t' + str(v) + '\n', 'utf-8'))
+
+        return ont_hash.hexdigest()
+
+    @staticmethod
+    def creates_tfidf_vectorizer(n_features: Optional[int] = None, engine: str = 'word') \
+            -> Union[TfidfVectorizer, Pipeline]:
+        """Creates the vectorizer used to convert pre-processed (i.e. tokenized) strings into a TF-IDF matrix. By
+        default, a TfidfVectorizer is used, which stores a vocabulary entry for every n-gram. If n_features is
+        provided, n-grams are instead hashed into n_features columns by a HashingVectorizer and then weighted by a
+        TfidfTransformer, so memory use does not grow with the size of the ontologies. N-grams that are hashed to the
+        same column are treated as the same n-gram (see reports_feature_collisions). TF-IDF values are stored as
+        float32, which halves the size of the TF-IDF matrix and of the similarity scores calculated from it.
+
+        The "word" engine uses word n-grams of 1 to 3 tokens. The "char" engine uses character trigrams within each
+        token (i.e. the Scikit-Learn "char_wb" analyzer), so strings that only differ by misspellings, truncations, or
+        word endings (e.g. "hypertensive" and "hypertension") still share most of their n-grams. Both engines produce a
+        TF-IDF matrix that is scored in the same way.
+
+        Args:
+            n_features: An optional integer specifying the number of hashed TF-IDF features (default=None).
+            engine: A string specifying the n-grams to score strings with (i.e. "word" or "char"; default="word").
+
+        Returns:
+            A Scikit-Learn TfidfVectorizer object or a Pipeline containing a HashingVectorizer and a TfidfTransformer.
+
+        Raises:
+            ValueError: If engine is not "word" or "char".
+        """
+
+        if engine == 'word':
+            settings = {'tokenizer': _returns_tokens, 'preprocessor': _returns_tokens, 'ngram_range': (1, 3)}
+        elif engine == 'char':
+            settings = {'analyzer': 'char_wb', 'preprocessor': _joins_tokens, 'ngram_range': (3, 3)}
+        else:
+            raise ValueError('engine must be "word" or "char".')
+
+        if n_features is None:
+            return TfidfVectorizer(use_idf=True, norm='l2', lowercase=False, dtype=np.float32, **settings)
+        else:
+            hashing = HashingVectorizer(lowercase=False, n_features=n_features, alternate_sign=False, norm=None,
+                                        dtype=np.float32, **settings)
+            return make_pipeline(hashing, TfidfTransformer(use_idf=True, norm='l2'))
+
+    @staticmethod
+    def reports_feature_collisions(documents: List, n_features: int, engine: str = 'word') -> Dict:
+        """Reports how many of the n-grams in a list of pre-processed documents are hashed to the same TF-IDF feature
+        when a hashed vectorizer with n_features columns is used (see creates_tfidf_vectorizer). Colliding n-grams
+        share a column (and IDF weight), which can add similarity between strings that do not share any n-grams.
+
+        Args:
+            documents: A list of pre-processed documents, where each document is a list of tokens.
+            n_features: An integer specifying the number of hashed TF-IDF features.
+            engine: A string specifying the n-grams to score strings with (i.e. "word" or "char"; default="word").
+
+        Returns:
+            A dictionary containing the number of distinct n-grams ("n_grams"), the number of feature columns they are
+                hashed to ("features"), the number of n-grams that share a column with another n-gram
+                ("colliding_n_grams"), and the fraction of n-grams that collide ("collision_rate").
+        """
+
+        analyzer = SimilarStringFinder.creates_tfidf_vectorizer(engine=engine).build_analyzer()
+        n_grams = sorted(set(x for doc in documents for x in analyzer(doc)))
+        hashing = HashingVectorizer(analyzer=_returns_tokens, n_features=n_features, alternate_sign=False, norm=None)
+        counts = np.bincount(hashing.transform([[x] for x in n_grams]).indices, minlength=n_features)
+        colliding = int(np.sum(counts[counts > 1]))
+
+        return {'n_grams': len(n_grams), 'features': int(np.sum(counts > 0)), 'colliding_n_grams': colliding,
+                'collision_rate': colliding / max(len(n_grams), 1)}
+
+    def builds_ontology_model(self, model_directory: str, n_jobs: int = 1, n_features: Optional[int] = None,
+                              engine: str = 'word') -> Tuple:
+        """Loads the TF-IDF vectorizer, pre-processed ontology corpus, and ontology TF-IDF matrix for the current
+        ontology release from model_directory. If they do not exist yet, the ontology data is pre-processed and the
+        vectorizer is fit on the ontology data only, so it can be re-used by clinical data sets mapped to the same
+        ontology release, and the results are saved to model_directory. The files are keyed by the md5 hash returned
+        from hashes_ontology_data (e.g. "tfidf_model_<hash>.pickle" and "tfidf_matrix_<hash>.npz").
+
+        Args:
+            model_directory: A string containing the path to a directory to store TF-IDF models in.
+            n_jobs: An integer specifying the number of worker processes to use when pre-processing the ontology data
+                (default=1).
+            n_features: An optional integer specifying the number of hashed TF-IDF features (default=None).
+            engine: A string specifying the n-grams to score strings with (i.e. "word" or "char"; default="word").
+
+        Returns:
+            A tuple containing: (1) a list of tuples with the pre-processed ontology corpus, (2) a fitted
+                TfidfVectorizer, and (3) a Scipy sparse matrix with a row of TF-IDF values for each item in (1).
+        """
+
+        ont_hash = self.hashes_ontology_data(n_features, engine)
+        model_file = os.path.join(model_directory, 'tfidf_model_{}.pickle'.format(ont_hash))
+        matrix_file = os.path.join(model_directory, 'tfidf_matrix_{}.npz'.format(ont_hash))
+
+        if os.path.exists(model_file) and os.path.exists(matrix_file):
+            print('Loading Ontology TF-IDF Model: {}'.format(model_file))
+            with open(model_file, 'rb') as handle:
+                ont_corpus, tf = pickle.load(handle)
+            ont_matrix = sparse.load_npz(matrix_file).tocsr()
+        else:
+            ont_corpus, tf = self.preprocesses_ontology_data(n_jobs), self.creates_tfidf_vectorizer(n_features, engine)
+            ont_matrix = tf.fit_transform([x[1] for x in ont_corpus]).tocsr()
+            print('Saving Ontology TF-IDF Model: {}'.format(model_file))
+            os.makedirs(model_directory, exist_ok=True)
+            with open(model_file, 'wb') as handle:
+                pickle.dump((ont_corpus, tf), handle, protocol=pickle.HIGHEST_PROTOCOL)
+            sparse.save_npz(matrix_file, ont_matrix)
+
+        return ont_corpus, tf, ont_matrix
+
+    def performs_similarity_search(self, n_jobs: int = 1, block_size: int = 100, model_directory: Optional[str] = None,
+                                   lsh_bands: Optional[int] = None, min_idf: Optional[float] = None,
+                                   token_cache_file: Optional[str] = None, n_features: Optional[int] = None,
+                                   output_directory: Optional[str] = None, output_format: str = 'csv',
+                                   engine: str = 'word', lsh_rows_per_band: int = 2) -> Union[pd.DataFrame, List[str]]:
+        """
+
+        Args:
+            n_jobs: An integer specifying the number of threads to use when calculating cosine similarity and the number
+                of worker processes to use when pre-processing the ontology data.
+            block_size: An integer specifying the number of clinical strings to score at a time. Larger blocks are
+                faster, but need more memory per thread.
+            model_directory: An optional string containing the path to a directory to store TF-IDF models in. If
+                provided, the TF-IDF vocabulary and IDF weights are fit on the ontology data only, once per ontology
+                release, and clinical strings are transformed with the persisted model (see builds_ontology_model).
+                Otherwise, the TF-IDF matrix is fit on the clinical and ontology data together (default=None).
+            lsh_bands: An optional integer specifying the number of MinHash LSH bands to use for an approximate
+                search of very large ontologies, where more bands increase recall and run time. If None, the exact
+                search is used (default=None).
+            min_idf: An optional float specifying the smallest inverse document frequency an n-gram needs to be used to
+                find candidate ontology strings. Candidates are still scored with all n-grams, but ontology strings
+                only sharing very common words with a clinical string are skipped (default=None).
+            token_cache_file: An optional string containing the path to a file to store pre-processed strings in, so
+                that strings processed in earlier runs are not pre-processed again. Strings cached by a different
+                version of the pre-processing steps are processed again (default=None).
+            n_features: An optional integer specifying the number of hashed TF-IDF features. If provided, n-grams are
+                hashed into a fixed number of features instead of being stored in a vocabulary, which bounds memory use
+                for very large ontologies (see creates_tfidf_vectorizer). If None, every n-gram is its own feature
+                (default=None).
+            output_directory: An optional string containing the path to a directory to write the long-format
+                similarity scores to, partitioned by ontology, as they are produced. If provided, the scores are not
+                kept in memory and the paths of the written part files are returned instead of the merged mappings.
+                The part files can be aggregated one at a time by aggregates_mapping_results or read with
+                reads_similarity_scores (default=None).
+            output_format: A string containing the file format to write to output_directory (i.e. "csv" or
+                "parquet"; default="csv").
+            engine: A string specifying the n-grams to score strings with. The "word" engine uses word n-grams and the
+                "char" engine uses character n-grams, which also match misspelled and truncated strings (see
+                creates_tfidf_vectorizer; default="word").
+            lsh_rows_per_band: An integer specifying the number of MinHash values in each LSH band, where fewer rows
+                per band increase recall and run time. Only used if lsh_bands is provided (default=2).
+
+        Returns:
+            complete_mapping: A Pandas DataFrame containing the results of calculating pairwise cosine similarity
+                between the input clinical data and the input ontologies and merged back with the original input
+                clinical data. If output_directory is provided, a list of the paths of the written part files.
+        """
+
+        print('\n#### PERFORMING STRING SIMILARITY SEARCH ####')
+
+        # STEP 1 - Pre-process Clinical and Ontology Data
+        print('\n*** Pre-Processing Input Data ...')
+        if token_cache_file is not None:
+            self.token_cache = TokenCache(token_cache_file, namespace=preprocessing_version)
+        # subset input clinical data set to only include string columns
+        print('Clinical Data')
+        concept_strings: List = self.concept_strings  # type: ignore
+        subset_data = self.clinical_data.copy()[[self.primary_key] + concept_strings].drop_duplicates()
+        split_strings = column_splitter(subset_data, self.primary_key, concept_strings, '|')
+        str_stacked = data_frame_subsetter(split_strings[[self.primary_key] + concept_strings],
+                                           self.primary_key, concept_strings)[[self.primary_key, 'CODE']]
+        preprocessed_clinical_data = self.text_preprocessor(str_stacked, self.primary_key, self.token_cache)
 
         # STEP 2 - CREATE TF-IDF MATRIX
-        print('\n*** Building TF-IDF Matrix')
-        corpus = preprocessed_clinical_data + [x for y in [v for k, v in ont_data_dict.items()] for x in y]
-        tf = TfidfVectorizer(tokenizer=lambda x: x, preprocessor=lambda x: x, use_idf=True, norm='l2', lowercase=False,
-                             ngram_range=(1, 3))
-        self.matrix = tf.fit_transform([x[1] for x in corpus])
+        if model_directory is not None:
+            ont_corpus, tf, ont_matrix = self.builds_ontology_model(model_directory, n_jobs, n_features, engine)
+            print('\n*** Building TF-IDF Matrix')
+            clinical_matrix = tf.transform([x[1] for x in preprocessed_clinical_data])
+            corpus = preprocessed_clinical_data + ont_corpus
+            self.matrix = sparse.vstack([clinical_matrix, ont_matrix]).tocsr()
+        else:
+            corpus = preprocessed_clinical_data + self.preprocesses_ontology_data(n_jobs)
+            print('\n*** Building TF-IDF Matrix')
+            tf = self.creates_tfidf_vectorizer(n_features, engine)
+            self.matrix = tf.fit_transform([x[1] for x in corpus])
+        self.token_cache.close()
 
         # STEP 3 - Calculating Cosine Similarity
         print('\n*** Calculating Cosine Similarity')
         keys = self.ont_dict.keys()
         ont_lists = [list(self.ont_dict[x]['label'].values())[0].split('/')[-1].split('_')[0] for x in keys]
-        cosine_sim = self.scores_tfidf(corpus, ont_lists, 10, 75)
+        cosine_sim = self.scores_tfidf(corpus, ont_lists, 10, 75, n_jobs, block_size, lsh_bands, min_idf,
+                                       output_directory, output_format, lsh_rows_per_band=lsh_rows_per_band)
+        if isinstance(cosine_sim, list): return cosine_sim
 
         # merge results with clinical data
         complete_mapping = pd.merge(self.clinical_data, cosine_sim, how='left', on=self.primary_key)
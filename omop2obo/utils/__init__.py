@@ -4,6 +4,9 @@
 
 from .data_utils import *
 from .ontology_utils import *
+from .pipeline_utils import *
+from .similarity_utils import *
+from .text_utils import *
 from .umls_api import cui_search
 
 
@@ -11,6 +14,10 @@ __all__ = ['gets_ontology_statistics', 'gets_ontology_classes', 'gets_ontology_c
            'gets_ontology_class_labels', 'gets_ontology_class_definitions', 'gets_ontology_class_synonyms',
            'gets_ontology_class_dbxrefs', 'gets_deprecated_ontology_classes', 'cui_search', 'data_frame_subsetter',
            'data_frame_supersetter', 'column_splitter', 'aggregates_column_values', 'data_frame_grouper',
-           'normalizes_source_codes', 'merge_dictionaries', 'ohdsi_ananke', 'normalizes_clinical_source_codes',
-           'filters_mapping_content', 'compiles_mapping_content', 'formats_mapping_evidence',
-           'assigns_mapping_category', 'aggregates_mapping_results']
+           'renders_mapping_table', 'normalizes_source_codes', 'merge_dictionaries', 'clears_partitioned_data',
+           'writes_partitioned_data', 'reads_partitioned_data', 'writes_mapping_results', 'reads_mapping_results',
+           'ohdsi_ananke', 'normalizes_clinical_source_codes', 'filters_mapping_content', 'plans_mapping_columns',
+           'compiles_mapping_content', 'formats_mapping_evidence', 'assigns_mapping_category',
+           'compiles_ontology_mappings', 'aggregates_mapping_results', 'builds_inverted_index',
+           'streams_top_similarities', 'finds_top_similarities', 'computes_minhash_signatures', 'builds_minhash_index',
+           'finds_approximate_similarities', 'measures_recall', 'TokenCache', 'hashes_inputs', 'PipelineRunner']
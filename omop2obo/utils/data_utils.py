@@ -10,36 +10,59 @@ Pandas DataFrame manipulations
 * column_splitter
 * aggregates_column_values
 * data_frame_grouper
+* renders_mapping_table
 * normalizes_source_codes
 
 Dictionary manipulations
 * merge_dictionaries
 
+Partitioned Result Files
+* clears_partitioned_data
+* writes_partitioned_data
+* reads_partitioned_data
+
+Mapping Result Files
+* writes_mapping_results
+* reads_mapping_results
+
 Mapping Result Aggregation
 * ohdsi_ananke
 * normalizes_clinical_source_codes
 * filters_mapping_content
+* plans_mapping_columns
 * compiles_mapping_content
 * formats_mapping_evidence
 * assigns_mapping_category
+* compiles_ontology_mappings
 * aggregates_mapping_results
 
 """
 
 # import needed libraries
+import glob
+import multiprocessing
+import numpy as np  # type: ignore
+import os
 import pandas as pd  # type: ignore
 import re
 
-from functools import reduce
+from functools import partial, reduce
 from more_itertools import unique_everseen
 from tqdm import tqdm  # type: ignore
-from typing import Any, Callable, Dict, List, Optional, Tuple  # type: ignore
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union  # type: ignore
 
 # ENVIRONMENT WARNINGS
 # WARNING 1 - Pandas: disable chained assignment warning rationale:
 # https://stackoverflow.com/questions/20625582/how-to-deal-with-settingwithcopywarning-in-pandas
 pd.options.mode.chained_assignment = None
 
+# ontology data used by aggregation worker processes (see aggregates_mapping_results)
+_worker_data: Dict = {}
+
+# ontology prefix of a mapping result column (see _gets_column_ontology)
+_mapping_column = re.compile(r'^(?:(?:CONCEPT|ANCESTOR)_(?:DBXREF|STR)_|AGGREGATED_|SIMILARITY_)([A-Z0-9]+)_|'
+                             r'^([A-Z0-9]+)_SIM_')
+
 
 def data_frame_subsetter(data: pd.DataFrame, primary_key: str, subset_columns: List) -> pd.DataFrame:
     """Takes a Pandas DataFrame and subsets it such that each subset represents an original column of codes, OMOP
@@ -156,29 +179,29 @@ def column_splitter(data: pd.DataFrame, key: str, delimited_columns: List, delim
     return merged_delimited_data.drop_duplicates()
 
 
-def aggregates_column_values(data: pd.DataFrame, primary_key: str, agg_cols: List, delimiter: str) -> pd.DataFrame:
+def aggregates_column_values(data: pd.DataFrame, primary_key: Union[str, List], agg_cols: List, delimiter: str) \
+        -> pd.DataFrame:
     """Takes a Pandas DataFrame, a string containing a primary key, a list of columns to aggregate, and a string
-    delimiter to use when aggregating the columns. The method then loops over each column in agg_cols and performs
-    the aggregation. The method joins all aggregated columns and merges it into a single Pandas DataFrame.
+    delimiter to use when aggregating the columns. The method aggregates all columns in agg_cols in a single groupby
+    pass, where the unique values of each column are joined (in order of appearance) using the delimiter.
 
     Args:
         data: A Pandas DataFrame.
-        primary_key: A string containing a column name to be used as a primary key.
+        primary_key: A string containing a column name to be used as a primary key or a list of column names when
+            the data should be aggregated by a composite key (e.g. ['CONCEPT_ID', 'CONCEPT_DBXREF_ONT_TYPE']).
         agg_cols: A list of columns to aggregate.
         delimiter: A string containing a delimiter to aggregate results by.
 
     Returns:
-        merged_combo: A Pandas DataFrame that includes the primary_key column and one
+        merged_combo: A Pandas DataFrame that includes the primary_key column(s) and one
             delimiter-aggregated column for each column in the agg_cols list.
     """
 
-    # create list of aggregated GroupBy DataFrames
-    combo = [data.groupby([primary_key])[col].apply(lambda x: delimiter.join(list(unique_everseen(x))))
-             for col in agg_cols]
+    keys = [primary_key] if isinstance(primary_key, str) else list(primary_key)
 
-    # merge data frames by primary key and reset index
-    merged_combo = reduce(lambda x, y: pd.merge(x, y, on=primary_key, how='outer'), combo)
-    merged_combo.reset_index(level=0, inplace=True)
+    # aggregate all columns at once and reset index
+    merged_combo = data.groupby(keys)[agg_cols].agg(lambda x: delimiter.join(list(unique_everseen(x))))
+    merged_combo.reset_index(inplace=True)
 
     return merged_combo
 
@@ -186,8 +209,8 @@ def aggregates_column_values(data: pd.DataFrame, primary_key: str, agg_cols: Lis
 def data_frame_grouper(data: pd.DataFrame, primary_key: str, type_column: str, col_agg: Callable) -> \
         pd.DataFrame:
     """Methods takes a Pandas DataFrame as input, a primary key, and a column to group the data by and
-    creates a new DataFrame that merges the individual grouped DataFrames into a single DataFrame.
-    Examples of the input and output data are shown below.
+    creates a new DataFrame where the data are aggregated by primary key and group in a single pass and the groups are
+    then pivoted into columns. Examples of the input and output data are shown below.
 
     INPUT_DATA:
                    CONCEPT_ID         CONCEPT_DBXREF_ONT_URI  CONCEPT_DBXREF_ONT_TYPE         CONCEPT_DBXREF_EVIDENCE
@@ -205,32 +228,73 @@ def data_frame_grouper(data: pd.DataFrame, primary_key: str, type_column: str, c
             primary key.
         type_column: A string containing the name of the column in the input DataFrame to use for
             grouping the data (see OUTPUT above for an example).
-        col_agg: A func that aggregates data within a Pandas DataFrame column.
+        col_agg: A func that aggregates data within a Pandas DataFrame column by a composite key (i.e. primary_key and
+            type_column).
 
     Returns:
-        grouped_data_full: A Pandas DataFrame containing a merged version of the grouped data.
+        grouped_data_full: A Pandas DataFrame containing a widened version of the grouped data.
     """
 
-    # group data by ontology type
-    grouped_data = data.groupby(type_column)
-    grouped_data_frames = []
+    # aggregate data by primary key and ontology type in a single pass
+    agg_cols = [col for col in data.columns if col.split('_')[-1] in ['LABEL', 'EVIDENCE', 'URI']]
+    grouped_data = col_agg(data, [primary_key, type_column], agg_cols, ' | ')
 
-    for grp in grouped_data.groups:
-        temp_df = grouped_data.get_group(grp)
-        temp_df.drop(type_column, axis=1, inplace=True)
-        # rename columns
-        updated_names = [x.replace('ONT', grp) for x in list(temp_df.columns) if x != primary_key]
-        temp_df.columns = [primary_key] + updated_names
-        # aggregate data
-        agg_cols = [col for col in temp_df.columns if col.split('_')[-1] in ['LABEL', 'EVIDENCE', 'URI']]
-        temp_df_agg = col_agg(temp_df.copy(), primary_key, agg_cols, ' | ')
+    # widen the ontology types into columns (e.g. CONCEPT_DBXREF_ONT_URI --> CONCEPT_DBXREF_HP_URI)
+    grouped_data_full = grouped_data.set_index([primary_key, type_column])[agg_cols].unstack(type_column)
+    ont_types = sorted(grouped_data_full.columns.get_level_values(type_column).unique())
+    grouped_data_full = grouped_data_full.reindex(columns=[(col, grp) for grp in ont_types for col in agg_cols])
+    grouped_data_full.columns = [col.replace('ONT', grp) for col, grp in grouped_data_full.columns]
+    grouped_data_full.reset_index(inplace=True)
 
-        grouped_data_frames.append(temp_df_agg.drop_duplicates())
+    return grouped_data_full.drop_duplicates()
 
-    # merge DataFrames back together
-    grouped_data_full = reduce(lambda x, y: pd.merge(x, y, how='outer', on=primary_key), grouped_data_frames)
 
-    return grouped_data_full.drop_duplicates()
+def renders_mapping_table(mapping_table: pd.DataFrame, primary_key: str) -> pd.DataFrame:
+    """Takes a long-format Pandas DataFrame of mapping results, with one row per mapped concept, level, mapping
+    source, ontology, and uri, and renders it as one row per primary key with pipe-delimited uri, label, and evidence
+    columns. Exact mapping columns are named by level, source, and ontology and similarity columns are named by
+    ontology, with the evidence rendered from the numeric score. Exact mapping values are de-duplicated, similarity
+    values are kept in order so that the uris, labels, and evidence line up. Exact mapping columns are rendered the
+    same way data_frame_grouper widens a single mapping source.
+
+        INPUT:
+              CONCEPT_ID      LEVEL   SOURCE    ONT      ONT_URI     ONT_LABEL                   EVIDENCE   SCORE
+            0     442264    CONCEPT   DBXREF  MONDO          URL   ear disease   CONCEPT_DBXREF_sctid:...     NaN
+            1     442264    CONCEPT      SIM     HP   HP_0000598   ear disease                       None     1.0
+
+        OUTPUT:
+              CONCEPT_ID  CONCEPT_DBXREF_MONDO_URI  ...  HP_SIM_ONT_URI  HP_SIM_ONT_LABEL  HP_SIM_ONT_EVIDENCE
+            0     442264                       URL  ...      HP_0000598       ear disease       HP_0000598_1.0
+
+    Args:
+        mapping_table: A long-format Pandas DataFrame of mapping results (see INPUT above).
+        primary_key: A string containing the column name of the primary key.
+
+    Returns:
+        A Pandas DataFrame with one row per primary key and a uri, label, and evidence column for each level, source,
+            and ontology in mapping_table (see OUTPUT above).
+    """
+
+    table, agg_cols = mapping_table.copy(), ['ONT_URI', 'ONT_LABEL', 'EVIDENCE']
+    sim_rows = table['SOURCE'] == 'SIM'
+    sim_scores = table.loc[sim_rows, 'SCORE'].apply(lambda x: str(round(float(x), 3)))
+    table.loc[sim_rows, 'EVIDENCE'] = table.loc[sim_rows, 'ONT_URI'] + '_' + sim_scores
+    table['COLUMN'] = table['LEVEL'] + '_' + table['SOURCE'] + '_' + table['ONT']
+    table.loc[sim_rows, 'COLUMN'] = table.loc[sim_rows, 'ONT'] + '_SIM_ONT'
+
+    # order column groups by level and source (as first seen) and then by ontology
+    blocks = {x: i for i, x in enumerate(unique_everseen(zip(table['LEVEL'], table['SOURCE'])))}
+    table['ORDER'] = [blocks[x] for x in zip(table['LEVEL'], table['SOURCE'])]
+    groups = list(unique_everseen(table.sort_values(['ORDER', 'ONT'], kind='mergesort')['COLUMN']))
+
+    # de-duplicate exact mapping values, keep similarity values aligned
+    exact = aggregates_column_values(table[~sim_rows], [primary_key, 'COLUMN'], agg_cols, ' | ')
+    sim = table[sim_rows].groupby([primary_key, 'COLUMN'], sort=False)[agg_cols].agg(' | '.join).reset_index()
+    rendered = pd.concat([exact, sim]).set_index([primary_key, 'COLUMN']).unstack('COLUMN')
+    rendered = rendered.reindex(columns=[(col, grp) for grp in groups for col in agg_cols])
+    rendered.columns = [grp + '_' + col.split('_')[-1] for col, grp in rendered.columns]
+
+    return rendered.reset_index()
 
 
 def normalizes_source_codes(data: pd.DataFrame, source_code_dict: Dict) -> pd.Series:
@@ -302,6 +366,306 @@ def merge_dictionaries(dictionaries: Dict, key_type: str, reverse: bool = False)
     return combined_dictionary
 
 
+def _lists_partitioned_files(directory: str, partition_column: str, file_format: str,
+                             partition_values: Optional[List] = None) -> List[Tuple[str, str]]:
+    """Lists the part files of a partitioned result directory, ordered by partition and then by part number.
+
+    Args:
+        directory: A string containing the path to a partitioned result directory.
+        partition_column: A string containing the name of the column the data is partitioned by.
+        file_format: A string containing the file format of the part files (i.e. "csv" or "parquet").
+        partition_values: An optional list of partition values to list, in order. If None, all partitions are listed
+            in sorted order (default=None).
+
+    Returns:
+        A list of tuples, where each tuple contains a partition value and the path to one of its part files.
+
+    Raises:
+        ValueError: If file_format is not "csv" or "parquet".
+    """
+
+    if file_format not in ['csv', 'parquet']: raise ValueError('file_format must be "csv" or "parquet".')
+
+    prefix = partition_column + '='
+    if partition_values is None:
+        partitions = sorted(x[len(prefix):] for x in os.listdir(directory) if x.startswith(prefix)) \
+            if os.path.isdir(directory) else []
+    else:
+        partitions = [str(x) for x in partition_values]
+
+    return [(value, part) for value in partitions
+            for part in sorted(glob.glob(os.path.join(directory, prefix + value, 'part-*.' + file_format)))]
+
+
+def clears_partitioned_data(directory: str, partition_column: str, file_format: str = 'csv') -> None:
+    """Removes the part files written to a partitioned result directory by an earlier run, so that they are not read
+    back together with new results. Other files in the directory are left alone.
+
+    Args:
+        directory: A string containing the path to a partitioned result directory.
+        partition_column: A string containing the name of the column the data is partitioned by.
+        file_format: A string containing the file format of the part files (i.e. "csv" or "parquet"; default="csv").
+
+    Returns:
+        None.
+    """
+
+    for _, part in _lists_partitioned_files(directory, partition_column, file_format):
+        os.remove(part)
+
+    return None
+
+
+def writes_partitioned_data(data: pd.DataFrame, directory: str, partition_column: str, part: int,
+                            file_format: str = 'csv') -> List[str]:
+    """Writes a chunk of a result table to a directory partitioned by the values of a column, so that large results
+    can be written as they are produced instead of being held in memory. Each chunk is written as one part file per
+    partition value, without the partition column. For example, the rows of chunk 3 with an ONT value of "HP" are
+    written to: directory/ONT=HP/part-00003.csv.
+
+    Args:
+        data: A Pandas DataFrame containing a chunk of results.
+        directory: A string containing the path to write the partitioned results to.
+        partition_column: A string containing the name of the column to partition the data by.
+        part: An integer containing the number of the chunk, which must be unique for each chunk.
+        file_format: A string containing the file format to write (i.e. "csv" or "parquet"; default="csv"). Writing
+            Parquet files requires pyarrow or fastparquet.
+
+    Returns:
+        A list of strings containing the paths of the written part files.
+
+    Raises:
+        ValueError: If file_format is not "csv" or "parquet".
+    """
+
+    if file_format not in ['csv', 'parquet']: raise ValueError('file_format must be "csv" or "parquet".')
+
+    files: List = []
+    for value, chunk in data.groupby(partition_column, sort=False):
+        partition = os.path.join(directory, partition_column + '=' + str(value))
+        if not os.path.exists(partition): os.makedirs(partition)
+        part_file = os.path.join(partition, 'part-{:05d}.{}'.format(part, file_format))
+        chunk = chunk.drop(columns=partition_column)
+        if file_format == 'csv': chunk.to_csv(part_file, sep=',', index=False, header=True)
+        else: chunk.to_parquet(part_file, index=False)
+        files.append(part_file)
+
+    return files
+
+
+def reads_partitioned_data(directory: str, partition_column: str, file_format: str = 'csv',
+                           partition_values: Optional[List] = None, dtype: Optional[Dict] = None) \
+        -> Iterator[pd.DataFrame]:
+    """Reads the part files written by writes_partitioned_data one at a time, ordered by partition and then by part
+    number. The partition column is added back to each part as its last column.
+
+    Args:
+        directory: A string containing the path to a partitioned result directory.
+        partition_column: A string containing the name of the column the data is partitioned by.
+        file_format: A string containing the file format of the part files (i.e. "csv" or "parquet"; default="csv").
+        partition_values: An optional list of partition values to read, in order. If None, all partitions are read in
+            sorted order (default=None).
+        dtype: An optional dictionary keyed by column name with the types to read CSV columns as (default=None).
+
+    Returns:
+        An iterator of Pandas DataFrames, one per part file.
+
+    Raises:
+        ValueError: If file_format is not "csv" or "parquet".
+    """
+
+    for value, part in _lists_partitioned_files(directory, partition_column, file_format, partition_values):
+        if file_format == 'csv': chunk = pd.read_csv(part, header=0, dtype=dtype, low_memory=False)
+        else: chunk = pd.read_parquet(part)
+        chunk[partition_column] = value
+
+        yield chunk
+
+
+def _gets_column_ontology(column: str) -> Optional[str]:
+    """Returns the ontology prefix of a mapping result column (e.g. "HP" for "CONCEPT_DBXREF_HP_URI", "HP_SIM_ONT_URI",
+    and "AGGREGATED_HP_URI") or None if the column is not specific to an ontology (e.g. "CONCEPT_LABEL").
+
+    Args:
+        column: A string containing the name of a mapping result column.
+
+    Returns:
+        A string containing the upper-case ontology prefix of the column or None.
+    """
+
+    match = _mapping_column.match(column.upper())
+
+    return None if match is None else match.group(1) or match.group(2)
+
+
+def _writes_mapping_file(data: pd.DataFrame, file_path: str, file_format: str, compression: Optional[str]) -> None:
+    """Writes a Pandas DataFrame of mapping results to a single file. Before writing a binary file, object columns
+    that mix strings with other types (e.g. integer concept identifiers and empty strings) are converted to strings,
+    which Parquet and Feather require.
+
+    Args:
+        data: A Pandas DataFrame of mapping results.
+        file_path: A string containing the path to write the file to.
+        file_format: A string containing the file format to write (i.e. "csv", "parquet", or "feather").
+        compression: An optional string containing the compression codec to use.
+
+    Returns:
+        None.
+    """
+
+    if file_format == 'csv':
+        data.to_csv(file_path, sep=',', index=False, header=True, compression=compression or 'infer')
+    else:
+        data = data.reset_index(drop=True)
+        for x in [x for x in data.columns if data[x].dtype == object]:
+            if pd.api.types.infer_dtype(data[x], skipna=True).startswith('mixed'):
+                data[x] = data[x].where(data[x].isna(), data[x].astype(str))
+        if file_format == 'parquet': data.to_parquet(file_path, index=False, compression=compression or 'snappy')
+        elif compression is None: data.to_feather(file_path)
+        else: data.to_feather(file_path, compression=compression)
+
+    return None
+
+
+def _reads_mapping_file(file_path: str, file_format: str, onts: Optional[List] = None,
+                        dtype: Optional[Dict] = None) -> pd.DataFrame:
+    """Reads a single file of mapping results, keeping the clinical columns and the columns of the ontologies in onts.
+
+    Args:
+        file_path: A string containing the path to a mapping result file.
+        file_format: A string containing the file format of the file (i.e. "csv", "parquet", or "feather").
+        onts: An optional list of ontology prefixes to read the columns of. If None, all columns are read
+            (default=None).
+        dtype: An optional dictionary keyed by column name with the types to read CSV columns as (default=None).
+
+    Returns:
+        A Pandas DataFrame of mapping results.
+    """
+
+    keep = None if onts is None else set(x.upper() for x in onts)
+    if file_format == 'csv':
+        usecols = None if keep is None else lambda x: _gets_column_ontology(x) in keep | {None}
+        return pd.read_csv(file_path, header=0, dtype=dtype, usecols=usecols, low_memory=False)
+    data = pd.read_parquet(file_path) if file_format == 'parquet' else pd.read_feather(file_path)
+
+    return data if keep is None else data[[x for x in data.columns if _gets_column_ontology(x) in keep | {None}]]
+
+
+def _infers_mapping_format(file_path: str) -> str:
+    """Infers the file format of a mapping result file, or of the part files in a directory of partitioned results,
+    from the file extension. Compression extensions (e.g. ".csv.gz") are ignored.
+
+    Args:
+        file_path: A string containing the path to a mapping result file or a directory of partitioned results.
+
+    Returns:
+        A string containing the file format (i.e. "parquet", "feather", or "csv" for any other extension).
+    """
+
+    if os.path.isdir(file_path):
+        parts = sorted(glob.glob(os.path.join(file_path, 'ONT=*', 'part-*')))
+        file_path = parts[0] if len(parts) > 0 else file_path
+    file_name = re.sub(r'\.(gz|bz2|zip|xz)$', '', file_path)
+
+    return file_name.rsplit('.', 1)[-1] if file_name.endswith(('.parquet', '.feather')) else 'csv'
+
+
+def writes_mapping_results(data: pd.DataFrame, file_path: str, file_format: str = 'csv',
+                           compression: Optional[str] = None, onts: Optional[List] = None) -> List[str]:
+    """Writes a Pandas DataFrame of mapping results as a CSV, Parquet, or Feather file. Parquet and Feather files
+    keep the column types, so they do not need to be inferred again when the results are read back, and are much
+    smaller and faster to read and write than CSV files.
+
+    When onts is provided, the results are partitioned by ontology: file_path is treated as a directory and the
+    clinical columns together with the columns of each ontology are written to their own file, so that the results
+    for a single ontology can be read without reading the others. For example, the HP mappings are written to:
+    file_path/ONT=HP/part-00000.parquet.
+
+    Args:
+        data: A Pandas DataFrame of mapping results (e.g. the output of aggregates_mapping_results).
+        file_path: A string containing the path to write the results to.
+        file_format: A string containing the file format to write (i.e. "csv", "parquet", or "feather";
+            default="csv"). Writing Parquet and Feather files requires pyarrow.
+        compression: An optional string containing the compression codec to use (e.g. "gzip" for CSV files, "snappy",
+            "gzip", or "zstd" for Parquet files, and "lz4" or "zstd" for Feather files). If None, CSV files are
+            compressed based on the file extension and Parquet and Feather files use their default codec
+            (default=None).
+        onts: An optional list of ontology prefixes to partition the results by (default=None).
+
+    Returns:
+        A list of strings containing the paths of the written files.
+
+    Raises:
+        ValueError: If file_format is not "csv", "parquet", or "feather".
+    """
+
+    if file_format not in ['csv', 'parquet', 'feather']:
+        raise ValueError('file_format must be "csv", "parquet", or "feather".')
+
+    if onts is None:
+        _writes_mapping_file(data, file_path, file_format, compression)
+        return [file_path]
+
+    files: List = []
+    clin_cols = [x for x in data.columns if _gets_column_ontology(x) is None]
+    for ont in [x.upper() for x in onts]:
+        partition = os.path.join(file_path, 'ONT=' + ont)
+        if not os.path.exists(partition): os.makedirs(partition)
+        part_file = os.path.join(partition, 'part-00000.' + file_format)
+        ont_cols = [x for x in data.columns if _gets_column_ontology(x) == ont]
+        _writes_mapping_file(data[clin_cols + ont_cols], part_file, file_format, compression)
+        files.append(part_file)
+
+    return files
+
+
+def reads_mapping_results(file_path: str, file_format: Optional[str] = None, onts: Optional[List] = None,
+                          dtype: Optional[Dict] = None) -> pd.DataFrame:
+    """Reads the mapping results written by writes_mapping_results. When file_path is a directory of results
+    partitioned by ontology, the files of each ontology are read and their columns are combined on the clinical
+    columns, so the returned DataFrame has the same rows as the written one. When the clinical columns of each ontology
+    are in the same order, the ontology columns are concatenated; otherwise, they are joined on the clinical columns.
+
+    Args:
+        file_path: A string containing the path to a mapping result file or a directory of partitioned results.
+        file_format: An optional string containing the file format of the results (i.e. "csv", "parquet", or
+            "feather"). If None, the format is inferred from the file extension (default=None).
+        onts: An optional list of ontology prefixes to read the results of. If None, the results of all ontologies
+            are read (default=None).
+        dtype: An optional dictionary keyed by column name with the types to read CSV columns as (default=None).
+
+    Returns:
+        A Pandas DataFrame of mapping results.
+
+    Raises:
+        ValueError: If file_format is not "csv", "parquet", or "feather".
+    """
+
+    if file_format is None: file_format = _infers_mapping_format(file_path)
+    if file_format not in ['csv', 'parquet', 'feather']:
+        raise ValueError('file_format must be "csv", "parquet", or "feather".')
+
+    if not os.path.isdir(file_path): return _reads_mapping_file(file_path, file_format, onts, dtype)
+
+    if onts is None: onts = sorted(x[4:] for x in os.listdir(file_path) if x.startswith('ONT='))
+    ont_data: List = []
+    for ont in [x.upper() for x in onts]:
+        parts = sorted(glob.glob(os.path.join(file_path, 'ONT=' + ont, 'part-*.' + file_format)))
+        if len(parts) == 0: continue
+        ont_data += [pd.concat([_reads_mapping_file(x, file_format, None, dtype) for x in parts], ignore_index=True)]
+    if len(ont_data) == 0: return pd.DataFrame()
+
+    # combine the ontology columns, checking the clinical columns of each ontology are in the same order
+    data = ont_data[0]
+    clin_cols = [x for x in data.columns if _gets_column_ontology(x) is None]
+    for ont_part in ont_data[1:]:
+        ont_cols = [x for x in ont_part.columns if _gets_column_ontology(x) is not None]
+        if ont_part[clin_cols].equals(data[clin_cols]): data = pd.concat([data, ont_part[ont_cols]], axis=1)
+        else: data = data.merge(ont_part[clin_cols + ont_cols], how='outer', on=clin_cols, validate='one_to_one')
+
+    return data
+
+
 def ohdsi_ananke(primary_key: str, ont_keys: list, ont_data: pd.DataFrame, data1: pd.DataFrame, data2: pd.DataFrame) \
         -> pd.DataFrame:
     """Function applies logic from the OHDSIAnanake method to extend data1, which contains dbxref mappings to OMOP
@@ -404,14 +768,12 @@ def filters_mapping_content(exact_results: List, similarity_results: List, thres
                         list(unique_everseen(exact_label)),
                         ' | '.join(exact_evid)]
     if sim_uri:
-        if any(x for x in sim_evid[0].split(' | ') if float(x.split('_')[-1]) == 1.0):
-            evid_list = sim_evid[0].split(' | ')
-            sim_keep = [evid_list.index(x) for x in evid_list if float(x.split('_')[-1]) == 1.0]
-            uris, labels = [sim_uri[x] for x in sim_keep], [sim_label[x] for x in sim_keep]
-            sim_result = [uris, labels, ' | '.join([evid_list[x] for x in sim_keep])]
-        elif any(x for x in sim_evid[0].split(' | ') if float(x.split('_')[-1]) >= threshold):
-            evid_list = sim_evid[0].split(' | ')
-            sim_keep = [evid_list.index(x) for x in evid_list if float(x.split('_')[-1]) >= threshold]
+        evid_list, evid_idx = sim_evid[0].split(' | '), {}  # type: ignore
+        scores = np.array([float(x.split('_')[-1]) for x in evid_list])
+        first_idx = np.array([evid_idx.setdefault(x, i) for i, x in enumerate(evid_list)])  # first position of evidence
+        sim_keep = first_idx[scores == 1.0]
+        if len(sim_keep) == 0: sim_keep = first_idx[scores >= threshold]
+        if len(sim_keep) > 0:
             uris, labels = [sim_uri[x] for x in sim_keep], [sim_label[x] for x in sim_keep]
             sim_result = [uris, labels, ' | '.join([evid_list[x] for x in sim_keep])]
         else:
@@ -420,32 +782,58 @@ def filters_mapping_content(exact_results: List, similarity_results: List, thres
     return exact_result, sim_result
 
 
-def compiles_mapping_content(row: pd.Series, ont: str, threshold: float) -> Tuple:
+def plans_mapping_columns(columns: List, ont: str) -> Dict:
+    """Function takes a list of column names and classifies the mapping columns for a specific ontology by level (i.e.
+    concept and ancestor) and type (i.e. uri, label, and evidence). Exact mapping columns are classified by level and
+    similarity columns are classified separately. The plan is intended to be computed once per ontology and reused for
+    each row processed by compiles_mapping_content.
+
+    Args:
+        columns: A list of column names.
+        ont: A string containing the name of an ontology (e.g. "HP", "MONDO").
+
+    Returns:
+        plan: A dictionary keyed by "CONCEPT", "ANCESTOR", and "SIM", where each value is a tuple of three lists
+            containing the positions (in columns) of the uri, label, and evidence columns. For example:
+                {'CONCEPT': ([4], [5], [6]), 'ANCESTOR': ([], [], []), 'SIM': ([7], [8], [9])}
+    """
+
+    relevant_cols = [i for i, x in enumerate(columns)
+                     if any(y for y in ['_DBXREF_' + ont, '_STR_' + ont, ont + '_SIM'] if y in x)]
+
+    plan: Dict = {}
+    for key in ['CONCEPT', 'ANCESTOR', 'SIM']:
+        if key == 'SIM': cols = [i for i in relevant_cols if 'SIM' in columns[i]]
+        else: cols = [i for i in relevant_cols if key in columns[i] and any(y in columns[i] for y in ['DBXREF', 'STR'])]
+        plan[key] = tuple([i for i in cols if y in columns[i]] for y in ['URI', 'LABEL', 'EVIDENCE'])
+
+    return plan
+
+
+def compiles_mapping_content(row: Union[pd.Series, Dict, np.ndarray], ont: str, threshold: float,
+                             column_plan: Optional[Dict] = None) -> Tuple:
     """Function takes a row of data from a Pandas DataFrame and processes it to return a single ontology mapping for
     the clinical concept represented by the row.
 
     Args:
-        row: A row from a Pandas DataFrame cont
+        row: A row from a Pandas DataFrame or a dictionary keyed by column name with values from that row. When a
+            column_plan is provided, row can also be an array of values in the same order as the planned columns.
         ont: A string containing the name of an ontology (e.g. "HP", "MONDO").
         threshold: A float that specifies a cut-off for filtering cosine similarity results.
+        column_plan: A dictionary of mapping column positions, as returned by plans_mapping_columns (default=None).
+            If None, the plan is derived from the keys of row.
 
     Returns:
         A list containing mapping results for a given row. The list contains three items: uris, labels, evidence.
     """
 
-    relevant_cols = [x for x in row.keys() if any(y for y in ['_DBXREF_' + ont, '_STR_' + ont, ont + '_SIM'] if y in x)]
+    if column_plan is None:
+        cols = list(row.keys())  # type: ignore
+        column_plan, row = plans_mapping_columns(cols, ont), [row[x] for x in cols]
 
+    sim_uri, sim_label, sim_evid = _extracts_mapping_columns(row, column_plan['SIM'])
     for level in ['CONCEPT', 'ANCESTOR']:
-        exact_uri, exact_label, exact_evid, sim_uri, sim_label, sim_evid = ([] for _ in range(6))  # type: ignore
-        for col in relevant_cols:
-            if level in col and any(y for y in ['DBXREF', 'STR'] if y in col):
-                if 'URI' in col and row[col] != '': exact_uri += [x.split('/')[-1] for x in row[col].split(' | ')]
-                if 'LABEL' in col and row[col] != '': exact_label += [x for x in row[col].split(' | ')]
-                if 'EVIDENCE' in col and row[col] != '': exact_evid += [row[col]]
-            if 'SIM' in col:
-                if 'URI' in col and row[col] != '': sim_uri += [x.split('/')[-1] for x in row[col].split(' | ')]
-                if 'LABEL' in col and row[col] != '': sim_label += [x for x in row[col].split(' | ')]
-                if 'EVIDENCE' in col and row[col] != '': sim_evid += [row[col]]
+        exact_uri, exact_label, exact_evid = _extracts_mapping_columns(row, column_plan[level])
         if exact_uri: break
 
     # put together mapping
@@ -455,7 +843,122 @@ def compiles_mapping_content(row: pd.Series, ont: str, threshold: float) -> Tupl
         return filters_mapping_content([exact_uri, exact_label, exact_evid], [sim_uri, sim_label, sim_evid], threshold)
 
 
-def formats_mapping_evidence(ont_dict: dict, source_dict: Dict, result: Tuple, clin_data: Dict) -> Tuple:
+def _extracts_mapping_columns(row: Any, cols: Tuple) -> Tuple[List, List, List]:
+    """Function splits the non-empty uri, label, and evidence values for a set of planned columns in a row.
+
+    Args:
+        row: A list or array of values from a row of mapping data.
+        cols: A tuple of three lists containing the positions of the uri, label, and evidence columns.
+
+    Returns:
+        A tuple of three lists containing uris, labels, and evidence.
+    """
+
+    uris = [x.split('/')[-1] for i in cols[0] if row[i] != '' for x in row[i].split(' | ')]
+    labels = [x for i in cols[1] if row[i] != '' for x in row[i].split(' | ')]
+    evidence = [row[i] for i in cols[2] if row[i] != '']
+
+    return uris, labels, evidence
+
+
+def _filters_similarity_rows(mapping_table: pd.DataFrame, primary_key: str, threshold: float) -> pd.DataFrame:
+    """Function filters the similarity rows of a long-format mapping table on their numeric scores. For each primary
+    key, only the similarity matches with a score of 1.0 are kept if there are any, otherwise the matches with a score
+    of at least threshold are kept. If no match meets the threshold, all of the matches of the primary key are kept.
+    Exact mapping rows are not filtered.
+
+    Args:
+        mapping_table: A long-format Pandas DataFrame of mapping results (see renders_mapping_table).
+        primary_key: A string containing the column name of the primary key.
+        threshold: A float that specifies a cut-off for filtering cosine similarity results.
+
+    Returns:
+        A Pandas DataFrame containing the filtered rows of mapping_table, in their original order.
+    """
+
+    sim = mapping_table['SOURCE'] == 'SIM'
+    # float32 scores are compared at the 3 decimal precision they are rendered with in the evidence strings
+    scores = mapping_table['SCORE'].where(sim).astype(float).round(3)
+    exact_match, above = scores == 1.0, scores >= threshold
+    keys = mapping_table[primary_key]
+    has_exact = exact_match.groupby(keys).transform('any').astype(bool)
+    has_above = above.groupby(keys).transform('any').astype(bool)
+
+    return mapping_table[~sim | exact_match | (~has_exact & above) | (~has_exact & ~has_above)]
+
+
+def _groups_mapping_table(mapping_table: pd.DataFrame, primary_key: str, ont: str, threshold: float) -> Dict:
+    """Function groups the rows of a long-format mapping table for a single ontology by primary key and level into the
+    uri, label, and evidence lists that compiles_mapping_content extracts from the pipe-delimited mapping columns. The
+    similarity rows are filtered on their scores (see _filters_similarity_rows) before their evidence is rendered.
+
+    Args:
+        mapping_table: A long-format Pandas DataFrame of mapping results (see renders_mapping_table).
+        primary_key: A string containing the column name of the primary key.
+        ont: A string containing the name of an ontology (e.g. "HP", "MONDO").
+        threshold: A float that specifies a cut-off for filtering cosine similarity results.
+
+    Returns:
+        mapping_content: A dictionary keyed by primary key, where each value is a dictionary keyed by level (i.e.
+            "CONCEPT", "ANCESTOR", and "SIM") with a tuple of uri, label, and evidence lists as values.
+    """
+
+    cols = [primary_key, 'LEVEL', 'SOURCE', 'ONT_URI', 'ONT_LABEL', 'EVIDENCE', 'SCORE']
+    ont_table = _filters_similarity_rows(mapping_table[mapping_table['ONT'] == ont], primary_key, threshold)
+    rows, grouped = ont_table[cols].to_numpy(dtype=object), {}  # type: Any, Dict
+    for key, level, source, uri, label, evidence, score in rows:
+        levels = grouped.setdefault(key, {})
+        if source == 'SIM':
+            sim = levels.setdefault('SIM', ([], [], []))
+            sim[0].append(uri); sim[1].append(label); sim[2].append(uri + '_' + str(round(float(score), 3)))
+        else:
+            exact = levels.setdefault(level, {}).setdefault(source, ({}, {}, {}))
+            exact[0][uri] = None; exact[1][label] = None; exact[2][evidence] = None
+
+    mapping_content: Dict = {}
+    for key, levels in grouped.items():
+        content = mapping_content[key] = {}
+        for level, sources in levels.items():
+            if level == 'SIM': content[level] = (levels[level][0], levels[level][1], [' | '.join(levels[level][2])])
+            else:
+                sources = [sources[x] for x in ['DBXREF', 'STR'] if x in sources]
+                content[level] = ([x.split('/')[-1] for y in sources for x in y[0]],
+                                  [x for y in sources for x in y[1]], [' | '.join(y[2]) for y in sources])
+
+    return mapping_content
+
+
+def _selects_mapping_content(content: Dict) -> Tuple:
+    """Function selects the exact mapping results for the first level with results and formats them together with the
+    similarity results, which were already filtered, for a primary key grouped by _groups_mapping_table.
+
+    Args:
+        content: A dictionary keyed by level with a tuple of uri, label, and evidence lists as values.
+
+    Returns:
+        A tuple of lists containing mapping results for a given row. The first list contains exact mapping results and
+            the second contains similarity results. Both lists contains 3 items: uris, labels, and evidence.
+    """
+
+    empty: Tuple = ([], [], [])
+    exact, sim = empty, content.get('SIM', empty)
+    for level in ['CONCEPT', 'ANCESTOR']:
+        exact = content.get(level, empty)
+        if exact[0]: break
+
+    # put together mapping
+    exact_result: List[Any] = [None, None, None]
+    sim_result: List[Any] = [None, None, None]
+    if exact[0]:
+        exact_result = [list(unique_everseen(exact[0])), list(unique_everseen(exact[1])), ' | '.join(exact[2])]
+    if sim[0]:
+        sim_result = [sim[0], sim[1], ' | '.join(sim[2])]
+
+    return exact_result, sim_result
+
+
+def formats_mapping_evidence(ont_dict: dict, source_dict: Dict, result: Tuple, clin_data: Dict,
+                             dbxref_type: Optional[Dict] = None) -> Tuple:
     """Takes a nested dictionary of ontology attributes, a dictionary of source code prefix mapping information, a
     nested list containing aggregated mapping information, and a dictionary of clinical concept labels and synonyms.
     The function uses this information to aggregate the evidence supporting the mapping provided in the result object.
@@ -466,6 +969,8 @@ def formats_mapping_evidence(ont_dict: dict, source_dict: Dict, result: Tuple, c
         result: A list containing mapping results for a given row. The list contains three items: uris, labels,
             evidence.
         clin_data: A dictionary keyed by column identifier with values containing data from the keyed column.
+        dbxref_type: A dictionary of normalized ontology database cross references, as returned by
+            normalizes_clinical_source_codes (default=None). If None, it is derived from ont_dict and source_dict.
 
     Returns:
         A tuple. Where the first item contains evidence for exact matches and the second contains evidence for cosine
@@ -474,37 +979,32 @@ def formats_mapping_evidence(ont_dict: dict, source_dict: Dict, result: Tuple, c
     """
 
     dbx_evid, lab_evid, syn_evid, sim_evid = ([] for _ in range(4))  # type: ignore
-    ont_label, ont_syns, ont_syntp = ont_dict['label'], ont_dict['synonym'], ont_dict['synonym_type']
-    dbxref_type = normalizes_clinical_source_codes(ont_dict['dbxref_type'], source_dict)
+    if dbxref_type is None: dbxref_type = normalizes_clinical_source_codes(ont_dict['dbxref_type'], source_dict)
 
     # sort clinical data
     if None not in result[0]:
+        uris, clin_index = set(result[0][0]), {}  # type: ignore
         for x in result[0][2].split(' | '):
-            lvl = x.split('_')[0]
-            clin = {k: v for k, v in clin_data.items() if lvl in k}
-
-            if 'dbxref' in x.lower():
+            lvl, evid_type, evid_value = x.split('_')[0], x.lower(), x.split(':')[-1]
+            if 'dbxref' in evid_type:
                 if x.split('_')[-1] in dbxref_type.keys():
                     prefix = dbxref_type[x.split('_')[-1]]
                 else:
                     prefix = 'DbXref*' + x.split('_')[-1].split(':')[0]
                 updated_prefix = 'OBO_' + prefix.split('*')[0] + '-OMOP_' + lvl + '_CODE'
                 dbx_evid.append(updated_prefix + ':' + prefix.split('*')[-1] + '_' + x.split(':')[-1].replace(':', '_'))
-            if 'label' in x.lower():
-                lab_evid, clin_lab = [], ' | '.join([clin[x] for x in clin.keys() if 'label' in x.lower()])
-                for lab in set(clin_lab.split(' | ')):
-                    if lab.lower() in ont_label.keys() and ont_label[lab.lower()].split('/')[-1] in result[0][0]:
-                        lab_evid.append('OBO_LABEL-OMOP_' + x.split('_')[0] + '_LABEL:' + x.split(':')[-1])
-                    if lab.lower() in ont_syns.keys() and ont_syns[lab.lower()].split('/')[-1] in result[0][0]:
-                        lab_evid.append('OBO_' + ont_syntp[lab.lower()] + '-OMOP_' + lvl + '_LABEL:' + x.split(':')[-1])
-            if 'synonym' in x.lower():
-                syn_evid, clin_syn = [], ' | '.join([clin[x] for x in clin.keys() if 'synonym' in x.lower()])
-                for syn in set(clin_syn.split(' | ')):
-                    if syn.lower() in ont_label.keys() and ont_label[syn.lower()].split('/')[-1] in result[0][0]:
-                        syn_evid.append('OBO_LABEL-OMOP_' + x.split('_')[0] + '_SYNONYM:' + x.split(':')[-1])
-                    if clin_syn.lower() in ont_syns.keys() and ont_syns[syn.lower()].split('/')[-1] in result[0][0]:
-                        syn_lab = '-OMOP_' + lvl + '_SYNONYM:'
-                        syn_evid.append('OBO_' + ont_syntp[syn.lower()] + syn_lab + x.split(':')[-1])
+            if ('label' in evid_type or 'synonym' in evid_type) and lvl not in clin_index:
+                clin_index[lvl] = _indexes_clinical_evidence(ont_dict, clin_data, lvl)
+            if 'label' in evid_type:
+                lab_evid = []
+                for label_uri, syn_uri, syn_type in clin_index[lvl][0]:
+                    if label_uri in uris: lab_evid.append('OBO_LABEL-OMOP_' + lvl + '_LABEL:' + evid_value)
+                    if syn_uri in uris: lab_evid.append('OBO_' + syn_type + '-OMOP_' + lvl + '_LABEL:' + evid_value)
+            if 'synonym' in evid_type:
+                syn_evid = []
+                for label_uri, syn_uri, syn_type in clin_index[lvl][1]:
+                    if label_uri in uris: syn_evid.append('OBO_LABEL-OMOP_' + lvl + '_SYNONYM:' + evid_value)
+                    if syn_uri in uris: syn_evid.append('OBO_' + syn_type + '-OMOP_' + lvl + '_SYNONYM:' + evid_value)
     if None not in result[1]:
         sim_evid = ['CONCEPT_SIMILARITY:' + x for x in result[1][-1].split(' | ')]
 
@@ -515,6 +1015,40 @@ def formats_mapping_evidence(ont_dict: dict, source_dict: Dict, result: Tuple, c
     return compiled_exact, compiled_sim
 
 
+def _indexes_clinical_evidence(ont_dict: dict, clin_data: Dict, lvl: str) -> Tuple[List, List]:
+    """Function looks up the clinical labels and synonyms for a specific level (e.g. "CONCEPT", "ANCESTOR") in the
+    ontology label and synonym dictionaries. Ontology synonyms are only matched to clinical synonyms when the joined
+    clinical synonym string is itself an ontology synonym, which mirrors the original evidence formatting.
+
+    Args:
+        ont_dict: A nested dictionary containing ontology attributes.
+        clin_data: A dictionary keyed by column identifier with values containing data from the keyed column.
+        lvl: A string containing the level of the clinical data (e.g. "CONCEPT", "ANCESTOR").
+
+    Returns:
+        A tuple of two lists, one for the unique normalized clinical labels and one for the synonyms. Each list contains
+            a tuple per string with the matching ontology label identifier, the matching ontology synonym identifier,
+            and the ontology synonym type (None when there is no match).
+    """
+
+    ont_label, ont_syns, ont_syntp = ont_dict['label'], ont_dict['synonym'], ont_dict['synonym_type']
+    clin = {k: v for k, v in clin_data.items() if lvl in k}
+    clin_lab = ' | '.join([clin[x] for x in clin.keys() if 'label' in x.lower()])
+    clin_syn = ' | '.join([clin[x] for x in clin.keys() if 'synonym' in x.lower()])
+    syn_match = clin_syn.lower() in ont_syns.keys()
+
+    index: Tuple[List, List] = ([], [])
+    for i, (strings, match_syns) in enumerate([(clin_lab, True), (clin_syn, syn_match)]):
+        for string in unique_everseen(x.lower() for x in strings.split(' | ')):
+            label_uri = ont_label[string].split('/')[-1] if string in ont_label.keys() else None
+            if match_syns and string in ont_syns.keys():
+                index[i].append((label_uri, ont_syns[string].split('/')[-1], ont_syntp[string]))
+            else:
+                index[i].append((label_uri, None, None))
+
+    return index
+
+
 def assigns_mapping_category(mapping_result: List, map_evidence: str) -> str:
     """Function takes a mapping result and evidence and uses it to determine the mapping category.
 
@@ -548,13 +1082,195 @@ def assigns_mapping_category(mapping_result: List, map_evidence: str) -> str:
     return mapping_category
 
 
+def compiles_ontology_mappings(data: pd.DataFrame, ont: str, ont_dict: Dict, source_codes: Dict, clin_cols: List,
+                               threshold: float = 0.25, progress: bool = True,
+                               mapping_table: Optional[pd.DataFrame] = None, primary_key: Optional[str] = None) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """Function takes a Pandas DataFrame containing the mapping columns for a single ontology and the clinical label
+    and synonym columns and derives the aggregated exact and similarity mapping results for each row. The relevant
+    columns are resolved and classified once and only rows with at least one non-empty mapping column are processed.
+
+    When a long-format mapping_table is provided, the mapping results are read from it (matching rows on primary_key)
+    instead of being split out of the pipe-delimited mapping columns in data.
+
+    Args:
+        data: A Pandas DataFrame of mapping results from running the OMOP2OBO exact mapping and concept similarity
+            pipeline.
+        ont: A string containing the name of an ontology (e.g. "HP", "MONDO").
+        ont_dict: A nested dictionary containing ontology attributes for the ontology specified by ont.
+        source_codes: A dictionary containing dbxref mappings between dbxref prefixes that is designed to normalize
+            prefixes to a single type.
+        clin_cols: A list of column names containing clinical concept labels and synonyms.
+        threshold: A float that specifies a cut-off for filtering cosine similarity results (default = 0.25).
+        progress: A bool indicating whether or not to display a progress bar (default=True).
+        mapping_table: A long-format Pandas DataFrame of mapping results, see renders_mapping_table (default=None).
+        primary_key: A string containing the column name of the primary key, required with mapping_table
+            (default=None).
+
+    Returns:
+        A tuple of two object arrays, each with one row per row in data and four columns (i.e. uris, labels, mapping
+            category, and mapping evidence). The first array contains the exact mapping results and the second
+            contains the similarity results. Rows without results are filled with None.
+    """
+
+    exact_mappings = np.full((len(data), 4), None, dtype=object)
+    sim_mappings = np.full((len(data), 4), None, dtype=object)
+
+    # resolve ontology columns, or mapping table content, and rows with at least one mapping result
+    if mapping_table is None:
+        ont_list = ['DBXREF_' + ont, 'STR_' + ont, ont + '_SIM']
+        ont_cols = [x for x in data.columns if any(y for y in ont_list if y in x)]
+        if len(ont_cols) == 0: return exact_mappings, sim_mappings
+        mapped_rows = np.flatnonzero((data[ont_cols] != '').any(axis=1).to_numpy())
+        ont_values, column_plan = data[ont_cols].to_numpy(dtype=object), plans_mapping_columns(ont_cols, ont)
+    else:
+        mapping_content = _groups_mapping_table(mapping_table, str(primary_key), ont, threshold)
+        keys = data[primary_key].to_numpy(dtype=object)
+        mapped_rows = np.array([i for i, x in enumerate(keys) if x in mapping_content], dtype=int)
+    clin_values = data[clin_cols].to_numpy(dtype=object)
+    dbxref_type = normalizes_clinical_source_codes(ont_dict['dbxref_type'], source_codes)
+
+    for idx in tqdm(mapped_rows, disable=not progress):
+        if mapping_table is None: map_info = compiles_mapping_content(ont_values[idx], ont, threshold, column_plan)
+        else: map_info = _selects_mapping_content(mapping_content[keys[idx]])
+        clin_data = dict(zip(clin_cols, clin_values[idx]))
+        ext_evid, sim_evid = formats_mapping_evidence(ont_dict, source_codes, map_info, clin_data, dbxref_type)
+        # get exact mapping information
+        if ext_evid != '':
+            exact_mappings[idx] = [' | '.join(map_info[0][0]), ' | '.join(map_info[0][1]),
+                                   assigns_mapping_category(map_info[0], ext_evid), ext_evid]
+        # get similarity information
+        if sim_evid != '':
+            sim_mappings[idx] = [' | '.join(map_info[1][0]), ' | '.join(map_info[1][1]),
+                                 assigns_mapping_category(map_info[1], sim_evid), sim_evid]
+
+    return exact_mappings, sim_mappings
+
+
+def _initializes_aggregation_worker(ont_data: Dict, source_codes: Dict) -> None:
+    """Stores the ontology data needed by an aggregation worker process. When processes are forked the data are
+    inherited from the parent process, otherwise they are sent once per worker rather than once per task.
+
+    Args:
+        ont_data: A nested dictionary of ontology data keyed by ontology (e.g. "hp", "mondo").
+        source_codes: A dictionary containing dbxref mappings between dbxref prefixes.
+
+    Returns:
+        None.
+    """
+
+    _worker_data['ont_data'], _worker_data['source_codes'] = ont_data, source_codes
+
+    return None
+
+
+def _compiles_ontology_chunk(args: Tuple) -> Tuple[np.ndarray, np.ndarray]:
+    """Runs compiles_ontology_mappings on a chunk of rows within an aggregation worker process.
+
+    Args:
+        args: A tuple containing a Pandas DataFrame chunk, an ontology name, a list of clinical columns, a similarity
+            threshold, and the mapping table rows for the chunk and primary key (both None if not used).
+
+    Returns:
+        A tuple of two object arrays containing the exact and similarity results for the chunk.
+    """
+
+    chunk, ont, clin_cols, threshold, mapping_table, primary_key = args
+    ont_dict, source_codes = _worker_data['ont_data'][ont.lower()], _worker_data['source_codes']
+
+    return compiles_ontology_mappings(chunk, ont, ont_dict, source_codes, clin_cols, threshold, False, mapping_table,
+                                      primary_key)
+
+
+def _aggregates_ontology_rows(data: pd.DataFrame, ont: str, ont_data: Dict, source_codes: Dict, clin_cols: List,
+                              threshold: float, pool: Optional[Any], workers: int,
+                              ont_table: Optional[pd.DataFrame] = None, primary_key: Optional[str] = None) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """Runs compiles_ontology_mappings for a single ontology on the rows of data, either in the current process or,
+    when a pool is provided, on contiguous chunks of rows in the pool's worker processes.
+
+    Args:
+        data: A Pandas DataFrame of mapping results.
+        ont: A string containing the upper-case name of an ontology (e.g. "HP").
+        ont_data: A nested dictionary of ontology data keyed by lower-case ontology name.
+        source_codes: A dictionary containing dbxref mappings between dbxref prefixes.
+        clin_cols: A list of column names containing clinical concept labels and synonyms.
+        threshold: A float that specifies a cut-off for filtering cosine similarity results.
+        pool: An optional multiprocessing Pool of aggregation workers (see _initializes_aggregation_worker).
+        workers: An integer specifying the number of worker processes in pool.
+        ont_table: An optional long-format Pandas DataFrame of the mapping results of the ontology (default=None).
+        primary_key: A string containing the column name of the primary key, required with ont_table (default=None).
+
+    Returns:
+        A tuple of two object arrays containing the exact and similarity results for each row of data.
+    """
+
+    if pool is None or len(data) < 2:
+        return compiles_ontology_mappings(data, ont, ont_data[ont.lower()], source_codes, clin_cols, threshold, True,
+                                          ont_table, primary_key)
+
+    ont_list = ['DBXREF_' + ont, 'STR_' + ont, ont + '_SIM']
+    if ont_table is None: sub_cols = [x for x in data.columns if any(y for y in ont_list if y in x)]
+    else: sub_cols = [str(primary_key)]
+    tasks = []
+    for x in [x for x in np.array_split(np.arange(len(data)), min(len(data), workers * 4)) if len(x)]:
+        chunk, chunk_table = data.iloc[x[0]:x[-1] + 1][sub_cols + clin_cols], None
+        if ont_table is not None: chunk_table = ont_table[ont_table[primary_key].isin(chunk[primary_key])]
+        tasks.append((chunk, ont, clin_cols, threshold, chunk_table, primary_key))
+    results = list(tqdm(pool.imap(_compiles_ontology_chunk, tasks), total=len(tasks)))
+
+    return np.vstack([x[0] for x in results]), np.vstack([x[1] for x in results])
+
+
+def _finds_key_rows(sorted_keys: np.ndarray, order: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Finds the rows whose key is in keys with a binary search over row keys that were sorted once, so that looking up
+    the rows of a small set of keys does not scan all rows.
+
+    Args:
+        sorted_keys: A numpy array of row keys in sorted order.
+        order: A numpy array of the row positions of sorted_keys (i.e. the argsort of the unsorted row keys).
+        keys: A numpy array of the keys to find, which may contain duplicates.
+
+    Returns:
+        A sorted numpy array of the positions of the rows with a key in keys.
+    """
+
+    # cast the keys to the type of sorted_keys, so it is not cast to the type of keys on every search, dropping keys
+    # that are longer than any row key and so cannot be found
+    keys = np.unique(keys)
+    if sorted_keys.dtype.kind == 'U':
+        keys = keys[np.char.str_len(keys.astype(str)) <= sorted_keys.dtype.itemsize // 4]
+    keys = keys.astype(sorted_keys.dtype)
+    lo, hi = np.searchsorted(sorted_keys, keys, 'left'), np.searchsorted(sorted_keys, keys, 'right')
+    counts = hi - lo
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+
+    return np.sort(order[offsets])
+
+
 def aggregates_mapping_results(data: pd.DataFrame, onts: List, ont_data: Dict, source_codes: Dict,
-                               threshold: float = 0.25) -> pd.DataFrame:
+                               threshold: float = 0.25, workers: int = 1, mapping_table: Optional[pd.DataFrame] = None,
+                               primary_key: Optional[str] = None, size_limit: Optional[int] = 32500,
+                               similarity_directory: Optional[str] = None, similarity_format: str = 'csv') \
+        -> pd.DataFrame:
     """Function takes a Pandas Dataframe containing the results from running the OMOP2OBO exact and similarity
     mapping functions. This function takes those results and aggregates them such that a single column set of
     evidence is returned for each ontology (i.e. uris, labels, mapping category, and mapping evidence).
 
-    #TODO: this function could (should) be parallelized
+    When workers is greater than 1, the rows are sharded into contiguous chunks which are processed by a pool of
+    worker processes. Each task only receives the columns relevant to the ontology being processed and the results
+    are reassembled in the original row order, so the output does not depend on the number of workers.
+
+    When a long-format mapping_table is provided (i.e. the ConceptAnnotator mapping_table and SimilarStringFinder
+    similarity_scores), the mapping results are read from it instead of from the pipe-delimited mapping columns.
+
+    When a similarity_directory is provided (i.e. the output_directory of SimilarStringFinder.scores_tfidf), the
+    similarity results are read from it one part file at a time. Each part holds all of the matches of its primary
+    keys for an ontology, so the rows of those keys are aggregated together with their exact mapping_table rows
+    before the next part is read, and memory use does not grow with the number of similarity matches. The rows of
+    each part are found with a binary search over primary keys that are sorted once per ontology and the rendered
+    similarity columns of each part (e.g. "HP_SIM_ONT_URI") are added to data, so the output matches the output of
+    merging the in-memory similarity results into data.
 
     Args:
         data: A Pandas DataFrame of mapping results from running the OMOP2OBO exact mapping and concept similarity
@@ -565,58 +1281,98 @@ def aggregates_mapping_results(data: pd.DataFrame, onts: List, ont_data: Dict, s
         source_codes: A dictionary containing dbxref mappings between dbxref prefixes that is designed to normalize
             prefixes to a single type.
         threshold: A float that specifies a cut-off for filtering cosine similarity results (default = 0.25).
+        workers: An integer specifying the number of worker processes to use (default=1).
+        mapping_table: A long-format Pandas DataFrame of mapping results, see renders_mapping_table (default=None).
+        primary_key: A string containing the column name of the primary key, required with mapping_table
+            (default=None).
+        size_limit: An integer specifying the maximum length of text fields, which defaults to the current size
+            limit for an Excel column (default=32500). Text fields are not shortened if None (e.g. when the output is
+            not intended to be opened in Excel).
+        similarity_directory: An optional string containing the path to a directory of similarity scores partitioned
+            by ontology, which requires mapping_table (default=None).
+        similarity_format: A string containing the file format of the similarity scores (i.e. "csv" or "parquet";
+            default="csv").
 
     Return:
         A Pandas DataFrame containing the original columns with 8 additional columns per ontology, where the first
             set of 4 columns contain the exact match results and the second set of 4 columns contains the concept
             similarity results.
+
+    Raises:
+        ValueError:
+            If mapping_table is provided without primary_key.
+            If similarity_directory is provided without mapping_table.
     """
 
     print('\n#### AGGREGATING AND COMPILING MAPPING RESULTS ####')
-    print('Note. Until parallelized this step can up to several hours to complete for large concept sets...\n')
+
+    if mapping_table is not None and primary_key is None:
+        raise ValueError('primary_key must be provided with mapping_table')
+    if similarity_directory is not None and mapping_table is None:
+        raise ValueError('mapping_table must be provided with similarity_directory')
 
     # set input variables
     cols = [x.lower() for x in data.columns]
     clin_cols = [x for x in cols if (x.endswith('label') or x.endswith('nym')) and not any(y for y in onts if y in x)]
-
-    for ont in [x.upper() for x in onts]:
-        print('Processing {} Mappings'.format(ont))
-        exact_mappings: List[Any] = []
-        sim_mappings: List[Any] = []
-        for idx, row in tqdm(data.iterrows(), total=data.shape[0]):
-            ont_list = ['DBXREF_' + ont, 'STR_' + ont, ont + '_SIM']
-            res = [x for x in row.keys() if row[x] != '' and any(y for y in ont_list if y in x)]
-            if len(res) != 0:
-                map_info = compiles_mapping_content(row, ont, threshold)
-                clin_data = {x.upper(): row[x.upper()] for x in clin_cols if x.upper() in row.keys()}
-                ext_evid, sim_evid = formats_mapping_evidence(ont_data[ont.lower()], source_codes, map_info, clin_data)
-                # get exact mapping information
-                if ext_evid != '':
-                    exact_mappings.append([' | '.join(map_info[0][0]), ' | '.join(map_info[0][1]),
-                                           assigns_mapping_category(map_info[0], ext_evid), ext_evid])
-                else: exact_mappings.append([None] * 4)
-                # get similarity information
-                if sim_evid != '':
-                    sim_mappings.append([' | '.join(map_info[1][0]), ' | '.join(map_info[1][1]),
-                                         assigns_mapping_category(map_info[1], sim_evid), sim_evid])
-                else: sim_mappings.append([None] * 4)
+    clin_cols = [x.upper() for x in clin_cols if x.upper() in data.columns]
+    pool = None
+    if workers > 1 and len(data) > 1:
+        shared_data = {x.lower(): ont_data[x.lower()] for x in onts}
+        pool = multiprocessing.Pool(workers, initializer=_initializes_aggregation_worker,
+                                    initargs=(shared_data, source_codes))
+    aggregate = partial(_aggregates_ontology_rows, ont_data=ont_data, source_codes=source_codes, clin_cols=clin_cols,
+                        threshold=threshold, pool=pool, workers=workers, primary_key=primary_key)
+
+    if similarity_directory is not None:  # add the rendered similarity columns in the order of ont_data
+        sim_onts = [x.upper() for x in ont_data.keys() if x.lower() in [y.lower() for y in onts]]
+        for col in [x + '_SIM_ONT_' + y for x in sim_onts for y in ['URI', 'LABEL', 'EVIDENCE']]: data[col] = ''
+
+    try:
+        for ont in [x.upper() for x in onts]:
+            print('Processing {} Mappings'.format(ont))
+            ont_table: Any = None if mapping_table is None else mapping_table[mapping_table['ONT'] == ont]
+            if similarity_directory is None:
+                exact_mappings, sim_mappings = aggregate(data, ont, ont_table=ont_table)
             else:
-                exact_mappings.append([None] * 4)
-                sim_mappings.append([None] * 4)
-
-        # add aggregated mapping results back to data frame
-        data['AGGREGATED_' + ont + '_URI'] = [x[0] for x in exact_mappings]
-        data['AGGREGATED_' + ont + '_LABEL'] = [x[1] for x in exact_mappings]
-        data['AGGREGATED_' + ont + '_MAPPING'] = [x[2] for x in exact_mappings]
-        data['AGGREGATED_' + ont + '_EVIDENCE'] = [x[3] for x in exact_mappings]
-        data['SIMILARITY_' + ont + '_URI'] = [x[0] for x in sim_mappings]
-        data['SIMILARITY_' + ont + '_LABEL'] = [x[1] for x in sim_mappings]
-        data['SIMILARITY_' + ont + '_MAPPING'] = [x[2] for x in sim_mappings]
-        data['SIMILARITY_' + ont + '_EVIDENCE'] = [x[3] for x in sim_mappings]
+                exact_mappings = np.full((len(data), 4), None, dtype=object)
+                sim_mappings = np.full((len(data), 4), None, dtype=object)
+                keys, done = data[primary_key].to_numpy(dtype=str), np.zeros(len(data), dtype=bool)
+                table_keys = ont_table[primary_key].to_numpy(dtype=str)
+                key_order, table_order = np.argsort(keys, kind='stable'), np.argsort(table_keys, kind='stable')
+                key_index = (keys[key_order], key_order)
+                table_index = (table_keys[table_order], table_order)
+                sim_cols = [ont + '_SIM_ONT_' + x for x in ['URI', 'LABEL', 'EVIDENCE']]
+                dtype = {str(primary_key): str, 'SCORE': np.float32}
+                for part in reads_partitioned_data(similarity_directory, 'ONT', similarity_format, [ont], dtype):
+                    part_keys = part[primary_key].to_numpy(dtype=str)
+                    rows = _finds_key_rows(*key_index, part_keys)
+                    if len(rows) == 0: continue
+                    part_table = pd.concat([ont_table.iloc[_finds_key_rows(*table_index, part_keys)], part])
+                    exact_mappings[rows], sim_mappings[rows] = aggregate(data.iloc[rows], ont, ont_table=part_table)
+                    rendered = renders_mapping_table(part, str(primary_key)).set_index(primary_key)
+                    rendered.index = rendered.index.astype(str)
+                    if sim_cols[0] in rendered.columns:
+                        data.iloc[rows, [data.columns.get_loc(x) for x in sim_cols]] = \
+                            rendered.reindex(keys[rows])[sim_cols].fillna('').to_numpy()
+                    done[rows] = True
+                rows = np.flatnonzero(~done)
+                if len(rows) > 0:
+                    exact_mappings[rows], sim_mappings[rows] = aggregate(data.iloc[rows], ont, ont_table=ont_table)
+
+            # add aggregated mapping results back to data frame
+            for i, col in enumerate(['URI', 'LABEL', 'MAPPING', 'EVIDENCE']):
+                data['AGGREGATED_' + ont + '_' + col] = exact_mappings[:, i]
+            for i, col in enumerate(['URI', 'LABEL', 'MAPPING', 'EVIDENCE']):
+                data['SIMILARITY_' + ont + '_' + col] = sim_mappings[:, i]
+    finally:
+        if pool is not None: pool.close(); pool.join()
 
     # shortens long text fields in original output data (otherwise Excel expands columns into additional rows)
-    size_limit = 32500  # current size limit for an Excel column
-    for x in data.columns:
-        data[x] = data[x].apply(lambda i: i[0:size_limit] if not isinstance(i, int) and i is not None else i)
+    if size_limit is not None:
+        text_cols = [x for x in data.columns if data[x].dtype == object and
+                     pd.api.types.infer_dtype(data[x], skipna=True) in ['string', 'mixed', 'mixed-integer']]
+        for x in text_cols:
+            long_text = data[x].str.len() > size_limit
+            if long_text.any(): data.loc[long_text, x] = data.loc[long_text, x].str.slice(0, size_limit)
 
     return data
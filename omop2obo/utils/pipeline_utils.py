@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pipeline Utility Functions.
+
+Stage Input Hashing
+* hashes_inputs
+
+Stage Checkpointing
+* PipelineRunner
+
+"""
+
+# import needed libraries
+import glob
+import hashlib
+import multiprocessing
+import os
+import pickle
+import re
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import pandas as pd  # type: ignore
+
+
+def hashes_inputs(inputs: Sequence) -> str:
+    """Creates an md5 hash of the inputs of a pipeline stage. Strings that are paths to existing files are hashed by
+    their content, so a stage is re-run when an input file changes, and all other inputs (e.g. parameters) are hashed
+    by their representation.
+
+    Args:
+        inputs: A list or tuple of stage inputs (e.g. file paths, strings, numbers, or lists and tuples of these).
+
+    Returns:
+        A string containing an md5 hexdigest.
+    """
+
+    input_hash = hashlib.md5()
+    for value in inputs:
+        if isinstance(value, str) and os.path.isfile(value):
+            input_hash.update(bytes('file\t' + value + '\n', 'utf-8'))
+            with open(value, 'rb') as handle:
+                for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+                    input_hash.update(chunk)
+        else:
+            input_hash.update(bytes('value\t' + repr(value) + '\n', 'utf-8'))
+
+    return input_hash.hexdigest()
+
+
+class _CheckpointedFrame(object):
+    """Stands in for a DataFrame in a pickled checkpoint, when the DataFrame itself is written to a Parquet file.
+
+    Attributes:
+        file_name: A string containing the name of the Parquet file, relative to the checkpoint directory.
+    """
+
+    def __init__(self, file_name: str) -> None:
+
+        self.file_name: str = file_name
+
+
+def _runs_stage_process(function: Callable, dependencies: List, connection: Connection) -> None:
+    """Runs a pipeline stage in a child process and sends its output, or the error it raised, back to the parent.
+
+    Args:
+        function: The function of the stage.
+        dependencies: A list of the outputs of the stages the stage depends on.
+        connection: The sending end of a multiprocessing Pipe.
+
+    Returns:
+        None.
+    """
+
+    try:
+        connection.send((True, function(*dependencies)))
+    except Exception as error:
+        try:
+            connection.send((False, error))
+        except Exception:
+            connection.send((False, RuntimeError(repr(error))))
+    finally:
+        connection.close()
+
+    return None
+
+
+class PipelineRunner(object):
+    """Runs the named stages of a pipeline in dependency order. Each stage is a function that is called with the
+    outputs of the stages it depends on and its output is checkpointed to checkpoint_directory, where DataFrames in
+    the output (i.e. the output itself or the items of an output tuple) are written to Parquet files and everything
+    else is pickled. DataFrames are also pickled when they cannot be written to Parquet (e.g. pyarrow is not
+    installed or a column mixes types). A checkpoint is keyed by an md5 hash of the stage's inputs and of the keys of
+    the stages it depends on, so when the pipeline is re-run, stages whose inputs have not changed are loaded from
+    their checkpoint instead of being run again and a crash only loses the work of the stages that were running.
+    Stages that do not depend on each other are run concurrently, either in threads or, for CPU-bound stages, in
+    separate processes. Where the platform supports it, processes are forked, so they share the outputs of earlier
+    stages (e.g. ontology data) with the parent process instead of receiving a copy, and only their own output is
+    sent back.
+
+    Attributes:
+        checkpoint_directory: An optional string containing the path to a directory to store checkpoints in. If None,
+            every stage is run and no checkpoints are written.
+        n_workers: An optional integer specifying the number of stages to run at the same time. If None, all stages
+            that are ready to run are run at the same time.
+        stages: A dictionary keyed by stage name, where each value is a dictionary with the stage's function,
+            depends_on, inputs, and checkpoint settings (see adds_stage).
+        completed: A dictionary keyed by stage name, with the value "loaded" or "ran" for each stage of the last
+            run that was loaded from a checkpoint or run.
+
+    Raises:
+        ValueError: If n_workers is smaller than 1.
+    """
+
+    def __init__(self, checkpoint_directory: Optional[str] = None, n_workers: Optional[int] = None) -> None:
+
+        if n_workers is not None and n_workers < 1: raise ValueError('n_workers must be at least 1.')
+
+        self.checkpoint_directory: Optional[str] = checkpoint_directory
+        self.n_workers: Optional[int] = n_workers
+        self.stages: Dict = {}
+        self.completed: Dict = {}
+
+    def adds_stage(self, name: str, function: Callable, depends_on: Sequence = (), inputs: Sequence = (),
+                   checkpoint: bool = True, process: bool = False) -> None:
+        """Adds a stage to the pipeline.
+
+        Args:
+            name: A string containing the name of the stage.
+            function: A function that is called with the outputs of the depends_on stages, in order, and returns
+                the output of the stage.
+            depends_on: A list or tuple of the names of the stages whose outputs the stage needs (default=()).
+            inputs: A list or tuple of the files and parameters the stage's output depends on, which are used to key
+                its checkpoint (see hashes_inputs; default=()).
+            checkpoint: A bool indicating whether or not the output of the stage should be checkpointed. Stages that
+                are cheap to run or whose output is very large can skip checkpointing (default=True).
+            process: A bool indicating whether or not the stage should be run in a separate process, so it does not
+                compete for the global interpreter lock with stages running at the same time (default=False).
+
+        Returns:
+            None.
+
+        Raises:
+            ValueError: If the stage already exists or depends on a stage that has not been added yet.
+        """
+
+        if name in self.stages: raise ValueError('The {} stage already exists.'.format(name))
+        missing = [x for x in depends_on if x not in self.stages]
+        if len(missing) > 0: raise ValueError('The {} stage depends on unknown stages: {}'.format(name, missing))
+
+        self.stages[name] = {'function': function, 'depends_on': list(depends_on), 'inputs': list(inputs),
+                             'checkpoint': checkpoint, 'process': process}
+
+        return None
+
+    def hashes_stages(self) -> Dict:
+        """Creates the key of each stage's checkpoint from the stage's inputs and the keys of the stages it depends
+        on, so a change to the inputs of a stage also changes the keys of all stages downstream of it.
+
+        Returns:
+            A dictionary keyed by stage name, where each value is a string containing an md5 hexdigest.
+        """
+
+        keys: Dict = {}
+        for name, stage in self.stages.items():
+            keys[name] = hashes_inputs([name, hashes_inputs(stage['inputs'])] + [keys[x] for x in stage['depends_on']])
+
+        return keys
+
+    def _gets_checkpoint_file(self, name: str, key: str) -> Optional[str]:
+        """Returns the path of a stage's checkpoint file.
+
+        Args:
+            name: A string containing the name of the stage.
+            key: A string containing the key of the stage (see hashes_stages).
+
+        Returns:
+            A string containing a file path or None if the stage is not checkpointed.
+        """
+
+        if self.checkpoint_directory is None or not self.stages[name]['checkpoint']: return None
+        else: return os.path.join(self.checkpoint_directory, '{}_{}.pickle'.format(name, key))
+
+    def _saves_checkpoint(self, name: str, checkpoint_file: str, output: Any) -> None:
+        """Saves the output of a stage. DataFrames in the output are written to Parquet files next to the checkpoint
+        file and replaced by a reference to their file before the output is pickled. Each file is written to a
+        temporary file, which is then renamed, and the checkpoint file is written last, so a crash while saving never
+        leaves a partial checkpoint behind. Checkpoints of the same stage with other keys are removed.
+
+        Args:
+            name: A string containing the name of the stage.
+            checkpoint_file: A string containing the path of the stage's checkpoint file.
+            output: The output of the stage.
+
+        Returns:
+            None.
+        """
+
+        directory = os.path.dirname(checkpoint_file)
+        os.makedirs(directory, exist_ok=True)
+        items = list(output) if isinstance(output, tuple) else [output]
+        for i, item in enumerate(items):
+            if isinstance(item, pd.DataFrame):
+                frame_file = checkpoint_file[:-len('.pickle')] + '_{}.parquet'.format(i)
+                try:
+                    item.to_parquet(frame_file + '.tmp')
+                    os.replace(frame_file + '.tmp', frame_file)
+                    items[i] = _CheckpointedFrame(os.path.basename(frame_file))
+                except (ImportError, NotImplementedError, TypeError, ValueError):
+                    if os.path.exists(frame_file + '.tmp'): os.remove(frame_file + '.tmp')
+        with open(checkpoint_file + '.tmp', 'wb') as handle:
+            pickle.dump(tuple(items) if isinstance(output, tuple) else items[0], handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(checkpoint_file + '.tmp', checkpoint_file)
+        key = os.path.basename(checkpoint_file)[len(name) + 1:-len('.pickle')]
+        stale_pattern = re.compile(re.escape(name) + r'_([0-9a-f]{32})(_[0-9]+\.parquet|\.pickle)')
+        for stale_file in glob.glob(os.path.join(directory, glob.escape(name) + '_*')):
+            stale_match = stale_pattern.fullmatch(os.path.basename(stale_file))
+            if stale_match is not None and stale_match.group(1) != key: os.remove(stale_file)
+
+        return None
+
+    @staticmethod
+    def _loads_checkpoint(checkpoint_file: str) -> Any:
+        """Loads the output of a stage from its checkpoint, reading the DataFrames written to Parquet files back in.
+
+        Args:
+            checkpoint_file: A string containing the path of the stage's checkpoint file.
+
+        Returns:
+            The output of the stage.
+        """
+
+        with open(checkpoint_file, 'rb') as handle:
+            output = pickle.load(handle)
+        items = list(output) if isinstance(output, tuple) else [output]
+        for i, item in enumerate(items):
+            if isinstance(item, _CheckpointedFrame):
+                items[i] = pd.read_parquet(os.path.join(os.path.dirname(checkpoint_file), item.file_name))
+
+        return tuple(items) if isinstance(output, tuple) else items[0]
+
+    def _runs_stage(self, name: str, dependencies: List, checkpoint_file: Optional[str]) -> Any:
+        """Runs a stage and checkpoints its output.
+
+        Args:
+            name: A string containing the name of the stage.
+            dependencies: A list of the outputs of the stages the stage depends on.
+            checkpoint_file: An optional string containing the path of the stage's checkpoint file.
+
+        Returns:
+            The output of the stage.
+        """
+
+        print('\n*** Running Pipeline Stage: {}'.format(name))
+        output = self.stages[name]['function'](*dependencies)
+        if checkpoint_file is not None: self._saves_checkpoint(name, checkpoint_file, output)
+
+        return output
+
+    def _starts_stage_process(self, name: str, dependencies: List) -> Any:
+        """Starts a stage in a child process. Processes are forked where the platform supports it, so the child
+        inherits the outputs of earlier stages without them being copied, and they are started from the calling
+        thread, so that no other thread of the pipeline holds a lock when the process is forked.
+
+        Args:
+            name: A string containing the name of the stage.
+            dependencies: A list of the outputs of the stages the stage depends on.
+
+        Returns:
+            A tuple containing the started multiprocessing Process and the receiving end of its Pipe.
+        """
+
+        print('\n*** Running Pipeline Stage: {} (process)'.format(name))
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        receiver, sender = context.Pipe(duplex=False)
+        function = self.stages[name]['function']
+        process = context.Process(target=_runs_stage_process, args=(function, dependencies, sender))
+        process.start()
+        sender.close()
+
+        return process, receiver
+
+    def _receives_stage(self, name: str, process: Any, receiver: Connection, checkpoint_file: Optional[str]) -> Any:
+        """Waits for a stage running in a child process to finish and checkpoints its output.
+
+        Args:
+            name: A string containing the name of the stage.
+            process: The multiprocessing Process running the stage.
+            receiver: The receiving end of the process's Pipe.
+            checkpoint_file: An optional string containing the path of the stage's checkpoint file.
+
+        Returns:
+            The output of the stage.
+
+        Raises:
+            RuntimeError: If the process exits without sending the output of the stage.
+        """
+
+        try:
+            success, output = receiver.recv()
+        except EOFError:
+            process.join()
+            raise RuntimeError('The {} stage process exited with code {}.'.format(name, process.exitcode))
+        finally:
+            receiver.close()
+        process.join()
+        if not success: raise output
+        if checkpoint_file is not None: self._saves_checkpoint(name, checkpoint_file, output)
+
+        return output
+
+    def _plans_stages(self, targets: List, keys: Dict) -> Dict:
+        """Finds the stages needed to produce the outputs of the target stages and whether each of them can be loaded
+        from a checkpoint or needs to be run. Stages only needed by stages that are loaded are skipped.
+
+        Args:
+            targets: A list of the names of the target stages.
+            keys: A dictionary keyed by stage name with the key of each stage (see hashes_stages).
+
+        Returns:
+            A dictionary keyed by stage name, with a tuple of the stage's checkpoint file (or None) and a bool that is
+                True if the stage needs to be run, ordered so that each stage comes after the stages it depends on.
+        """
+
+        plan: Dict = {}
+
+        def visits_stage(name: str) -> None:
+            if name in plan: return None
+            checkpoint_file = self._gets_checkpoint_file(name, keys[name])
+            if checkpoint_file is not None and os.path.exists(checkpoint_file):
+                plan[name] = (checkpoint_file, False)
+            else:
+                for dependency in self.stages[name]['depends_on']: visits_stage(dependency)
+                plan[name] = (checkpoint_file, True)
+
+            return None
+
+        for target in targets: visits_stage(target)
+
+        return plan
+
+    def runs(self, targets: Optional[Sequence] = None) -> Dict:
+        """Runs the pipeline. Stages with a valid checkpoint are loaded and the remaining stages are run as soon as
+        the stages they depend on have finished, so stages that do not depend on each other run at the same time. If
+        a stage fails, the stages that are still running are finished and checkpointed before the error is raised.
+
+        Args:
+            targets: An optional list or tuple of the names of the stages whose outputs are needed. If None, the
+                stages that no other stage depends on are used (default=None).
+
+        Returns:
+            A dictionary keyed by stage name containing the output of each target stage and of each stage that was
+                loaded or run to produce them.
+        """
+
+        if targets is None:
+            upstream = set(x for stage in self.stages.values() for x in stage['depends_on'])
+            targets = [x for x in self.stages.keys() if x not in upstream]
+        plan = self._plans_stages(list(targets), self.hashes_stages())
+        pending = [x for x, (_, run) in plan.items() if run]
+        needed = set(targets) | set(x for name in pending for x in self.stages[name]['depends_on'])
+        outputs: Dict = {}; self.completed = {}
+
+        # load the checkpoints needed by the targets or by the stages that are run
+        for name, (checkpoint_file, run) in plan.items():
+            if not run and name in needed:
+                print('\n*** Loading Pipeline Stage: {} ({})'.format(name, checkpoint_file))
+                outputs[name] = self._loads_checkpoint(checkpoint_file)
+                self.completed[name] = 'loaded'
+
+        # run each stage as soon as the stages it depends on are done
+        with ThreadPoolExecutor(max_workers=self.n_workers or max(len(pending), 1)) as executor:
+            running: Dict = {}
+            while len(pending) > 0 or len(running) > 0:
+                for name in [x for x in pending if all(y in outputs for y in self.stages[x]['depends_on'])]:
+                    dependencies = [outputs[x] for x in self.stages[name]['depends_on']]
+                    if self.stages[name]['process']:
+                        process, receiver = self._starts_stage_process(name, dependencies)
+                        future = executor.submit(self._receives_stage, name, process, receiver, plan[name][0])
+                    else:
+                        future = executor.submit(self._runs_stage, name, dependencies, plan[name][0])
+                    running[future] = name
+                    pending.remove(name)
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs[name] = future.result()
+                    self.completed[name] = 'ran'
+
+        return outputs
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Similarity Utility Functions.
+
+Sparse Cosine Similarity Search
+* builds_inverted_index
+* streams_top_similarities
+* finds_top_similarities
+
+Approximate Cosine Similarity Search
+* computes_minhash_signatures
+* builds_minhash_index
+* finds_approximate_similarities
+* measures_recall
+
+"""
+
+# import needed libraries
+import numpy as np  # type: ignore
+
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from scipy import sparse  # type: ignore
+from typing import Dict, Iterator, List, Optional
+
+# set up environment variables
+minhash_empty = 1 << 32
+
+
+def _ranks_matches(scores: np.ndarray, indices: np.ndarray, top_n: int, min_score: float,
+                   reference_groups: Optional[np.ndarray] = None) -> List:
+    """Filters the scores of a single query row to those greater than or equal to min_score and returns the top_n
+    (reference row index, score) tuples (or the top_n for each reference group). See finds_top_similarities for
+    details on the arguments and output.
+    """
+
+    keep = scores >= min_score
+    scores, indices = scores[keep], indices[keep]
+    if reference_groups is not None:  # rank matches within each group and keep the top_n per group
+        groups = reference_groups[indices]
+        order = np.lexsort((indices, -scores, groups))
+        rank = np.arange(len(order)) - np.searchsorted(groups[order], groups[order], 'left')
+        order = order[rank < top_n]
+    else:
+        if len(scores) > top_n > 0:  # keep every row tied with the n-th best score until the final sort
+            kth_score = scores[np.argpartition(-scores, top_n - 1)[top_n - 1]]
+            scores, indices = scores[scores >= kth_score], indices[scores >= kth_score]
+        order = np.lexsort((indices, -scores))[:max(top_n, 0)]
+
+    return list(zip(indices[order].tolist(), scores[order].tolist()))
+
+
+def _rescores_candidates(query_block: sparse.csr_matrix, reference_matrix: sparse.csr_matrix, query_rows: np.ndarray,
+                         reference_rows: np.ndarray) -> np.ndarray:
+    """Returns the exact cosine similarity of each (query row, reference row) candidate pair of two L2-normalized
+    TF-IDF matrices.
+    """
+
+    scores = query_block[query_rows].multiply(reference_matrix[reference_rows]).sum(axis=1)
+
+    return np.asarray(scores).ravel()
+
+
+def _scores_similarity_block(query_block: sparse.csr_matrix, reference_t: sparse.csr_matrix, top_n: int,
+                             min_score: float, reference_groups: Optional[np.ndarray] = None,
+                             reference_matrix: Optional[sparse.csr_matrix] = None) -> List:
+    """Scores a block of query rows against a transposed reference matrix and returns the top_n matches for each row
+    (or for each reference group of each row). If reference_matrix is provided, reference_t is a pruned inverted index
+    (see builds_inverted_index), which is only used to find the candidate rows of each query row. Each query row is
+    then scored exactly against its own candidate rows of reference_matrix, so its matches do not depend on the other
+    rows of the block. See finds_top_similarities for details on the arguments and output.
+    """
+
+    block = query_block.dot(reference_t).tocsr()
+    if reference_matrix is not None:
+        block.sort_indices()
+        query_rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        block.data = _rescores_candidates(query_block, reference_matrix, query_rows, block.indices)
+    similar_variables = [_ranks_matches(block.data[block.indptr[row]:block.indptr[row + 1]],
+                                        block.indices[block.indptr[row]:block.indptr[row + 1]],
+                                        top_n, min_score, reference_groups) for row in range(block.shape[0])]
+
+    return similar_variables
+
+
+def builds_inverted_index(reference_matrix: sparse.csr_matrix, min_idf: Optional[float] = None) -> sparse.csr_matrix:
+    """Builds a feature (i.e. n-gram) to reference row inverted index from a TF-IDF matrix, which is the transpose of
+    the matrix in CSR format, so that each row lists the reference rows containing a feature. Multiplying a query row
+    by the index only touches the reference rows sharing at least one feature with it. Features with an inverse
+    document frequency (IDF) below min_idf are dropped from the index. The IDF is derived from the reference rows in
+    the same way as the Scikit-Learn TfidfVectorizer (i.e. ln((1 + n) / (1 + df)) + 1). Very common words (e.g.
+    "disease" or "of") are shared with a large share of all reference rows, while contributing little to the cosine
+    similarity, so skipping them greatly reduces the number of candidate rows.
+
+    Args:
+        reference_matrix: A sparse Scipy matrix where each row is a reference variable (e.g. an ontology string).
+        min_idf: An optional float specifying the smallest IDF a feature needs to be kept in the index. If None, all
+            features are kept.
+
+    Returns:
+        A sparse Scipy matrix with one row per feature and one column per reference row.
+    """
+
+    reference_t = sparse.csr_matrix(reference_matrix).T.tocsr()
+    if min_idf is not None:
+        idf = np.log((1 + reference_t.shape[1]) / (1 + np.diff(reference_t.indptr))) + 1
+        reference_t = sparse.diags((idf >= min_idf).astype(reference_t.dtype)).dot(reference_t).tocsr()
+        reference_t.eliminate_zeros()
+
+    return reference_t
+
+
+def streams_top_similarities(query_matrix: sparse.csr_matrix, reference_matrix: sparse.csr_matrix, top_n: int,
+                             min_score: float = 0.0, block_size: int = 100, n_jobs: int = 1,
+                             reference_groups: Optional[List] = None, min_idf: Optional[float] = None) \
+        -> Iterator[List]:
+    """Lazily finds the top_n most similar reference rows for each query row of two L2-normalized TF-IDF matrices,
+    yielding the results one block of query rows at a time and in query row order. When n_jobs is greater than one,
+    blocks are scored in a pool of threads, which run in parallel because Scipy releases the GIL while multiplying
+    sparse matrices. Each worker only holds the sparse product of a single block, so memory use per worker is bounded
+    by block_size.
+
+    Args:
+        query_matrix: A sparse Scipy matrix where each row is a query variable (e.g. a clinical string).
+        reference_matrix: A sparse Scipy matrix where each row is a reference variable (e.g. an ontology string). It
+            must have the same number of columns as query_matrix.
+        top_n: An integer representing the number of similar reference rows to return for each query row.
+        min_score: A float specifying the minimum cosine similarity score a match must have to be returned.
+        block_size: An integer specifying the number of query rows to score at a time.
+        n_jobs: An integer specifying the number of threads to score blocks with.
+        reference_groups: An optional list with one group label per reference row (e.g. the ontology of each row). If
+            provided, the top_n matches are kept separately for each group, so large groups cannot crowd out small
+            ones, and the matches for each query row are ordered by group before score.
+        min_idf: An optional float specifying the smallest inverse document frequency a feature needs to be used to
+            find candidate reference rows (see builds_inverted_index). Candidates are re-scored with all features, so
+            scores stay exact, but reference rows only sharing very common features with a query row are skipped. If
+            None, every reference row sharing a feature with a query row is scored.
+
+    Returns:
+        An iterator of lists, one per block of query rows, where each list contains the top_n matches for each query
+            row in the block (see finds_top_similarities for an example).
+
+    Raises:
+        ValueError:
+            If query_matrix and reference_matrix do not have the same number of columns.
+            If block_size or n_jobs is less than one.
+            If reference_groups does not have one label per reference row.
+    """
+
+    if query_matrix.shape[1] != reference_matrix.shape[1]:
+        raise ValueError('query_matrix and reference_matrix must have the same number of columns.')
+    if block_size < 1 or n_jobs < 1:
+        raise ValueError('block_size and n_jobs must be greater than zero.')
+    if reference_groups is not None and len(reference_groups) != reference_matrix.shape[0]:
+        raise ValueError('reference_groups must contain one label per reference_matrix row.')
+
+    query_matrix, reference_t = sparse.csr_matrix(query_matrix), builds_inverted_index(reference_matrix, min_idf)
+    groups = np.unique(reference_groups, return_inverse=True)[1] if reference_groups is not None else None
+    blocks = (query_matrix[start:start + block_size] for start in range(0, query_matrix.shape[0], block_size))
+    scorer = partial(_scores_similarity_block, reference_t=reference_t, top_n=top_n, min_score=min_score,
+                     reference_groups=groups,
+                     reference_matrix=sparse.csr_matrix(reference_matrix) if min_idf is not None else None)
+
+    if n_jobs == 1:
+        for block in blocks:
+            yield scorer(block)
+    else:
+        with ThreadPool(n_jobs) as pool:
+            for block_matches in pool.imap(scorer, blocks):
+                yield block_matches
+
+
+def finds_top_similarities(query_matrix: sparse.csr_matrix, reference_matrix: sparse.csr_matrix, top_n: int,
+                           min_score: float = 0.0, block_size: int = 100, n_jobs: int = 1,
+                           reference_groups: Optional[List] = None, min_idf: Optional[float] = None) -> List:
+    """Finds the top_n most similar reference rows for each query row of two L2-normalized TF-IDF matrices. Blocks of
+    query rows are multiplied against the transposed reference matrix, which keeps the result sparse so that only
+    reference rows sharing at least one feature with a query row are ever scored. Scores below min_score are dropped
+    before the top_n rows are selected with a partial sort. Within each result, matches are ordered by descending
+    score and ties are broken by ascending reference row index.
+
+    Args:
+        query_matrix: A sparse Scipy matrix where each row is a query variable (e.g. a clinical string).
+        reference_matrix: A sparse Scipy matrix where each row is a reference variable (e.g. an ontology string). It
+            must have the same number of columns as query_matrix.
+        top_n: An integer representing the number of similar reference rows to return for each query row.
+        min_score: A float specifying the minimum cosine similarity score a match must have to be returned.
+        block_size: An integer specifying the number of query rows to score at a time.
+        n_jobs: An integer specifying the number of threads to score blocks with.
+        reference_groups: An optional list with one group label per reference row (e.g. the ontology of each row). If
+            provided, the top_n matches are kept separately for each group, so large groups cannot crowd out small
+            ones, and the matches for each query row are ordered by group before score.
+        min_idf: An optional float specifying the smallest inverse document frequency a feature needs to be used to
+            find candidate reference rows (see builds_inverted_index). Candidates are re-scored with all features, so
+            scores stay exact, but reference rows only sharing very common features with a query row are skipped. If
+            None, every reference row sharing a feature with a query row is scored.
+
+    Returns:
+        similar_variables: A list with one list per query row, where each inner list contains tuples of a reference row
+            index and its cosine similarity score for the top_n most similar reference rows (e.g. [[(3, 0.82), (0,
+            0.51)], [(7, 1.0)]]).
+
+    Raises:
+        ValueError:
+            If query_matrix and reference_matrix do not have the same number of columns.
+            If block_size or n_jobs is less than one.
+            If reference_groups does not have one label per reference row.
+    """
+
+    blocks = streams_top_similarities(query_matrix, reference_matrix, top_n, min_score, block_size, n_jobs,
+                                      reference_groups, min_idf)
+    similar_variables = [x for block_matches in blocks for x in block_matches]
+
+    return similar_variables
+
+
+def computes_minhash_signatures(matrix: sparse.csr_matrix, num_perm: int = 64, seed: int = 0,
+                                block_size: int = 2000) -> np.ndarray:
+    """Computes a MinHash signature for each row of a sparse matrix, where each row is treated as the set of its
+    non-zero columns (i.e. the word n-grams of a TF-IDF row). Each of the num_perm hash functions is a random
+    multiply-shift hash of the column index, so the share of signature values two rows have in common estimates the
+    Jaccard similarity of their n-gram sets. Rows without any non-zero columns are given a signature of 2^32 (which no
+    hash function returns) in every position.
+
+    Args:
+        matrix: A sparse Scipy matrix.
+        num_perm: An integer specifying the number of hash functions (i.e. signature length).
+        seed: An integer used to seed the random hash functions.
+        block_size: An integer specifying the number of rows to hash at a time.
+
+    Returns:
+        signatures: A numpy array of unsigned integers with one row per matrix row and num_perm columns.
+    """
+
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 1 << 32, (2, num_perm)).astype(np.uint64)
+    a = ((a[0] << np.uint64(32)) | a[1]) | np.uint64(1)  # random odd 64-bit multipliers
+    b = rng.randint(0, 1 << 32, num_perm).astype(np.uint64) << np.uint64(32)
+    matrix = sparse.csr_matrix(matrix)
+    signatures = np.full((matrix.shape[0], num_perm), minhash_empty, dtype=np.uint64)
+
+    for start in range(0, matrix.shape[0], block_size):
+        block = matrix[start:start + block_size]
+        rows = np.flatnonzero(np.diff(block.indptr) > 0)
+        if len(rows) > 0:
+            hashes = (block.indices.astype(np.uint64)[:, None] * a + b) >> np.uint64(32)
+            signatures[start + rows] = np.minimum.reduceat(hashes, block.indptr[rows], axis=0)
+
+    return signatures
+
+
+def _hashes_signature_bands(signatures: np.ndarray, bands: int, rows_per_band: int) -> np.ndarray:
+    """Combines each band of rows_per_band MinHash values into a single 64-bit bucket key, returning an array with
+    one row per signature and one column per band.
+    """
+
+    keys = np.zeros((signatures.shape[0], bands), dtype=np.uint64)
+    for band in range(bands):
+        for col in range(band * rows_per_band, (band + 1) * rows_per_band):
+            keys[:, band] = (keys[:, band] * np.uint64(1000003)) ^ signatures[:, col]
+
+    return keys
+
+
+def builds_minhash_index(reference_matrix: sparse.csr_matrix, bands: int = 64, rows_per_band: int = 2,
+                         seed: int = 0) -> Dict:
+    """Builds a MinHash locality-sensitive hashing (LSH) index of the rows of a sparse matrix. The MinHash signature of
+    each row (see computes_minhash_signatures) is cut into bands of rows_per_band values and each band is combined into
+    a bucket key. The keys of each band are sorted, so that the rows in a bucket can be looked up with a binary search.
+    Building the index is the most expensive part of an approximate search, so an index can be built once per
+    reference matrix and re-used by finds_approximate_similarities.
+
+    Args:
+        reference_matrix: A sparse Scipy matrix where each row is a reference variable (e.g. an ontology string).
+        bands: An integer specifying the number of LSH bands.
+        rows_per_band: An integer specifying the number of MinHash values in each band.
+        seed: An integer used to seed the MinHash functions.
+
+    Returns:
+        A dictionary containing the index settings ("bands", "rows_per_band", and "seed"), the number of indexed rows
+            ("rows"), the sorted bucket keys of each band ("keys"), and the row indices in key order ("order").
+
+    Raises:
+        ValueError: If bands or rows_per_band is less than one.
+    """
+
+    if bands < 1 or rows_per_band < 1:
+        raise ValueError('bands and rows_per_band must be greater than zero.')
+
+    signatures = computes_minhash_signatures(reference_matrix, bands * rows_per_band, seed)
+    keys = _hashes_signature_bands(signatures, bands, rows_per_band)
+    order = np.argsort(keys, axis=0, kind='stable')
+
+    return {'bands': bands, 'rows_per_band': rows_per_band, 'seed': seed, 'rows': reference_matrix.shape[0],
+            'keys': np.take_along_axis(keys, order, axis=0), 'order': order}
+
+
+def finds_approximate_similarities(query_matrix: sparse.csr_matrix, reference_matrix: sparse.csr_matrix, top_n: int,
+                                   min_score: float = 0.0, bands: int = 64, rows_per_band: int = 2,
+                                   max_bucket_size: Optional[int] = 1000, block_size: int = 1000,
+                                   reference_groups: Optional[List] = None, seed: int = 0,
+                                   index: Optional[Dict] = None) -> List:
+    """Approximates finds_top_similarities with a MinHash locality-sensitive hashing (LSH) index (see
+    builds_minhash_index). A reference row becomes a candidate for a query row when all MinHash values of at least one
+    band are equal. Only candidates are re-scored with the exact cosine similarity, so the returned scores are exact,
+    but some true matches may be missed. The probability that two rows with Jaccard similarity s become candidates is
+    1 - (1 - s^rows_per_band)^bands, which makes bands and rows_per_band the recall-versus-speed knob: more bands or
+    fewer rows per band increase recall and the number of candidates to re-score. Buckets holding more than
+    max_bucket_size reference rows are skipped, as these are usually shared through very common words (e.g.
+    "disease") and would add many low scoring candidates. Use measures_recall to check the recall of a setting against
+    the exact search.
+
+    Args:
+        query_matrix: A sparse Scipy matrix where each row is a query variable (e.g. a clinical string).
+        reference_matrix: A sparse Scipy matrix where each row is a reference variable (e.g. an ontology string). It
+            must have the same number of columns as query_matrix.
+        top_n: An integer representing the number of similar reference rows to return for each query row.
+        min_score: A float specifying the minimum cosine similarity score a match must have to be returned.
+        bands: An integer specifying the number of LSH bands.
+        rows_per_band: An integer specifying the number of MinHash values in each band.
+        max_bucket_size: An optional integer specifying the largest bucket to draw candidates from (default=1000). If
+            None, all buckets are used.
+        block_size: An integer specifying the number of query rows to re-score at a time.
+        reference_groups: An optional list with one group label per reference row (see finds_top_similarities).
+        seed: An integer used to seed the MinHash functions.
+        index: An optional dictionary returned by builds_minhash_index for reference_matrix. If provided, its bands,
+            rows_per_band, and seed are used instead of the arguments above.
+
+    Returns:
+        similar_variables: A list with one list per query row, where each inner list contains tuples of a reference row
+            index and its cosine similarity score (see finds_top_similarities for an example).
+
+    Raises:
+        ValueError:
+            If query_matrix and reference_matrix do not have the same number of columns.
+            If bands, rows_per_band, or block_size is less than one.
+            If reference_groups does not have one label per reference row.
+            If index was not built from a matrix with the same number of rows as reference_matrix.
+    """
+
+    if query_matrix.shape[1] != reference_matrix.shape[1]:
+        raise ValueError('query_matrix and reference_matrix must have the same number of columns.')
+    if block_size < 1:
+        raise ValueError('block_size must be greater than zero.')
+    if reference_groups is not None and len(reference_groups) != reference_matrix.shape[0]:
+        raise ValueError('reference_groups must contain one label per reference_matrix row.')
+    if index is None:
+        index = builds_minhash_index(reference_matrix, bands, rows_per_band, seed)
+    elif index['rows'] != reference_matrix.shape[0]:
+        raise ValueError('index must be built from reference_matrix.')
+
+    query_matrix, reference_matrix = sparse.csr_matrix(query_matrix), sparse.csr_matrix(reference_matrix)
+    groups = np.unique(reference_groups, return_inverse=True)[1] if reference_groups is not None else None
+    n_ref, bands, rows_per_band = reference_matrix.shape[0], index['bands'], index['rows_per_band']
+    query_signatures = computes_minhash_signatures(query_matrix, bands * rows_per_band, index['seed'])
+    query_keys = _hashes_signature_bands(query_signatures, bands, rows_per_band)
+    query_empty = (query_signatures == minhash_empty).all(axis=1)  # rows without features have no candidates
+
+    similar_variables: List = []
+    for start in range(0, query_matrix.shape[0], block_size):
+        block_keys, block_empty, pairs = query_keys[start:start + block_size], query_empty[start:start + block_size], []
+        for band in range(bands):  # collect (query row, reference row) candidate pairs sharing a band key
+            lo = np.searchsorted(index['keys'][:, band], block_keys[:, band], 'left')
+            hi = np.searchsorted(index['keys'][:, band], block_keys[:, band], 'right')
+            counts = np.where(block_empty | ((hi - lo) > (max_bucket_size or n_ref)), 0, hi - lo)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+            pairs.append(np.repeat(np.arange(len(block_keys)), counts) * n_ref + index['order'][offsets, band])
+        candidates = np.unique(np.concatenate(pairs))
+        query_rows, reference_rows = candidates // n_ref, candidates % n_ref
+
+        # re-score the candidates with the exact cosine similarity
+        block = query_matrix[start:start + block_size]
+        scores = _rescores_candidates(block, reference_matrix, query_rows, reference_rows)
+        bounds = np.searchsorted(query_rows, np.arange(block.shape[0] + 1))
+        similar_variables += [_ranks_matches(scores[bounds[row]:bounds[row + 1]],
+                                             reference_rows[bounds[row]:bounds[row + 1]], top_n, min_score, groups)
+                              for row in range(block.shape[0])]
+
+    return similar_variables
+
+
+def measures_recall(exact_matches: List, approximate_matches: List) -> float:
+    """Measures the recall of an approximate similarity search, as the share of (query row, reference row) matches
+    returned by the exact search (i.e. finds_top_similarities) that are also returned by the approximate search (i.e.
+    finds_approximate_similarities).
+
+    Args:
+        exact_matches: A list of lists of (reference row index, score) tuples, one list per query row.
+        approximate_matches: A list of lists of (reference row index, score) tuples, one list per query row.
+
+    Returns:
+        A float between 0 and 1. If the exact search returned no matches, the recall is 1.0.
+    """
+
+    exact = set((row, x[0]) for row, matches in enumerate(exact_matches) for x in matches)
+    approximate = set((row, x[0]) for row, matches in enumerate(approximate_matches) for x in matches)
+
+    return len(exact & approximate) / len(exact) if len(exact) > 0 else 1.0
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Text Pre-Processing Utility Functions.
+
+Pre-Processed String Caching
+* TokenCache
+
+"""
+
+# import needed libraries
+import hashlib
+import shelve
+
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+class TokenCache(object):
+    """Content-addressed cache of pre-processed strings, which is keyed by the md5 hash of the raw string and stores the
+    list of tokens returned for that string. Strings are first looked up in a least recently used memory tier, then in
+    an optional on-disk (shelve) tier, so that ontology strings only need to be pre-processed once across runs. The
+    hash also includes a namespace identifying the pre-processing steps, so tokens cached by a different version of the
+    pre-processor are not re-used.
+
+    Attributes:
+        cache_file: An optional string containing the path to a shelve file used as the on-disk tier. If None, only
+            the memory tier is used.
+        max_size: An integer specifying the maximum number of strings to keep in the memory tier.
+        namespace: A string identifying the pre-processing steps (e.g. a version or a hash of their settings).
+        hits: An integer counting the strings that were found in the cache.
+        misses: An integer counting the strings that needed to be pre-processed.
+
+    Raises:
+        ValueError: If max_size is smaller than 1.
+    """
+
+    def __init__(self, cache_file: Optional[str] = None, max_size: int = 100000, namespace: str = '') -> None:
+
+        if max_size < 1: raise ValueError('max_size must be at least 1.')
+
+        self.cache_file: Optional[str] = cache_file
+        self.max_size: int = max_size
+        self.namespace: str = namespace
+        self.hits: int = 0
+        self.misses: int = 0
+        self._memory: OrderedDict = OrderedDict()
+        self._disk: Optional[shelve.Shelf] = None
+
+    def __enter__(self) -> 'TokenCache':
+
+        return self
+
+    def __exit__(self, *args) -> None:
+
+        self.close()
+
+        return None
+
+    def __len__(self) -> int:
+
+        return len(self._memory)
+
+    def hashes_string(self, string: str) -> str:
+        """Creates the md5 hash used to key a raw string in the cache, which combines the namespace and the string.
+
+        Args:
+            string: A string to pre-process.
+
+        Returns:
+            A string containing an md5 hexdigest.
+        """
+
+        return hashlib.md5(bytes(self.namespace + '\x00' + str(string), 'utf-8')).hexdigest()
+
+    def _opens_disk_tier(self) -> Optional[shelve.Shelf]:
+        """Opens the on-disk tier the first time it is needed.
+
+        Returns:
+            A shelve.Shelf object or None if no cache_file was provided.
+        """
+
+        if self._disk is None and self.cache_file is not None:
+            self._disk = shelve.open(self.cache_file)
+
+        return self._disk
+
+    def _stores_tokens(self, key: str, tokens: List) -> None:
+        """Adds a list of tokens to the memory tier, removing the least recently used strings when it is full.
+
+        Args:
+            key: A string containing the md5 hash of a raw string.
+            tokens: A list of tokens for the raw string.
+
+        Returns:
+            None.
+        """
+
+        self._memory[key] = tokens
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+        return None
+
+    def gets_tokens(self, key: str) -> Optional[List]:
+        """Looks up the tokens of a hashed string in the memory tier and then in the on-disk tier. Strings found on
+        disk are moved into the memory tier.
+
+        Args:
+            key: A string containing the md5 hash of a raw string.
+
+        Returns:
+            A list of tokens or None if the string has not been cached.
+        """
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        disk = self._opens_disk_tier()
+        if disk is not None and key in disk:
+            tokens = disk[key]
+            self._stores_tokens(key, tokens)
+            return tokens
+
+        return None
+
+    def processes(self, strings: List, preprocessor: Callable[[List], List]) -> List:
+        """Returns the tokens for each string in a list. Each distinct string is only looked up once and the strings
+        that are not cached are passed to preprocessor together, so identical strings (e.g. the same synonym in two
+        ontologies) are only pre-processed once. New results are added to both cache tiers.
+
+        Args:
+            strings: A list of raw strings.
+            preprocessor: A function that takes a list of raw strings and returns a list with the tokens of each string.
+
+        Returns:
+            A list of token lists, in the same order as strings.
+        """
+
+        keys = [self.hashes_string(x) for x in strings]
+        found: Dict = {}
+        missing: Dict = {}
+        for key, string in zip(keys, strings):
+            if key in found or key in missing: continue
+            tokens = self.gets_tokens(key)
+            if tokens is None: missing[key] = string
+            else: found[key] = tokens
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if len(missing) > 0:
+            disk = self._opens_disk_tier()
+            for key, tokens in zip(missing.keys(), preprocessor(list(missing.values()))):
+                found[key] = tokens
+                self._stores_tokens(key, tokens)
+                if disk is not None: disk[key] = tokens
+            if disk is not None: disk.sync()
+
+        return [found[key] for key in keys]
+
+    def close(self) -> None:
+        """Closes the on-disk tier, if it has been opened.
+
+        Returns:
+            None.
+        """
+
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+        return None
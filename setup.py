@@ -39,6 +39,7 @@ test_deps = [
 ]
 
 extras = {
+    'parquet': ['pyarrow>=1.0.0'],
     'test': test_deps,
 }
 
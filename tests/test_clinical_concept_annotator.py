@@ -7,7 +7,7 @@ import pickle
 from unittest import TestCase
 
 from omop2obo.clinical_concept_annotator import ConceptAnnotator
-from omop2obo.utils import column_splitter, data_frame_subsetter, normalizes_source_codes
+from omop2obo.utils import column_splitter, data_frame_subsetter, normalizes_source_codes, renders_mapping_table
 
 
 class TestConceptAnnotator(TestCase):
@@ -360,3 +360,87 @@ class TestConceptAnnotator(TestCase):
         self.assertTrue(len(results.columns) == 14)
 
         return None
+
+
+class TestConceptAnnotatorCorpus(TestCase):
+    """Class to test functions used when annotating clinical concepts on a small clinical and ontology corpus."""
+
+    def setUp(self):
+
+        current_directory = os.path.dirname(__file__)
+        dir_loc = os.path.join(current_directory, 'data')
+        self.dir_loc = os.path.abspath(dir_loc)
+        self.mapping_directory = self.dir_loc + '/mappings'
+
+        # read in the sample clinical and ontology corpus
+        self.clinical_file = self.dir_loc + '/clinical_data/sample_clinical_corpus.csv'
+        with open(self.dir_loc + '/sample_corpus_ontology_dictionary.pickle', 'rb') as handle:
+            self.ont_dict = pickle.load(handle)
+        handle.close()
+
+        # add clinical_data file input parameters
+        self.primary_key = 'CONCEPT_ID'
+        self.concept_codes = tuple(['CONCEPT_SOURCE_CODE'])
+        self.concept_strings = tuple(['CONCEPT_LABEL', 'CONCEPT_SYNONYM'])
+        self.ancestor_codes = tuple(['ANCESTOR_SOURCE_CODE'])
+        self.ancestor_strings = tuple(['ANCESTOR_LABEL'])
+
+        # source code map
+        self.source_codes = self.mapping_directory + '/source_code_vocab_map.csv'
+
+        # initialize the class without UMLS data
+        self.annotator = ConceptAnnotator(self.clinical_file, self.ont_dict, self.primary_key, self.concept_codes,
+                                          self.concept_strings, self.ancestor_codes, self.ancestor_strings,
+                                          source_codes=self.source_codes)
+        self.annotator.umls_cui_data = None
+
+        return None
+
+    def test_tidies_mapping_results(self):
+        """Tests the tidies_mapping_results method."""
+
+        # prepare input data
+        primary_key, code_strings = 'CONCEPT_ID', ['CONCEPT_LABEL', 'CONCEPT_SYNONYM']
+        clinical_strings = self.annotator.clinical_data.copy()[[primary_key] + code_strings]
+        split_strings = column_splitter(clinical_strings, primary_key, code_strings, '|')
+        split_strings = split_strings[[primary_key] + code_strings]
+        split_strings_stacked = data_frame_subsetter(split_strings, primary_key, code_strings)
+        stacked_strings = self.annotator.exact_string_mapper(split_strings_stacked, 'CONCEPT_ID', 'concept')
+
+        # test method
+        results = self.annotator.tidies_mapping_results(stacked_strings, 'CONCEPT_ID', 'concept', 'STR')
+        self.assertTrue(len(results) == 5)
+        self.assertEqual(list(results.columns), ['CONCEPT_ID', 'LEVEL', 'SOURCE', 'ONT', 'ONT_URI', 'ONT_LABEL',
+                                                 'EVIDENCE', 'SCORE'])
+        self.assertEqual(list(results['LEVEL'].unique()), ['CONCEPT'])
+        self.assertEqual(list(results['SOURCE'].unique()), ['STR'])
+        self.assertEqual(list(results['EVIDENCE']), list(stacked_strings['CONCEPT_STR_ONT_EVIDENCE']))
+        self.assertTrue(results['SCORE'].isna().all())
+
+        return None
+
+    def test_clinical_concept_mapper_mapping_table(self):
+        """Tests the clinical_concept_mapper method stores the mapping results in a long-format mapping table."""
+
+        # test method
+        results = self.annotator.clinical_concept_mapper()
+        self.assertTrue(len(results) == 7)
+
+        # check long-format mapping table
+        mapping_table = self.annotator.mapping_table
+        self.assertEqual(list(mapping_table.columns), ['CONCEPT_ID', 'LEVEL', 'SOURCE', 'ONT', 'ONT_URI', 'ONT_LABEL',
+                                                       'EVIDENCE', 'SCORE'])
+        self.assertEqual(sorted(mapping_table['LEVEL'].unique()), ['ANCESTOR', 'CONCEPT'])
+        self.assertEqual(len(mapping_table), 11)
+
+        # check the rendered mapping table contains the same mapping columns as the results
+        rendered = renders_mapping_table(mapping_table, self.primary_key)
+        mapping_cols = [x for x in results.columns if any(y in x for y in ['_DBXREF_', '_STR_'])]
+        self.assertEqual(sorted(mapping_cols), sorted(x for x in rendered.columns if x != self.primary_key))
+        self.assertEqual(results.at[5, 'CONCEPT_DBXREF_MONDO_URI'], 'http://purl.obolibrary.org/obo/MONDO_0002406')
+        self.assertEqual(results.at[5, 'CONCEPT_STR_HP_EVIDENCE'], 'CONCEPT_LABEL:eczema')
+        self.assertEqual(results.at[4, 'ANCESTOR_STR_MONDO_EVIDENCE'],
+                         'ANCESTOR_LABEL:disorder_of_musculoskeletal_system')
+        self.assertEqual(results.at[6, 'CONCEPT_STR_HP_URI'], '')
+
+        return None
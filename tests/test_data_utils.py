@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import importlib.util
+import numpy as np
+import os
 import pandas as pd
+import shutil
+import tempfile
 import unittest
 
 from typing import Dict, Tuple
@@ -160,6 +165,68 @@ class TestDataUtils(unittest.TestCase):
                                                       'CONCEPT_DBXREF_MONDO_URI', 'CONCEPT_DBXREF_MONDO_LABEL',
                                                       'CONCEPT_DBXREF_MONDO_EVIDENCE'])
 
+        # check that values were aggregated by concept and ontology type
+        row = grouped_data[grouped_data['CONCEPT_ID'] == '133835'].iloc[0]
+        self.assertEqual(row['CONCEPT_DBXREF_HP_URI'], 'http://purl.obolibrary.org/obo/HP_0000964')
+        self.assertEqual(row['CONCEPT_DBXREF_MONDO_LABEL'], 'dermatitis')
+        self.assertTrue(pd.isna(grouped_data[grouped_data['CONCEPT_ID'] == '442264'].iloc[0]['CONCEPT_DBXREF_HP_URI']))
+
+        return None
+
+    def test_renders_mapping_table(self):
+        """Tests the renders_mapping_table method."""
+
+        # set-up input data
+        mapping_table = pd.DataFrame({'CONCEPT_ID': ['4098595', '4098595', '4098595', '4098595', '4098595'],
+                                      'LEVEL': ['CONCEPT', 'CONCEPT', 'CONCEPT', 'CONCEPT', 'CONCEPT'],
+                                      'SOURCE': ['DBXREF', 'DBXREF', 'STR', 'SIM', 'SIM'],
+                                      'ONT': ['HP', 'HP', 'HP', 'HP', 'HP'],
+                                      'ONT_URI': ['http://purl.obolibrary.org/obo/HP_0008181',
+                                                  'http://purl.obolibrary.org/obo/HP_0008181',
+                                                  'http://purl.obolibrary.org/obo/HP_0008181', 'HP_0008181',
+                                                  'HP_0003146'],
+                                      'ONT_LABEL': ['abetalipoproteinemia', 'abetalipoproteinemia',
+                                                    'abetalipoproteinemia', 'abetalipoproteinemia',
+                                                    'abetalipoproteinemia'],
+                                      'EVIDENCE': ['CONCEPT_DBXREF_snomed:190787008', 'CONCEPT_DBXREF_umls:C0000744',
+                                                   'CONCEPT_SOURCE_LABEL:abetalipoproteinemia', None, None],
+                                      'SCORE': [None, None, None, 1.0, 0.4321]})
+
+        # test method
+        results = renders_mapping_table(mapping_table, 'CONCEPT_ID')
+        self.assertIsInstance(results, pd.DataFrame)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(list(results.columns), ['CONCEPT_ID', 'CONCEPT_DBXREF_HP_URI', 'CONCEPT_DBXREF_HP_LABEL',
+                                                 'CONCEPT_DBXREF_HP_EVIDENCE', 'CONCEPT_STR_HP_URI',
+                                                 'CONCEPT_STR_HP_LABEL', 'CONCEPT_STR_HP_EVIDENCE', 'HP_SIM_ONT_URI',
+                                                 'HP_SIM_ONT_LABEL', 'HP_SIM_ONT_EVIDENCE'])
+        self.assertEqual(results.at[0, 'CONCEPT_DBXREF_HP_URI'], 'http://purl.obolibrary.org/obo/HP_0008181')
+        self.assertEqual(results.at[0, 'CONCEPT_DBXREF_HP_EVIDENCE'], 'CONCEPT_DBXREF_snomed:190787008 | '
+                                                                      'CONCEPT_DBXREF_umls:C0000744')
+        self.assertEqual(results.at[0, 'HP_SIM_ONT_LABEL'], 'abetalipoproteinemia | abetalipoproteinemia')
+        self.assertEqual(results.at[0, 'HP_SIM_ONT_EVIDENCE'], 'HP_0008181_1.0 | HP_0003146_0.432')
+
+        return None
+
+    def test_renders_mapping_table_data_frame_grouper(self):
+        """Tests that the renders_mapping_table method widens exact mappings like the data_frame_grouper method."""
+
+        # set-up input data -- the grouping data in long format
+        mapping_table = pd.DataFrame({'CONCEPT_ID': self.group_data['CONCEPT_ID'], 'LEVEL': 'CONCEPT',
+                                      'SOURCE': 'DBXREF', 'ONT': self.group_data['CONCEPT_DBXREF_ONT_TYPE'],
+                                      'ONT_URI': self.group_data['CONCEPT_DBXREF_ONT_URI'],
+                                      'ONT_LABEL': self.group_data['CONCEPT_DBXREF_ONT_LABEL'],
+                                      'EVIDENCE': self.group_data['CONCEPT_DBXREF_ONT_EVIDENCE'], 'SCORE': None})
+
+        # test method
+        grouped_data = data_frame_grouper(self.group_data, 'CONCEPT_ID', 'CONCEPT_DBXREF_ONT_TYPE',
+                                          aggregates_column_values)
+        results = renders_mapping_table(mapping_table, 'CONCEPT_ID')
+        self.assertEqual(list(results.columns), list(grouped_data.columns))
+        grouped_data = grouped_data.sort_values('CONCEPT_ID').reset_index(drop=True)
+        results = results.sort_values('CONCEPT_ID').reset_index(drop=True)
+        pd.testing.assert_frame_equal(results, grouped_data)
+
         return None
 
     def test_normalizes_source_codes(self):
@@ -199,6 +266,106 @@ class TestDataUtils(unittest.TestCase):
 
         return None
 
+    def test_partitioned_data(self):
+        """Tests the writes_partitioned_data, reads_partitioned_data, and clears_partitioned_data methods."""
+
+        directory = tempfile.mkdtemp()
+        data = pd.DataFrame({'CONCEPT_ID': ['4331309', '37018594', '442264'], 'ONT': ['HP', 'MONDO', 'HP'],
+                             'ONT_URI': ['HP_0012819', 'MONDO_0002009', 'HP_0100261']})
+
+        # test writing chunks
+        files = writes_partitioned_data(data.iloc[0:2], directory, 'ONT', 0)
+        files += writes_partitioned_data(data.iloc[2:], directory, 'ONT', 1)
+        self.assertEqual(files, [os.path.join(directory, 'ONT=HP', 'part-00000.csv'),
+                                 os.path.join(directory, 'ONT=MONDO', 'part-00000.csv'),
+                                 os.path.join(directory, 'ONT=HP', 'part-00001.csv')])
+        self.assertRaises(ValueError, writes_partitioned_data, data, directory, 'ONT', 2, 'xlsx')
+
+        # test reading chunks back by partition and then by part
+        chunks = list(reads_partitioned_data(directory, 'ONT', dtype={'CONCEPT_ID': str}))
+        self.assertEqual(len(chunks), 3)
+        results = pd.concat(chunks, ignore_index=True)[list(data.columns)]
+        pd.testing.assert_frame_equal(results, data.iloc[[0, 2, 1]].reset_index(drop=True))
+        mondo = list(reads_partitioned_data(directory, 'ONT', partition_values=['MONDO']))
+        self.assertEqual(list(mondo[0]['ONT_URI']), ['MONDO_0002009'])
+
+        # test clearing chunks
+        clears_partitioned_data(directory, 'ONT')
+        self.assertEqual(list(reads_partitioned_data(directory, 'ONT')), [])
+
+        shutil.rmtree(directory)
+
+        return None
+
+    def test_mapping_results(self):
+        """Tests the writes_mapping_results and reads_mapping_results methods."""
+
+        directory = tempfile.mkdtemp()
+        data = pd.DataFrame({'CONCEPT_ID': ['4331309', '37018594'], 'CONCEPT_LABEL': ['Myopia', 'Asthma'],
+                             'CONCEPT_DBXREF_HP_URI': ['HP_0000545', ''], 'HP_SIM_ONT_URI': ['HP_0000545', ''],
+                             'AGGREGATED_HP_URI': ['HP_0000545', ''], 'AGGREGATED_MONDO_URI': ['', 'MONDO_0004979']})
+
+        # test writing and reading a single file
+        file_path = os.path.join(directory, 'mappings.csv.gz')
+        self.assertEqual(writes_mapping_results(data, file_path, 'csv', 'gzip'), [file_path])
+        results = reads_mapping_results(file_path, 'csv', dtype=str).fillna('')
+        pd.testing.assert_frame_equal(results, data)
+        hp = reads_mapping_results(file_path, 'csv', onts=['hp'], dtype=str)
+        self.assertEqual(list(hp.columns), list(data.columns)[:-1])
+        self.assertRaises(ValueError, writes_mapping_results, data, file_path, 'xlsx')
+        self.assertRaises(ValueError, reads_mapping_results, file_path, 'xlsx')
+        pd.testing.assert_frame_equal(reads_mapping_results(file_path, dtype=str).fillna(''), data)
+
+        # test writing and reading results partitioned by ontology
+        files = writes_mapping_results(data, os.path.join(directory, 'partitioned'), 'csv', onts=['hp', 'mondo'])
+        self.assertEqual(files, [os.path.join(directory, 'partitioned', 'ONT=HP', 'part-00000.csv'),
+                                 os.path.join(directory, 'partitioned', 'ONT=MONDO', 'part-00000.csv')])
+        results = reads_mapping_results(os.path.join(directory, 'partitioned'), 'csv', dtype=str).fillna('')
+        pd.testing.assert_frame_equal(results, data)
+        mondo = reads_mapping_results(os.path.join(directory, 'partitioned'), 'csv', onts=['MONDO'], dtype=str)
+        self.assertEqual(list(mondo.columns), ['CONCEPT_ID', 'CONCEPT_LABEL', 'AGGREGATED_MONDO_URI'])
+        results = reads_mapping_results(os.path.join(directory, 'partitioned'), dtype=str).fillna('')
+        pd.testing.assert_frame_equal(results, data)
+
+        # test partitions with rows in a different order are joined on the clinical columns
+        mondo_file = os.path.join(directory, 'partitioned', 'ONT=MONDO', 'part-00000.csv')
+        pd.read_csv(mondo_file, dtype=str).iloc[::-1].to_csv(mondo_file, index=False)
+        results = reads_mapping_results(os.path.join(directory, 'partitioned'), 'csv', dtype=str).fillna('')
+        pd.testing.assert_frame_equal(results, data)
+
+        shutil.rmtree(directory)
+
+        return None
+
+    @unittest.skipIf(importlib.util.find_spec('pyarrow') is None, 'requires pyarrow')
+    def test_mapping_results_binary(self):
+        """Tests the writes_mapping_results and reads_mapping_results methods with Parquet and Feather files."""
+
+        directory = tempfile.mkdtemp()
+        data = pd.DataFrame({'CONCEPT_ID': [4331309, 37018594], 'ANCESTOR_CONCEPT_ID': [4331309, ''],
+                             'CONCEPT_DBXREF_HP_URI': ['HP_0000545', ''],
+                             'AGGREGATED_MONDO_URI': ['', 'MONDO_0004979']})
+
+        for file_format in ['parquet', 'feather']:
+            # test that column types are kept and mixed columns are written as strings
+            file_path = os.path.join(directory, 'mappings.' + file_format)
+            writes_mapping_results(data, file_path, file_format, 'zstd')
+            results = reads_mapping_results(file_path)
+            self.assertEqual(results['CONCEPT_ID'].dtype, data['CONCEPT_ID'].dtype)
+            self.assertEqual(list(results['ANCESTOR_CONCEPT_ID']), ['4331309', ''])
+            self.assertEqual(list(data['ANCESTOR_CONCEPT_ID']), [4331309, ''])
+
+            # test results partitioned by ontology
+            partitioned = os.path.join(directory, 'partitioned_' + file_format)
+            writes_mapping_results(data, partitioned, file_format, onts=['hp', 'mondo'])
+            results = reads_mapping_results(partitioned)
+            self.assertEqual(list(results.columns), list(data.columns))
+            self.assertEqual(list(results['AGGREGATED_MONDO_URI']), ['', 'MONDO_0004979'])
+
+        shutil.rmtree(directory)
+
+        return None
+
     def test_ohdsi_ananke(self):
         """Tests the ohdsi_ananke method."""
 
@@ -384,6 +551,35 @@ class TestDataUtils(unittest.TestCase):
 
         return None
 
+    def tests_plans_mapping_columns(self):
+        """Tests the plans_mapping_columns method."""
+
+        # create required input resources
+        columns = ['CONCEPT_ID', 'CONCEPT_DBXREF_HP_URI', 'CONCEPT_DBXREF_HP_LABEL', 'CONCEPT_DBXREF_HP_EVIDENCE',
+                   'ANCESTOR_STR_HP_URI', 'ANCESTOR_STR_HP_LABEL', 'ANCESTOR_STR_HP_EVIDENCE', 'CONCEPT_STR_MONDO_URI',
+                   'HP_SIM_ONT_URI', 'HP_SIM_ONT_LABEL', 'HP_SIM_ONT_EVIDENCE']
+
+        # test method
+        results = plans_mapping_columns(columns, 'HP')
+        self.assertIsInstance(results, Dict)
+        self.assertEqual(results['CONCEPT'], ([1], [2], [3]))
+        self.assertEqual(results['ANCESTOR'], ([4], [5], [6]))
+        self.assertEqual(results['SIM'], ([8], [9], [10]))
+
+        # test planned and unplanned rows return the same results
+        data_row = pd.Series({'CONCEPT_ID': '4098595',
+                              'CONCEPT_DBXREF_HP_URI': 'http://purl.obolibrary.org/obo/HP_0008181',
+                              'CONCEPT_DBXREF_HP_LABEL': 'abetalipoproteinemia',
+                              'CONCEPT_DBXREF_HP_EVIDENCE': 'CONCEPT_DBXREF_snomed:190787008',
+                              'HP_SIM_ONT_URI': 'HP_0008181',
+                              'HP_SIM_ONT_LABEL': 'abetalipoproteinemia',
+                              'HP_SIM_ONT_EVIDENCE': 'HP_0008181_1.0'})
+        plan = plans_mapping_columns(list(data_row.keys()), 'HP')
+        self.assertEqual(compiles_mapping_content(data_row.to_numpy(), 'HP', 0.75, plan),
+                         compiles_mapping_content(data_row, 'HP', 0.75))
+
+        return None
+
     def tests_compiles_mapping_content_1(self):
         """Tests the compiles_mapping_content method - round 1."""
 
@@ -481,6 +677,10 @@ class TestDataUtils(unittest.TestCase):
                                      'OBO_LABEL-OMOP_CONCEPT_LABEL:abetalipoproteinemia')
         self.assertEqual(results[1], 'CONCEPT_SIMILARITY:HP_0008181_1.0')
 
+        # test method with precomputed dbxref types
+        dbxref_type = normalizes_clinical_source_codes(ont_dict['dbxref_type'], source_dict)
+        self.assertEqual(formats_mapping_evidence(ont_dict, source_dict, result, clin_data, dbxref_type), results)
+
         return None
 
     def tests_assigns_mapping_category_exact(self):
@@ -525,6 +725,33 @@ class TestDataUtils(unittest.TestCase):
 
         return None
 
+    def tests_compiles_ontology_mappings(self):
+        """Tests the compiles_ontology_mappings method."""
+
+        # set-up inputs
+        data = pd.DataFrame({'CONCEPT_ID': ['4098595', '4098596'],
+                             'CONCEPT_LABEL': ['Abetalipoproteinemia', 'Wet lung'],
+                             'CONCEPT_DBXREF_HP_URI': ['http://purl.obolibrary.org/obo/HP_0008181', ''],
+                             'CONCEPT_DBXREF_HP_LABEL': ['abetalipoproteinemia', ''],
+                             'CONCEPT_DBXREF_HP_EVIDENCE': ['CONCEPT_DBXREF_snomed:190787008', ''],
+                             'HP_SIM_ONT_URI': ['HP_0008181', ''],
+                             'HP_SIM_ONT_LABEL': ['abetalipoproteinemia', ''],
+                             'HP_SIM_ONT_EVIDENCE': ['HP_0008181_1.0', '']})
+
+        # test method
+        exact, sim = compiles_ontology_mappings(data, 'HP', self.ont_data['hp'], self.source_codes,
+                                                ['CONCEPT_LABEL'], 0.25)
+        self.assertEqual(exact.shape, (2, 4))
+        self.assertEqual(sim.shape, (2, 4))
+        self.assertEqual(list(exact[0]), ['HP_0008181', 'abetalipoproteinemia', 'Automatic Exact - Concept',
+                                          'OBO_DbXref-OMOP_CONCEPT_CODE:snomed_190787008'])
+        self.assertEqual(list(sim[0]), ['HP_0008181', 'abetalipoproteinemia', 'Manual Exact - Concept Similarity',
+                                        'CONCEPT_SIMILARITY:HP_0008181_1.0'])
+        self.assertEqual(list(exact[1]), [None] * 4)
+        self.assertEqual(list(sim[1]), [None] * 4)
+
+        return None
+
     def tests_aggregates_mapping_results_full_SimResults(self):
         """Tests the aggregates_mapping_results method when there is similarity data."""
 
@@ -597,3 +824,154 @@ class TestDataUtils(unittest.TestCase):
         self.assertEqual(results.at[0, 'SIMILARITY_HP_EVIDENCE'], None)
 
         return None
+
+    def tests_aggregates_mapping_results_workers(self):
+        """Tests the aggregates_mapping_results method when run with multiple worker processes."""
+
+        # set-up inputs
+        data3 = pd.DataFrame({'CONCEPT_ID': ['4098595', '4098596'],
+                              'CONCEPT_LABEL': ['Abetalipoproteinemia', 'Abetalipoproteinemia'],
+                              'CONCEPT_SOURCE_LABEL': ['Abetalipoproteinemia', ''],
+                              'CONCEPT_SYNONYM': ['Apolipoprotein B deficiency', ''],
+                              'CONCEPT_DBXREF_HP_URI': ['http://purl.obolibrary.org/obo/HP_0008181', ''],
+                              'CONCEPT_DBXREF_HP_LABEL': ['abetalipoproteinemia', ''],
+                              'CONCEPT_DBXREF_HP_EVIDENCE': ['CONCEPT_DBXREF_snomed:190787008', ''],
+                              'CONCEPT_STR_HP_URI': ['http://purl.obolibrary.org/obo/HP_0008181', ''],
+                              'CONCEPT_STR_HP_LABEL': ['abetalipoproteinemia', ''],
+                              'CONCEPT_STR_HP_EVIDENCE': ['CONCEPT_SOURCE_LABEL:abetalipoproteinemia', '']})
+
+        # test method returns the same results for a single and multiple worker processes
+        results1 = aggregates_mapping_results(data3.copy(), ['hp'], self.ont_data, self.source_codes, 0.25)
+        results2 = aggregates_mapping_results(data3.copy(), ['hp'], self.ont_data, self.source_codes, 0.25, 2)
+        self.assertEqual(len(results2), 2)
+        self.assertEqual(results2.at[0, 'AGGREGATED_HP_URI'], 'HP_0008181')
+        self.assertEqual(results2.at[1, 'AGGREGATED_HP_URI'], None)
+        pd.testing.assert_frame_equal(results1, results2)
+
+        return None
+
+    def tests_aggregates_mapping_results_mapping_table(self):
+        """Tests the aggregates_mapping_results method when a long-format mapping table is provided."""
+
+        # set-up inputs
+        data4 = pd.DataFrame({'CONCEPT_ID': ['4098595', '4098596'],
+                              'CONCEPT_LABEL': ['Abetalipoproteinemia', 'Abetalipoproteinemia'],
+                              'CONCEPT_SOURCE_LABEL': ['Abetalipoproteinemia', ''],
+                              'CONCEPT_SYNONYM': ['Apolipoprotein B deficiency', '']})
+        mapping_table = pd.DataFrame({'CONCEPT_ID': ['4098595', '4098595', '4098595'],
+                                      'LEVEL': ['CONCEPT', 'CONCEPT', 'CONCEPT'],
+                                      'SOURCE': ['DBXREF', 'STR', 'SIM'],
+                                      'ONT': ['HP', 'HP', 'HP'],
+                                      'ONT_URI': ['http://purl.obolibrary.org/obo/HP_0008181',
+                                                  'http://purl.obolibrary.org/obo/HP_0008181', 'HP_0008181'],
+                                      'ONT_LABEL': ['abetalipoproteinemia', 'abetalipoproteinemia',
+                                                    'abetalipoproteinemia'],
+                                      'EVIDENCE': ['CONCEPT_DBXREF_snomed:190787008',
+                                                   'CONCEPT_SOURCE_LABEL:abetalipoproteinemia', None],
+                                      'SCORE': [None, None, 1.0]})
+
+        # test method returns the same results as the pipe-delimited mapping columns
+        wide_data = pd.merge(data4, renders_mapping_table(mapping_table, 'CONCEPT_ID'), how='left', on='CONCEPT_ID')
+        results1 = aggregates_mapping_results(wide_data.fillna(''), ['hp'], self.ont_data, self.source_codes, 0.25)
+        results2 = aggregates_mapping_results(data4.copy(), ['hp'], self.ont_data, self.source_codes, 0.25, 1,
+                                              mapping_table, 'CONCEPT_ID')
+        self.assertEqual(results2.at[0, 'AGGREGATED_HP_URI'], 'HP_0008181')
+        self.assertEqual(results2.at[0, 'AGGREGATED_HP_EVIDENCE'], 'OBO_DbXref-OMOP_CONCEPT_CODE:snomed_190787008 | '
+                                                                   'OBO_LABEL-OMOP_CONCEPT_LABEL:abetalipoproteinemia')
+        self.assertEqual(results2.at[0, 'SIMILARITY_HP_EVIDENCE'], 'CONCEPT_SIMILARITY:HP_0008181_1.0')
+        self.assertEqual(results2.at[1, 'AGGREGATED_HP_URI'], None)
+        pd.testing.assert_frame_equal(results1[results2.columns], results2)
+
+        # test method raises an error when the primary key is missing
+        self.assertRaises(ValueError, aggregates_mapping_results, data4.copy(), ['hp'], self.ont_data,
+                          self.source_codes, 0.25, 1, mapping_table)
+
+        return None
+
+    def tests_aggregates_mapping_results_mapping_table_scores(self):
+        """Tests the aggregates_mapping_results method filters similarity results on the scores of a mapping table."""
+
+        # set-up inputs
+        data6 = pd.DataFrame({'CONCEPT_ID': ['1', '2', '3'], 'CONCEPT_LABEL': ['Abetalipoproteinemia'] * 3,
+                              'CONCEPT_SYNONYM': [''] * 3})
+        mapping_table = pd.DataFrame({'CONCEPT_ID': ['1', '1', '2', '2', '3'], 'LEVEL': ['CONCEPT'] * 5,
+                                      'SOURCE': ['SIM'] * 5, 'ONT': ['HP'] * 5,
+                                      'ONT_URI': ['HP_0008181', 'HP_0000001', 'HP_0008181', 'HP_0000001',
+                                                  'HP_0000001'],
+                                      'ONT_LABEL': ['abetalipoproteinemia', 'all'] * 2 + ['all'],
+                                      'EVIDENCE': [None] * 5,
+                                      'SCORE': np.array([0.5, 0.1, 1.0, 0.8, 0.1], dtype=np.float32)})
+
+        # test exact matches are kept over matches above the threshold, which are kept over the remaining matches
+        results = aggregates_mapping_results(data6.copy(), ['hp'], self.ont_data, self.source_codes, 0.25, 1,
+                                             mapping_table, 'CONCEPT_ID')
+        self.assertEqual(list(results['SIMILARITY_HP_EVIDENCE']),
+                         ['CONCEPT_SIMILARITY:HP_0008181_0.5', 'CONCEPT_SIMILARITY:HP_0008181_1.0',
+                          'CONCEPT_SIMILARITY:HP_0000001_0.1'])
+
+        return None
+
+    def tests_aggregates_mapping_results_similarity_directory(self):
+        """Tests the aggregates_mapping_results method when similarity scores are read from a directory."""
+
+        # set-up inputs
+        directory = tempfile.mkdtemp()
+        data7 = pd.DataFrame({'CONCEPT_ID': ['1', '2', '3', '4'], 'CONCEPT_LABEL': ['Abetalipoproteinemia'] * 4,
+                              'CONCEPT_SYNONYM': [''] * 4})
+        exact_table = pd.DataFrame({'CONCEPT_ID': ['1', '4'], 'LEVEL': ['CONCEPT'] * 2, 'SOURCE': ['STR'] * 2,
+                                    'ONT': ['HP'] * 2, 'ONT_URI': ['http://purl.obolibrary.org/obo/HP_0008181'] * 2,
+                                    'ONT_LABEL': ['abetalipoproteinemia'] * 2,
+                                    'EVIDENCE': ['CONCEPT_LABEL:abetalipoproteinemia'] * 2, 'SCORE': [None] * 2})
+        sim_table = pd.DataFrame({'CONCEPT_ID': ['1', '1', '2', '3'], 'LEVEL': ['CONCEPT'] * 4,
+                                  'SOURCE': ['SIM'] * 4, 'ONT': ['HP'] * 4,
+                                  'ONT_URI': ['HP_0008181', 'HP_0000001', 'HP_0008181', 'HP_0000001'],
+                                  'ONT_LABEL': ['abetalipoproteinemia', 'all', 'abetalipoproteinemia', 'all'],
+                                  'EVIDENCE': [None] * 4,
+                                  'SCORE': np.array([1.0, 0.5, 0.8, 0.1], dtype=np.float32)})
+        writes_partitioned_data(sim_table.iloc[0:3], directory, 'ONT', 0)
+        writes_partitioned_data(sim_table.iloc[3:], directory, 'ONT', 1)
+
+        # test reading the scores one part at a time returns the same results as the complete mapping table merged
+        # with the rendered similarity columns
+        mapping_table = pd.concat([exact_table, sim_table], ignore_index=True)
+        data8 = data7.merge(renders_mapping_table(sim_table, 'CONCEPT_ID'), how='left', on='CONCEPT_ID').fillna('')
+        results1 = aggregates_mapping_results(data8, ['hp'], self.ont_data, self.source_codes, 0.25, 1,
+                                              mapping_table, 'CONCEPT_ID')
+        results2 = aggregates_mapping_results(data7.copy(), ['hp'], self.ont_data, self.source_codes, 0.25, 1,
+                                              exact_table, 'CONCEPT_ID', similarity_directory=directory)
+        pd.testing.assert_frame_equal(results1, results2)
+        self.assertEqual(list(results2['HP_SIM_ONT_URI']), ['HP_0008181 | HP_0000001', 'HP_0008181', 'HP_0000001', ''])
+        self.assertEqual(list(results2['HP_SIM_ONT_EVIDENCE'])[1], 'HP_0008181_0.8')
+        self.assertEqual(list(results2['SIMILARITY_HP_URI']), ['HP_0008181', 'HP_0008181', 'HP_0000001', None])
+        self.assertEqual(list(results2['AGGREGATED_HP_URI']), ['HP_0008181', None, None, 'HP_0008181'])
+
+        # test method raises an error when the mapping table is missing
+        self.assertRaises(ValueError, aggregates_mapping_results, data7.copy(), ['hp'], self.ont_data,
+                          self.source_codes, 0.25, 1, None, 'CONCEPT_ID', 32500, directory)
+
+        shutil.rmtree(directory)
+
+        return None
+
+    def tests_aggregates_mapping_results_size_limit(self):
+        """Tests the aggregates_mapping_results method when shortening long text fields."""
+
+        # set-up inputs
+        data5 = pd.DataFrame({'CONCEPT_ID': ['4098595', '4098596'],
+                              'CONCEPT_LABEL': ['Abetalipoproteinemia' * 2000, None],
+                              'CONCEPT_SYNONYM': ['Apolipoprotein B deficiency', ''],
+                              'CONCEPT_COUNT': [1, 2]})
+
+        # test method shortens long text fields by default
+        results = aggregates_mapping_results(data5.copy(), ['hp'], self.ont_data, self.source_codes, 0.25)
+        self.assertEqual(results.at[0, 'CONCEPT_LABEL'], ('Abetalipoproteinemia' * 2000)[0:32500])
+        self.assertEqual(results.at[1, 'CONCEPT_LABEL'], None)
+        self.assertEqual(results.at[0, 'CONCEPT_SYNONYM'], 'Apolipoprotein B deficiency')
+        self.assertEqual(list(results['CONCEPT_COUNT']), [1, 2])
+
+        # test method does not shorten text fields when size_limit is None
+        results = aggregates_mapping_results(data5.copy(), ['hp'], self.ont_data, self.source_codes, 0.25,
+                                             size_limit=None)
+        self.assertEqual(results.at[0, 'CONCEPT_LABEL'], 'Abetalipoproteinemia' * 2000)
+
+        return None
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd  # type: ignore
+
+from omop2obo.utils import writes_mapping_results
+
+
+class TestN3CMappingConversion(unittest.TestCase):
+    """Class to test the N3C mapping conversion application."""
+
+    def setUp(self):
+        # load the application, which is a script and not part of the package
+        app_file = os.path.join(os.path.dirname(__file__), '..', 'applications', 'N3C', 'n3c_mapping_conversion.py')
+        spec = importlib.util.spec_from_file_location('n3c_mapping_conversion', app_file)
+        self.n3c = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.n3c)
+
+        # create a temporary directory and mapping results
+        self.directory = tempfile.mkdtemp()
+        self.data = pd.DataFrame({'CONCEPT_ID': [4331309, 37018594, 442793],
+                                  'CONCEPT_LABEL': ['Myocardial disease', 'Complement deficiency', 'Diabetes'],
+                                  'AGGREGATED_HP_URI': ['HP_0001638', '', 'HP_0000819'],
+                                  'AGGREGATED_MONDO_URI': ['MONDO_0004994', 'MONDO_0004979', '']})
+
+        return None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+        return None
+
+    def test_reads_mapping_data_csv(self):
+        """Tests the reads_mapping_data method with a CSV file."""
+
+        file_path = os.path.join(self.directory, 'mappings.csv')
+        writes_mapping_results(self.data, file_path, 'csv')
+        results = self.n3c.reads_mapping_data(file_path, sheet_name='OMOP2OBO_HPO_Mapping_Results')
+        pd.testing.assert_frame_equal(results.fillna(''), self.data)
+
+        return None
+
+    def test_reads_mapping_data_partitioned(self):
+        """Tests the reads_mapping_data method with CSV files partitioned by ontology."""
+
+        file_path = os.path.join(self.directory, 'partitioned')
+        writes_mapping_results(self.data, file_path, 'csv', onts=['hp', 'mondo'])
+        self.assertEqual(sorted(os.listdir(file_path)), ['ONT=HP', 'ONT=MONDO'])
+        results = self.n3c.reads_mapping_data(file_path, sheet_name='OMOP2OBO_HPO_Mapping_Results')
+        pd.testing.assert_frame_equal(results.fillna(''), self.data)
+
+        # test partitions with rows in a different order are joined on the clinical columns
+        mondo_file = os.path.join(file_path, 'ONT=MONDO', 'part-00000.csv')
+        pd.read_csv(mondo_file).iloc[::-1].to_csv(mondo_file, index=False)
+        results = self.n3c.reads_mapping_data(file_path, sheet_name='OMOP2OBO_HPO_Mapping_Results')
+        pd.testing.assert_frame_equal(results.fillna(''), self.data)
+
+        return None
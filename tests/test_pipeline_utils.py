@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pandas as pd  # type: ignore
+
+from omop2obo.utils import *
+
+
+class TestPipelineUtils(unittest.TestCase):
+    """Class to test pipeline utility methods."""
+
+    def setUp(self):
+        # create a temporary directory, an input file, and a record of the stages that are run
+        self.temp_dir = tempfile.mkdtemp()
+        self.checkpoint_directory = os.path.join(self.temp_dir, 'checkpoints')
+        self.input_file = os.path.join(self.temp_dir, 'clinical_data.csv')
+        with open(self.input_file, 'w') as handle:
+            handle.write('CONCEPT_ID\n4331309\n')
+        self.ran = []
+
+        return None
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+        return None
+
+    def creates_pipeline(self, n_workers=None):
+        pipeline = PipelineRunner(self.checkpoint_directory, n_workers)
+        pipeline.adds_stage('ontologies', lambda: self.ran.append('ontologies') or ['HP'], inputs=['HP'])
+        pipeline.adds_stage('exact_mapping', lambda x: self.ran.append('exact_mapping') or x + ['exact'],
+                            depends_on=['ontologies'], inputs=[self.input_file])
+        pipeline.adds_stage('similarity_mapping', lambda x: self.ran.append('similarity_mapping') or x + ['sim'],
+                            depends_on=['ontologies'], inputs=[self.input_file, 'word'])
+        pipeline.adds_stage('merged_mapping', lambda x, y: self.ran.append('merged_mapping') or x + y,
+                            depends_on=['exact_mapping', 'similarity_mapping'])
+
+        return pipeline
+
+    def test_hashes_inputs(self):
+        """Tests the hashes_inputs method."""
+
+        file_hash = hashes_inputs([self.input_file, 'HP'])
+        self.assertEqual(file_hash, hashes_inputs([self.input_file, 'HP']))
+        self.assertNotEqual(file_hash, hashes_inputs([self.input_file, 'MONDO']))
+
+        # test files are hashed by their content
+        with open(self.input_file, 'a') as handle:
+            handle.write('37018594\n')
+        self.assertNotEqual(file_hash, hashes_inputs([self.input_file, 'HP']))
+
+        return None
+
+    def test_pipeline_runner(self):
+        """Tests the PipelineRunner class."""
+
+        results = self.creates_pipeline().runs()
+        self.assertEqual(results['merged_mapping'], ['HP', 'exact', 'HP', 'sim'])
+        self.assertEqual(sorted(self.ran), ['exact_mapping', 'merged_mapping', 'ontologies', 'similarity_mapping'])
+        self.assertEqual(len(os.listdir(self.checkpoint_directory)), 4)
+
+        # test a re-run only loads the target stage
+        self.ran = []
+        pipeline = self.creates_pipeline()
+        self.assertEqual(pipeline.runs()['merged_mapping'], ['HP', 'exact', 'HP', 'sim'])
+        self.assertEqual(self.ran, [])
+        self.assertEqual(pipeline.completed, {'merged_mapping': 'loaded'})
+
+        # test changing an input file re-runs the stages downstream of it and replaces their checkpoints
+        with open(self.input_file, 'a') as handle:
+            handle.write('37018594\n')
+        pipeline = self.creates_pipeline()
+        pipeline.runs()
+        self.assertEqual(sorted(self.ran), ['exact_mapping', 'merged_mapping', 'similarity_mapping'])
+        self.assertEqual(pipeline.completed['ontologies'], 'loaded')
+        self.assertEqual(len(os.listdir(self.checkpoint_directory)), 4)
+
+        # test bad input
+        self.assertRaises(ValueError, pipeline.adds_stage, 'ontologies', list)
+        self.assertRaises(ValueError, pipeline.adds_stage, 'aggregation', list, ['unknown'])
+        self.assertRaises(ValueError, PipelineRunner, None, 0)
+
+        return None
+
+    def test_pipeline_runner_failure(self):
+        """Tests the PipelineRunner class when a stage fails."""
+
+        pipeline = self.creates_pipeline()
+        pipeline.adds_stage('aggregation', lambda x: 1 / 0, depends_on=['merged_mapping'])
+        self.assertRaises(ZeroDivisionError, pipeline.runs)
+
+        # test the completed stages are loaded when the pipeline is resumed
+        self.ran = []
+        pipeline = self.creates_pipeline()
+        pipeline.adds_stage('aggregation', lambda x: len(x), depends_on=['merged_mapping'])
+        self.assertEqual(pipeline.runs()['aggregation'], 4)
+        self.assertEqual(self.ran, [])
+
+        return None
+
+    def test_pipeline_runner_data_frames(self):
+        """Tests the PipelineRunner class checkpoints the DataFrames in the output of a stage."""
+
+        mappings = pd.DataFrame({'CONCEPT_ID': ['4331309', '37018594'], 'HP_URI': ['HP_0008181', None]})
+        mixed = pd.DataFrame({'CONCEPT_ID': ['4331309', 37018594]})
+
+        def creates_frame_pipeline(ont):
+            pipeline = PipelineRunner(self.checkpoint_directory)
+            pipeline.adds_stage('exact_mapping', lambda: (mappings, mixed, {'4331309': 'HP_0008181'}), inputs=[ont])
+            pipeline.adds_stage('aggregated_mapping', lambda x: x[0].set_index('CONCEPT_ID'),
+                                depends_on=['exact_mapping'])
+
+            return pipeline
+
+        creates_frame_pipeline('HP').runs()
+
+        # test the DataFrames that can be written to Parquet are, when pyarrow is installed, and the rest is pickled
+        files = os.listdir(self.checkpoint_directory)
+        n_parquet = 0 if importlib.util.find_spec('pyarrow') is None else 2
+        self.assertEqual(len([x for x in files if x.endswith('.parquet')]), n_parquet)
+        self.assertEqual(len([x for x in files if x.endswith('.pickle')]), 2)
+
+        # test the outputs loaded from the checkpoints are the same as the outputs of the stages
+        pipeline = creates_frame_pipeline('HP')
+        results = pipeline.runs(['exact_mapping', 'aggregated_mapping'])
+        self.assertEqual(pipeline.completed, {'exact_mapping': 'loaded', 'aggregated_mapping': 'loaded'})
+        pd.testing.assert_frame_equal(results['exact_mapping'][0], mappings)
+        pd.testing.assert_frame_equal(results['exact_mapping'][1], mixed)
+        self.assertEqual(results['exact_mapping'][2], {'4331309': 'HP_0008181'})
+        pd.testing.assert_frame_equal(results['aggregated_mapping'], mappings.set_index('CONCEPT_ID'))
+
+        # test the Parquet files of a stage are replaced with its checkpoint when its inputs change
+        creates_frame_pipeline('MONDO').runs()
+        self.assertEqual(len(os.listdir(self.checkpoint_directory)), len(files))
+        self.assertEqual(len(set(os.listdir(self.checkpoint_directory)) & set(files)), 0)
+
+        return None
+
+    def test_pipeline_runner_concurrency(self):
+        """Tests the PipelineRunner class runs stages that do not depend on each other at the same time."""
+
+        # the stages can only pass the barrier if they are running at the same time
+        barrier = threading.Barrier(2, timeout=10)
+        pipeline = PipelineRunner()
+        pipeline.adds_stage('exact_mapping', lambda: barrier.wait() >= 0)
+        pipeline.adds_stage('similarity_mapping', lambda: barrier.wait() >= 0)
+        self.assertEqual(pipeline.runs(), {'exact_mapping': True, 'similarity_mapping': True})
+
+        # test stages run one at a time when n_workers is 1
+        pipeline.n_workers, barrier = 1, threading.Barrier(2, timeout=0.1)
+        self.assertRaises(threading.BrokenBarrierError, pipeline.runs)
+
+        return None
+
+    @unittest.skipIf('fork' not in multiprocessing.get_all_start_methods(), 'lambda stages need forked processes')
+    def test_pipeline_runner_process(self):
+        """Tests the PipelineRunner class when stages are run in separate processes."""
+
+        # the stages can only pass the barrier if they are running at the same time
+        barrier = multiprocessing.get_context('fork').Barrier(2, timeout=10)
+        pipeline = self.creates_pipeline()
+        pipeline.stages['exact_mapping']['process'] = pipeline.stages['similarity_mapping']['process'] = True
+        pipeline.stages['exact_mapping']['function'] = lambda x: [barrier.wait() >= 0, os.getpid()] + x
+        pipeline.stages['similarity_mapping']['function'] = lambda x: [barrier.wait() >= 0, os.getpid()] + x
+        results = pipeline.runs()
+
+        # test the stages ran in two other processes and their outputs were merged and checkpointed
+        exact, similarity = results['exact_mapping'], results['similarity_mapping']
+        self.assertEqual([exact[0], exact[2:], similarity[0], similarity[2:]], [True, ['HP'], True, ['HP']])
+        self.assertEqual(len({os.getpid(), exact[1], similarity[1]}), 3)
+        self.assertEqual(results['merged_mapping'], exact + similarity)
+        self.assertEqual(len(os.listdir(self.checkpoint_directory)), 4)
+
+        # test errors raised in a process are raised by the pipeline
+        pipeline = PipelineRunner()
+        pipeline.adds_stage('exact_mapping', lambda: 1 / 0, process=True)
+        self.assertRaises(ZeroDivisionError, pipeline.runs)
+
+        return None
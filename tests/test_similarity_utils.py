@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import unittest
+
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import linear_kernel
+
+from omop2obo.utils import *
+
+
+class TestSimilarityUtils(unittest.TestCase):
+    """Class to test similarity utility methods."""
+
+    def setUp(self):
+        # create a small TF-IDF matrix of clinical and ontology strings
+        clinical = ['fracture of nose', 'chronic kidney failure', 'skin eczema', 'wet lung']
+        ontology = ['nose fracture', 'fracture', 'kidney failure', 'chronic kidney disease', 'eczema', 'atopic eczema',
+                    'lung disorder', 'heart valve disease', 'kidney failure']
+        matrix = TfidfVectorizer(ngram_range=(1, 3)).fit_transform(clinical + ontology)
+        self.query_matrix = matrix[0:len(clinical)]
+        self.reference_matrix = matrix[len(clinical):]
+
+        return None
+
+    def test_finds_top_similarities(self):
+        """Tests the finds_top_similarities method."""
+
+        results = finds_top_similarities(self.query_matrix, self.reference_matrix, 2, block_size=3)
+        dense_scores = linear_kernel(self.query_matrix, self.reference_matrix)
+
+        # test output
+        self.assertIsInstance(results, list)
+        self.assertEqual(len(results), 4)
+        for row, matches in enumerate(results):
+            self.assertTrue(len(matches) <= 2)
+            self.assertIsInstance(matches[0], tuple)
+            # scores match a dense similarity calculation and are sorted
+            expected = sorted(dense_scores[row], reverse=True)[0:len(matches)]
+            self.assertTrue(np.allclose([x[1] for x in matches], expected))
+            for idx, score in matches:
+                self.assertAlmostEqual(dense_scores[row][idx], score)
+
+        # test ties are broken by reference row index
+        self.assertEqual([x[0] for x in results[1]], [2, 8])
+
+        return None
+
+    def test_finds_top_similarities_float32(self):
+        """Tests the finds_top_similarities method with float32 matrices against float64 results."""
+
+        query, reference = self.query_matrix.astype(np.float32), self.reference_matrix.astype(np.float32)
+        results = finds_top_similarities(query, reference, 3, 0.1, reference_groups=[0, 0, 1, 0, 0, 0, 0, 0, 1])
+        expected = finds_top_similarities(self.query_matrix, self.reference_matrix, 3, 0.1,
+                                          reference_groups=[0, 0, 1, 0, 0, 0, 0, 0, 1])
+
+        # test scores are calculated in float32 and match the float64 scores within float32 precision
+        self.assertTrue(all(float(np.float32(x[1])) == x[1] for y in results for x in y))
+        self.assertFalse(all(float(np.float32(x[1])) == x[1] for y in expected for x in y))
+        for matches, expected_matches in zip(results, expected):
+            self.assertEqual(sorted(x[0] for x in matches), sorted(x[0] for x in expected_matches))
+            scores = {x[0]: x[1] for x in expected_matches}
+            self.assertTrue(np.allclose([x[1] for x in matches], [scores[x[0]] for x in matches], atol=1e-6))
+
+        return None
+
+    def test_finds_top_similarities_min_score(self):
+        """Tests the finds_top_similarities method when a minimum score is provided."""
+
+        results = finds_top_similarities(self.query_matrix, self.reference_matrix, 10, min_score=0.25)
+        dense_scores = linear_kernel(self.query_matrix, self.reference_matrix)
+
+        # test output
+        for row, matches in enumerate(results):
+            self.assertTrue(all(x[1] >= 0.25 for x in matches))
+            self.assertEqual(len(matches), sum(dense_scores[row] >= 0.25))
+
+        # test zero-scoring reference rows are never returned
+        results = finds_top_similarities(self.query_matrix, self.reference_matrix, 20)
+        self.assertTrue(all(x[1] > 0 for y in results for x in y))
+
+        return None
+
+    def test_finds_top_similarities_errors(self):
+        """Tests the finds_top_similarities method when the matrices do not have the same number of columns."""
+
+        self.assertRaises(ValueError, finds_top_similarities, self.query_matrix, sparse.csr_matrix((2, 3)), 10)
+
+        return None
+
+    def test_streams_top_similarities(self):
+        """Tests the streams_top_similarities method."""
+
+        results = finds_top_similarities(self.query_matrix, self.reference_matrix, 3, 0.1)
+
+        # test blocks are yielded in query row order
+        blocks = list(streams_top_similarities(self.query_matrix, self.reference_matrix, 3, 0.1, block_size=3))
+        self.assertEqual([len(x) for x in blocks], [3, 1])
+        self.assertEqual([x for y in blocks for x in y], results)
+
+        # test blocks scored in parallel match blocks scored serially
+        blocks = list(streams_top_similarities(self.query_matrix, self.reference_matrix, 3, 0.1, 1, n_jobs=3))
+        self.assertEqual(len(blocks), 4)
+        self.assertEqual([x for y in blocks for x in y], results)
+
+        # test bad block_size and n_jobs values
+        self.assertRaises(ValueError, list, streams_top_similarities(self.query_matrix, self.reference_matrix, 3,
+                                                                     block_size=0))
+        self.assertRaises(ValueError, list, streams_top_similarities(self.query_matrix, self.reference_matrix, 3,
+                                                                     n_jobs=0))
+
+        return None
+
+    def test_finds_top_similarities_reference_groups(self):
+        """Tests the finds_top_similarities method when reference rows are grouped."""
+
+        groups = ['A', 'A', 'B', 'A', 'A', 'A', 'A', 'A', 'B']
+        results = finds_top_similarities(self.query_matrix, self.reference_matrix, 1, 0.1, reference_groups=groups)
+        dense_scores = linear_kernel(self.query_matrix, self.reference_matrix)
+
+        # test the top_n matches are kept for each group
+        for row, matches in enumerate(results):
+            for group in set(groups):
+                rows = [i for i, x in enumerate(groups) if x == group]
+                expected = [i for i in rows if dense_scores[row][i] >= 0.1]
+                group_matches = [x for x in matches if groups[x[0]] == group]
+                self.assertEqual(len(group_matches), min(len(expected), 1))
+                if len(expected) > 0:
+                    self.assertAlmostEqual(group_matches[0][1], max(dense_scores[row][expected]))
+
+        # test matches for each row are ordered by group
+        self.assertEqual([groups[x[0]] for x in results[1]], ['A', 'B'])
+
+        # test bad reference_groups
+        self.assertRaises(ValueError, finds_top_similarities, self.query_matrix, self.reference_matrix, 1,
+                          reference_groups=['A'])
+
+        return None
+
+    def test_computes_minhash_signatures(self):
+        """Tests the computes_minhash_signatures method."""
+
+        matrix = sparse.vstack([self.reference_matrix[[2, 8]], sparse.csr_matrix((1, self.reference_matrix.shape[1]))])
+        signatures = computes_minhash_signatures(matrix, num_perm=16, block_size=2)
+
+        # test output
+        self.assertEqual(signatures.shape, (3, 16))
+        self.assertTrue(np.array_equal(signatures[0], signatures[1]))  # identical strings have identical signatures
+        self.assertTrue(np.all(signatures[2] == 1 << 32))  # rows without features
+        self.assertTrue(np.array_equal(signatures, computes_minhash_signatures(matrix, num_perm=16)))
+
+        return None
+
+    def test_finds_approximate_similarities(self):
+        """Tests the finds_approximate_similarities method."""
+
+        exact = finds_top_similarities(self.query_matrix, self.reference_matrix, 3, 0.1)
+        dense_scores = linear_kernel(self.query_matrix, self.reference_matrix)
+
+        # test output with a high recall setting
+        results = finds_approximate_similarities(self.query_matrix, self.reference_matrix, 3, 0.1, 64, 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(measures_recall(exact, results), 1.0)
+        for row, matches in enumerate(results):  # returned scores are exact
+            for idx, score in matches:
+                self.assertAlmostEqual(dense_scores[row][idx], score)
+
+        # test a re-used index and reference_groups
+        index = builds_minhash_index(self.reference_matrix, 64, 1)
+        self.assertEqual(finds_approximate_similarities(self.query_matrix, self.reference_matrix, 3, 0.1, index=index),
+                         results)
+        groups = ['A', 'A', 'B', 'A', 'A', 'A', 'A', 'A', 'B']
+        results = finds_approximate_similarities(self.query_matrix, self.reference_matrix, 1, 0.1, index=index,
+                                                 reference_groups=groups)
+        self.assertEqual(results, finds_top_similarities(self.query_matrix, self.reference_matrix, 1, 0.1,
+                                                         reference_groups=groups))
+
+        # test bad input
+        self.assertRaises(ValueError, finds_approximate_similarities, self.query_matrix, sparse.csr_matrix((2, 3)), 3)
+        self.assertRaises(ValueError, finds_approximate_similarities, self.query_matrix, self.reference_matrix, 3,
+                          bands=0)
+        self.assertRaises(ValueError, finds_approximate_similarities, self.query_matrix, self.reference_matrix[0:2], 3,
+                          index=index)
+
+        return None
+
+    def test_measures_recall(self):
+        """Tests the measures_recall method."""
+
+        exact = [[(0, 0.9), (1, 0.5)], [(2, 0.4)]]
+        self.assertEqual(measures_recall(exact, exact), 1.0)
+        self.assertEqual(measures_recall(exact, [[(0, 0.9)], []]), 1 / 3)
+        self.assertEqual(measures_recall([[], []], [[(0, 0.9)], []]), 1.0)
+
+        return None
+
+    def test_builds_inverted_index(self):
+        """Tests the builds_inverted_index method."""
+
+        index = builds_inverted_index(self.reference_matrix)
+        self.assertEqual(index.shape, (self.reference_matrix.shape[1], self.reference_matrix.shape[0]))
+        self.assertEqual((index != self.reference_matrix.T).nnz, 0)
+
+        # test low idf features are removed
+        df = np.diff(self.reference_matrix.tocsc().indptr)
+        idf = np.log((1 + 9) / (1 + df)) + 1
+        pruned = builds_inverted_index(self.reference_matrix, min_idf=np.median(idf[df > 0]))
+        self.assertTrue(pruned.nnz < index.nnz)
+        self.assertEqual(set(np.flatnonzero(np.diff(pruned.indptr) > 0)),
+                         set(np.flatnonzero((idf >= np.median(idf[df > 0])) & (df > 0))))
+
+        return None
+
+    def test_finds_top_similarities_min_idf(self):
+        """Tests the finds_top_similarities method when candidates are found with a pruned inverted index."""
+
+        exact = finds_top_similarities(self.query_matrix, self.reference_matrix, 3)
+        dense_scores = linear_kernel(self.query_matrix, self.reference_matrix)
+
+        # test a min_idf that keeps all features returns the exact results
+        self.assertEqual(finds_top_similarities(self.query_matrix, self.reference_matrix, 3, min_idf=0.0), exact)
+
+        # test a min_idf that removes features only returns exact scores
+        results = finds_top_similarities(self.query_matrix, self.reference_matrix, 3, min_idf=2.0, block_size=2)
+        self.assertEqual(len(results), 4)
+        for row, matches in enumerate(results):
+            for idx, score in matches:
+                self.assertAlmostEqual(dense_scores[row][idx], score)
+
+        return None
+
+    def test_streams_top_similarities_min_idf_block_size(self):
+        """Tests the streams_top_similarities method returns the same pruned matches for any block_size."""
+
+        # "disease" and "of" are below min_idf, so "heart disease" only has "disease of heart" as a candidate, while
+        # "lung kidney" has every string sharing "lung" or "kidney" as a candidate
+        vectorizer = TfidfVectorizer().fit(['heart disease', 'lung kidney'])
+        query_matrix = vectorizer.transform(['heart disease', 'lung kidney'])
+        reference_matrix = vectorizer.transform(['disease of kidney', 'disease of heart', 'disease of lung',
+                                                 'rare kidney', 'disease of skin'])
+        single = [x for block in streams_top_similarities(query_matrix, reference_matrix, 9, block_size=1,
+                                                          min_idf=1.5) for x in block]
+        large = [x for block in streams_top_similarities(query_matrix, reference_matrix, 9, block_size=100,
+                                                         min_idf=1.5) for x in block]
+        self.assertEqual(single, large)
+        self.assertEqual([x[0] for x in large[0]], [1])
+
+        return None
@@ -4,14 +4,18 @@
 import os.path
 import nltk
 import numpy as np
+import pandas as pd
 import pickle
+import shutil
+import tempfile
 import warnings
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from typing import Dict, List, Tuple
 from unittest import TestCase
 
-from omop2obo.string_similarity import SimilarStringFinder
+from omop2obo.string_similarity import preprocessing_version, SimilarStringFinder
+from omop2obo.utils import finds_approximate_similarities, finds_top_similarities, measures_recall, TokenCache
 
 # download stopwords data from NLTK
 nltk.download('wordnet')
@@ -209,3 +213,360 @@ class TestSimilarStringFinder(TestCase):
                                                  'MONDO_SIM_ONT_EVIDENCE'])
 
         return None
+
+
+class TestSimilarStringFinderCorpus(TestCase):
+    """Class to test functions used when performing string similarity on a small clinical and ontology corpus."""
+
+    def setUp(self):
+
+        # disable warning
+        warnings.filterwarnings('ignore')
+
+        current_directory = os.path.dirname(__file__)
+        dir_loc = os.path.join(current_directory, 'data')
+        self.dir_loc = os.path.abspath(dir_loc)
+        self.directory = tempfile.mkdtemp()
+
+        # read in the sample clinical and ontology corpus
+        self.clinical_file = self.dir_loc + '/clinical_data/sample_clinical_corpus.csv'
+        with open(self.dir_loc + '/sample_corpus_ontology_dictionary.pickle', 'rb') as handle:
+            self.ont_dict = pickle.load(handle)
+        handle.close()
+
+        # add clinical_data file input parameters
+        self.primary_key = 'CONCEPT_ID'
+        self.concept_strings = tuple(['CONCEPT_LABEL', 'CONCEPT_SYNONYM'])
+
+        # initialize the class
+        self.similarity_finder = SimilarStringFinder(self.clinical_file, self.ont_dict, self.primary_key,
+                                                     self.concept_strings)
+
+        return None
+
+    def tearDown(self):
+
+        shutil.rmtree(self.directory)
+
+        return None
+
+    def test_text_preprocessor_n_jobs(self):
+        """Test the text_preprocessor method when strings are pre-processed by worker processes."""
+
+        data = pd.DataFrame({'ID': ['1', '2', '3', '4'],
+                             'CODE': ['The Fractures of the Nose', 'fractures of THE nose', 'caf\u00e9-au-lait spots',
+                                      'The Fractures of the Nose']})
+        processed_text = self.similarity_finder.text_preprocessor(data.copy(), 'ID')
+        processed_text_jobs = self.similarity_finder.text_preprocessor(data.copy(), 'ID', n_jobs=2)
+
+        # check output
+        self.assertEqual(processed_text, processed_text_jobs)
+        self.assertEqual(processed_text[0][1], ['the', 'fracture', 'nose'])
+        self.assertEqual(processed_text[1][1], ['fracture', 'the', 'nose'])
+        self.assertEqual(processed_text[2][1], ['caf', 'au', 'lait', 'spot'])
+        self.assertEqual(processed_text[0][1], processed_text[3][1])
+
+        return None
+
+    def test_performs_similarity_search_n_jobs(self):
+        """Test the performs_similarity_search method when the ontology data is pre-processed by worker processes."""
+
+        # run method
+        results = self.similarity_finder.performs_similarity_search()
+        scores = self.similarity_finder.similarity_scores
+        results_jobs = self.similarity_finder.performs_similarity_search(n_jobs=2)
+
+        # test output
+        pd.testing.assert_frame_equal(results, results_jobs)
+        pd.testing.assert_frame_equal(scores, self.similarity_finder.similarity_scores)
+        self.assertEqual(len(results), 7)
+        self.assertEqual(list(results.columns), ['CONCEPT_ID', 'CONCEPT_SOURCE_CODE', 'CONCEPT_LABEL',
+                                                 'CONCEPT_SYNONYM', 'ANCESTOR_SOURCE_CODE', 'ANCESTOR_LABEL',
+                                                 'HP_SIM_ONT_URI', 'HP_SIM_ONT_LABEL', 'HP_SIM_ONT_EVIDENCE',
+                                                 'MONDO_SIM_ONT_URI', 'MONDO_SIM_ONT_LABEL', 'MONDO_SIM_ONT_EVIDENCE'])
+        self.assertEqual(list(results['MONDO_SIM_ONT_URI']), ['MONDO_0000003', 'MONDO_0000001', 'MONDO_0000002',
+                                                              'MONDO_0000004', 'MONDO_0100010', 'MONDO_0002406', ''])
+
+        return None
+
+    def test_performs_similarity_search_float32(self):
+        """Test the performs_similarity_search method builds the TF-IDF matrix and similarity scores in float32."""
+
+        # run method with a vocabulary and with hashed features
+        for n_features in [None, 2 ** 16]:
+            results = self.similarity_finder.performs_similarity_search(n_features=n_features)
+            scores = self.similarity_finder.similarity_scores
+
+            # test output
+            self.assertEqual(self.similarity_finder.matrix.dtype, np.float32)
+            self.assertEqual(scores['SCORE'].dtype, np.float32)
+            self.assertEqual(len(results), 7)
+            self.assertEqual(scores[scores['ONT_URI'] == 'MONDO_0000002']['SCORE'].tolist(), [1.0])
+
+        return None
+
+    def test_corpus_modifier_keys(self):
+        """Test the corpus_modifier method groups identifiers by key in corpus order."""
+
+        corpus = [('123_a', ['x']), ('HP_0000001_b', ['y']), ('123_c', ['z']), ('HP_0000001_b', ['y']),
+                  ('HP_0000002_d', ['w']), ('MONDO_0000001_e', ['v'])]
+        corpus_idx, corpus_enum = self.similarity_finder.corpus_modifier(corpus, ['HP', 'MONDO'])
+
+        # check output
+        self.assertEqual(list(corpus_idx.items()), [('123', ['123_a', '123_c']),
+                                                     ('HP_0000001', ['HP_0000001_b', 'HP_0000001_b']),
+                                                     ('HP_0000002', ['HP_0000002_d']),
+                                                     ('MONDO_0000001', ['MONDO_0000001_e'])])
+        self.assertEqual(list(corpus_enum.items()), [('123_a', [0]), ('HP_0000001_b', [1, 3]), ('123_c', [2]),
+                                                     ('HP_0000002_d', [4]), ('MONDO_0000001_e', [5])])
+
+        # check the ontology corpus is grouped by ontology class
+        ont_corpus = self.similarity_finder.preprocesses_ontology_data()
+        corpus_idx, corpus_enum = self.similarity_finder.corpus_modifier(ont_corpus, ['HP', 'MONDO'])
+        self.assertEqual(sorted(corpus_idx.keys()), ['HP_0000001', 'HP_0000002', 'HP_0000004', 'HP_0000951',
+                                                     'HP_0000964', 'MONDO_0000001', 'MONDO_0000002', 'MONDO_0000003',
+                                                     'MONDO_0000004', 'MONDO_0002081', 'MONDO_0002406',
+                                                     'MONDO_0100010'])
+        self.assertEqual(len(corpus_idx['HP_0000001']), 2)
+        self.assertEqual(sorted(x for y in corpus_enum.values() for x in y), list(range(len(ont_corpus))))
+
+        return None
+
+    def test_filters_matches_best_score(self):
+        """Test the filters_matches method keeps the best score for each uri and sorts the results by score."""
+
+        # set-up the method
+        matches = [[0.2376527813301072, 'MONDO_0023757'], [0.24449752310188258, 'MONDO_0007975'],
+                   [0.32094866776185677, 'MONDO_0023757'], [0.2110089826112492, 'MONDO_0023757']]
+
+        # test the method
+        results = self.similarity_finder.filters_matches(matches, 0)
+        self.assertEqual(results, [['0.321', 'MONDO_0023757'], ['0.244', 'MONDO_0007975']])
+
+        return None
+
+    def test_creates_tfidf_vectorizer(self):
+        """Test the creates_tfidf_vectorizer method."""
+
+        # test the word engine
+        analyzer = self.similarity_finder.creates_tfidf_vectorizer().build_analyzer()
+        self.assertEqual(analyzer(['renal', 'failure']), ['renal', 'failure', 'renal failure'])
+
+        # test the char engine -- trigrams within each token
+        analyzer = self.similarity_finder.creates_tfidf_vectorizer(engine='char').build_analyzer()
+        self.assertEqual(analyzer(['renal']), [' re', 'ren', 'ena', 'nal', 'al '])
+        hashed = self.similarity_finder.creates_tfidf_vectorizer(2 ** 16, engine='char')
+        self.assertEqual(hashed.fit_transform([['renal'], ['renl']]).shape, (2, 2 ** 16))
+
+        # test bad engine
+        self.assertRaises(ValueError, self.similarity_finder.creates_tfidf_vectorizer, engine='jaro')
+
+        return None
+
+    def test_performs_similarity_search_engine(self):
+        """Test the performs_similarity_search method when using character n-grams."""
+
+        # test the ontology hash depends on the engine
+        self.assertNotEqual(self.similarity_finder.hashes_ontology_data(),
+                            self.similarity_finder.hashes_ontology_data(engine='char'))
+
+        # run method
+        word_results = self.similarity_finder.performs_similarity_search()
+        results = self.similarity_finder.performs_similarity_search(engine='char')
+
+        # test output
+        self.assertTrue(len(results) == 7)
+        self.assertTrue(len(results.columns) == 12)
+        self.assertTrue(all(self.similarity_finder.similarity_scores['SCORE'] >= 0.25))
+
+        # test word endings are matched by the char engine only (i.e. "hypertensive" and "hypertension")
+        self.assertEqual(word_results.at[3, 'HP_SIM_ONT_URI'], '')
+        self.assertEqual(results.at[3, 'HP_SIM_ONT_URI'], 'HP_0000004')
+
+        return None
+
+    def test_performs_similarity_search_model_directory(self):
+        """Test the performs_similarity_search method when the ontology TF-IDF model is persisted."""
+
+        model_directory = tempfile.mkdtemp()
+        ont_hash = self.similarity_finder.hashes_ontology_data()
+
+        # run method and test the model is saved
+        results = self.similarity_finder.performs_similarity_search(model_directory=model_directory)
+        self.assertTrue(os.path.exists(model_directory + '/tfidf_model_{}.pickle'.format(ont_hash)))
+        self.assertTrue(os.path.exists(model_directory + '/tfidf_matrix_{}.npz'.format(ont_hash)))
+        self.assertTrue(len(results) == 7)
+        self.assertTrue(len(results.columns) == 12)
+
+        # run method again and test the saved model is re-used
+        self.similarity_finder.preprocesses_ontology_data = None
+        cached_results = self.similarity_finder.performs_similarity_search(model_directory=model_directory)
+        pd.testing.assert_frame_equal(results, cached_results)
+
+        # test a model with different TF-IDF settings is saved separately
+        del self.similarity_finder.preprocesses_ontology_data
+        self.similarity_finder.performs_similarity_search(model_directory=model_directory, n_features=2 ** 16)
+        self.assertEqual(len(os.listdir(model_directory)), 4)
+        self.assertEqual(self.similarity_finder.matrix.shape[1], 2 ** 16)
+
+        shutil.rmtree(model_directory)
+
+        return None
+
+    def test_performs_similarity_search_lsh_bands(self):
+        """Test the performs_similarity_search method when using the approximate MinHash LSH search."""
+
+        # run method
+        exact_results = self.similarity_finder.performs_similarity_search()
+        scores = self.similarity_finder.similarity_scores
+        results = self.similarity_finder.performs_similarity_search(lsh_bands=64)
+
+        # test output
+        self.assertTrue(len(results) == 7)
+        self.assertTrue(len(results.columns) == 12)
+        self.assertTrue(all(self.similarity_finder.similarity_scores['SCORE'] >= 0.25))
+
+        # test the exact matches are found by the approximate search
+        self.assertEqual(list(results['MONDO_SIM_ONT_URI']), list(exact_results['MONDO_SIM_ONT_URI']))
+
+        # test one MinHash value per band returns all exact matches
+        self.similarity_finder.performs_similarity_search(lsh_bands=64, lsh_rows_per_band=1)
+        pd.testing.assert_frame_equal(scores, self.similarity_finder.similarity_scores)
+
+        return None
+
+    def test_performs_similarity_search_lsh_recall(self):
+        """Test the recall of the approximate MinHash LSH search against the exact search."""
+
+        for engine in ['word', 'char']:
+            clinical_corpus = self.similarity_finder.text_preprocessor(
+                self.similarity_finder.clinical_data[[self.primary_key, 'CONCEPT_LABEL']].copy(), self.primary_key)
+            ont_corpus = self.similarity_finder.preprocesses_ontology_data()
+            tf = self.similarity_finder.creates_tfidf_vectorizer(engine=engine)
+            matrix = tf.fit_transform([x[1] for x in clinical_corpus + ont_corpus]).tocsr()
+            clinical_matrix, ont_matrix = matrix[:len(clinical_corpus)], matrix[len(clinical_corpus):]
+            exact = finds_top_similarities(clinical_matrix, ont_matrix, 10, 0.25)
+
+            # test recall with the default number of rows per band and with one row per band
+            recall = measures_recall(exact, finds_approximate_similarities(clinical_matrix, ont_matrix, 10, 0.25, 64))
+            self.assertTrue(recall >= 0.9)
+            self.assertEqual(measures_recall(exact, finds_approximate_similarities(clinical_matrix, ont_matrix, 10,
+                                                                                   0.25, 64, 1)), 1.0)
+
+        return None
+
+    def test_performs_similarity_search_n_features(self):
+        """Test the performs_similarity_search method when using hashed TF-IDF features."""
+
+        # test the ontology hash depends on n_features
+        self.assertEqual(self.similarity_finder.hashes_ontology_data(), self.similarity_finder.hashes_ontology_data())
+        self.assertNotEqual(self.similarity_finder.hashes_ontology_data(),
+                            self.similarity_finder.hashes_ontology_data(2 ** 16))
+
+        # run method
+        results = self.similarity_finder.performs_similarity_search(n_features=2 ** 16)
+
+        # test output
+        self.assertTrue(len(results) == 7)
+        self.assertTrue(len(results.columns) == 12)
+        self.assertEqual(self.similarity_finder.matrix.shape[1], 2 ** 16)
+        self.assertEqual(self.similarity_finder.matrix.dtype, np.float32)
+
+        return None
+
+    def test_reports_feature_collisions(self):
+        """Test the reports_feature_collisions method."""
+
+        documents = [x[1] for x in self.similarity_finder.preprocesses_ontology_data()]
+
+        # test output
+        report = self.similarity_finder.reports_feature_collisions(documents, 2 ** 20)
+        self.assertEqual(set(report.keys()), {'n_grams', 'features', 'colliding_n_grams', 'collision_rate'})
+        self.assertTrue(report['features'] <= report['n_grams'])
+
+        # test the n-grams do not collide at the hashed feature sizes used and the top matches are unchanged
+        self.similarity_finder.performs_similarity_search()
+        scores = self.similarity_finder.similarity_scores
+        for n_features in [2 ** 16, 2 ** 18, 2 ** 20]:
+            self.assertEqual(self.similarity_finder.reports_feature_collisions(documents, n_features)['collision_rate'],
+                             0.0)
+            self.similarity_finder.performs_similarity_search(n_features=n_features)
+            pd.testing.assert_frame_equal(scores, self.similarity_finder.similarity_scores)
+
+        # test every n-gram collides when there is only one feature
+        report = self.similarity_finder.reports_feature_collisions(documents, 1)
+        self.assertEqual(report['features'], 1)
+        self.assertEqual(report['collision_rate'], 1.0)
+
+        return None
+
+    def test_scores_tfidf_output_directory(self):
+        """Test the scores_tfidf method when the similarity scores are written to a directory."""
+
+        # set-up method
+        data = self.similarity_finder.clinical_data[[self.primary_key, 'CONCEPT_LABEL']].copy()
+        corpus = self.similarity_finder.text_preprocessor(data, self.primary_key)
+        corpus += self.similarity_finder.preprocesses_ontology_data()
+        tf = self.similarity_finder.creates_tfidf_vectorizer()
+        self.similarity_finder.matrix = tf.fit_transform([x[1] for x in corpus])
+        self.similarity_finder.scores_tfidf(corpus, ['HP', 'MONDO'], 10, 0)
+        scores = self.similarity_finder.similarity_scores
+        output_directory = self.directory + '/similarity_scores'
+
+        # run method with one match per chunk and test only the paths of the written part files are returned
+        streamed = self.similarity_finder.scores_tfidf(corpus, ['HP', 'MONDO'], 10, 0,
+                                                       output_directory=output_directory, flush_size=1)
+        self.assertIsInstance(streamed, list)
+        self.assertEqual(len(streamed), len(scores[[self.primary_key, 'ONT']].drop_duplicates()))
+        self.assertTrue(all(os.path.exists(x) for x in streamed))
+        self.assertEqual(len(self.similarity_finder.similarity_scores), 0)
+        self.assertTrue(os.path.exists(os.path.join(output_directory, 'ONT=HP', 'part-00000.csv')))
+
+        # test the scores are read back with the same columns and types
+        read_scores = self.similarity_finder.reads_similarity_scores(output_directory)
+        sort_cols = [self.primary_key, 'ONT', 'ONT_URI']
+        pd.testing.assert_frame_equal(scores.sort_values(sort_cols).reset_index(drop=True),
+                                      read_scores.sort_values(sort_cols).reset_index(drop=True))
+
+        return None
+
+    def test_renders_similarity_scores(self):
+        """Test the renders_similarity_scores method."""
+
+        # set-up method
+        scores = pd.DataFrame({'CONCEPT_ID': ['4311399', '4311399', '4311399'],
+                               'ONT': ['HP', 'HP', 'MONDO'],
+                               'ONT_URI': ['HP_0002617', 'HP_0001543', 'MONDO_0001273'],
+                               'ONT_LABEL': ['dilatation', 'gastroschisis', 'megacolon'],
+                               'SCORE': np.array([1.0, 0.5123, 0.455], dtype=np.float32)})
+
+        # test method
+        results = self.similarity_finder.renders_similarity_scores(scores, self.primary_key, ['HP', 'MONDO'])
+        self.assertIsInstance(results, pd.DataFrame)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results.at[0, 'HP_SIM_ONT_URI'], 'HP_0002617 | HP_0001543')
+        self.assertEqual(results.at[0, 'HP_SIM_ONT_LABEL'], 'dilatation | gastroschisis')
+        self.assertEqual(results.at[0, 'HP_SIM_ONT_EVIDENCE'], 'HP_0002617_1.0 | HP_0001543_0.512')
+        self.assertEqual(results.at[0, 'MONDO_SIM_ONT_EVIDENCE'], 'MONDO_0001273_0.455')
+
+        return None
+
+    def test_performs_similarity_search_token_cache(self):
+        """Test the performs_similarity_search method when pre-processed strings are cached on disk."""
+
+        token_cache_file = self.directory + '/token_cache'
+
+        # run method and test the cached strings are re-used in the next run
+        results = self.similarity_finder.performs_similarity_search(token_cache_file=token_cache_file)
+        self.assertTrue(self.similarity_finder.token_cache.misses > 0)
+        cached_results = self.similarity_finder.performs_similarity_search(token_cache_file=token_cache_file)
+        self.assertEqual(self.similarity_finder.token_cache.misses, 0)
+        pd.testing.assert_frame_equal(results, cached_results)
+
+        # test strings are keyed by the version of the pre-processing steps
+        with TokenCache(token_cache_file, namespace=preprocessing_version) as token_cache:
+            self.assertIsNotNone(token_cache.gets_tokens(token_cache.hashes_string('Atopic eczema')))
+        with TokenCache(token_cache_file) as token_cache:
+            self.assertIsNone(token_cache.gets_tokens(token_cache.hashes_string('Atopic eczema')))
+
+        return None
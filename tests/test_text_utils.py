@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from omop2obo.utils import *
+
+
+class TestTextUtils(unittest.TestCase):
+    """Class to test text pre-processing utility methods."""
+
+    def setUp(self):
+        # create a temporary directory and a simple pre-processor that records the strings it is called with
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.temp_dir, 'token_cache')
+        self.processed = []
+
+        return None
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+        return None
+
+    def preprocessor(self, strings):
+        self.processed += strings
+
+        return [x.lower().split() for x in strings]
+
+    def test_token_cache_memory(self):
+        """Tests the TokenCache class when only the memory tier is used."""
+
+        cache = TokenCache(max_size=2)
+        results = cache.processes(['Kidney Failure', 'Nose', 'Kidney Failure'], self.preprocessor)
+
+        # test output and in-run de-duplication
+        self.assertEqual(results, [['kidney', 'failure'], ['nose'], ['kidney', 'failure']])
+        self.assertEqual(self.processed, ['Kidney Failure', 'Nose'])
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+        # test cached strings are not processed again and the least recently used string is removed
+        self.assertEqual(cache.processes(['Nose', 'Eczema'], self.preprocessor), [['nose'], ['eczema']])
+        self.assertEqual(self.processed, ['Kidney Failure', 'Nose', 'Eczema'])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.gets_tokens(cache.hashes_string('Kidney Failure')))
+
+        # test bad max_size
+        self.assertRaises(ValueError, TokenCache, max_size=0)
+
+        return None
+
+    def test_token_cache_disk(self):
+        """Tests the TokenCache class when the on-disk tier is used."""
+
+        with TokenCache(self.cache_file) as cache:
+            cache.processes(['Kidney Failure', 'Nose'], self.preprocessor)
+
+        # test strings processed in an earlier run are read from disk
+        with TokenCache(self.cache_file) as cache:
+            results = cache.processes(['Nose', 'Eczema', 'Kidney Failure'], self.preprocessor)
+            self.assertEqual(results, [['nose'], ['eczema'], ['kidney', 'failure']])
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(self.processed, ['Kidney Failure', 'Nose', 'Eczema'])
+
+        return None
+
+    def test_token_cache_namespace(self):
+        """Tests the TokenCache class does not re-use tokens cached under a different namespace."""
+
+        with TokenCache(self.cache_file, namespace='1') as cache:
+            cache.processes(['Kidney Failure', 'Nose'], self.preprocessor)
+            self.assertNotEqual(cache.hashes_string('Nose'), TokenCache(namespace='2').hashes_string('Nose'))
+
+        # test strings cached by another version of the pre-processor are processed again
+        with TokenCache(self.cache_file, namespace='2') as cache:
+            self.assertEqual(cache.processes(['Nose'], self.preprocessor), [['nose']])
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        # test strings cached by the same version are re-used
+        with TokenCache(self.cache_file, namespace='1') as cache:
+            self.assertEqual(cache.processes(['Nose', 'Kidney Failure'], self.preprocessor),
+                             [['nose'], ['kidney', 'failure']])
+            self.assertEqual((cache.hits, cache.misses), (2, 0))
+        self.assertEqual(self.processed, ['Kidney Failure', 'Nose', 'Nose'])
+
+        return None